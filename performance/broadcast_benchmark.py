@@ -0,0 +1,100 @@
+"""Benchmark for WebSocket fan-out with many subscribers attached.
+
+Measures how long the order handlers are held up by publishing one event to N subscribers,
+with the broadcast hub and with the previous sequential `await client.send_json` loop.
+A share of the subscribers is slow (every send takes --slow-send-ms), the rest are fast.
+Also measures the hub with every client subscribed to one of the symbols instead of receiving every update.
+
+Usage: python performance/broadcast_benchmark.py [--subscribers 1000] [--slow-share 0.01] [--events 100]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+
+from broadcast import BroadcastHub, COALESCE, OrderEvent, OrderUpdate  # noqa: E402
+from misc import SUPPORTED_SYMBOLS  # noqa: E402
+
+
+class FakeWebSocket:
+    def __init__(self, send_delay: float):
+        self.send_delay = send_delay
+        self.received = 0
+
+    async def send_text(self, payload: str):
+        if self.send_delay:
+            await asyncio.sleep(self.send_delay)
+        self.received += 1
+
+    async def send_json(self, message: dict):
+        await self.send_text("")
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+def make_clients(subscribers: int, slow_share: float, slow_send: float):
+    slow = int(subscribers * slow_share)
+    return [FakeWebSocket(slow_send if i < slow else 0) for i in range(subscribers)]
+
+
+def order_event(order_id: int) -> dict:
+    return {"order_id": order_id, "status": "PENDING", "symbol": "EURUSD", "quantity": 10,
+            "created_time": time.time(), "executed_time": None}
+
+
+async def bench_hub(clients, events: int, subscribe: bool = False) -> float:
+    hub = BroadcastHub(max_queue_size=1024, policy=COALESCE)
+    for number, client in enumerate(clients):
+        hub.connect(client)
+        if subscribe:
+            hub.subscribe(client, symbols=[SUPPORTED_SYMBOLS[number % len(SUPPORTED_SYMBOLS)]])
+    elapsed = 0.0
+    for order_id in range(events):
+        update = OrderUpdate(order_id, "EURUSD", "PENDING", json.dumps(order_event(order_id)).encode())
+        start = time.perf_counter()
+        hub.publish(OrderEvent([update]))
+        elapsed += time.perf_counter() - start
+        await asyncio.sleep(0)
+    for client in clients:
+        hub.disconnect(client)
+    return elapsed / events
+
+
+async def bench_sequential(clients, events: int) -> float:
+    elapsed = 0.0
+    for order_id in range(events):
+        start = time.perf_counter()
+        for client in clients:
+            await client.send_json(order_event(order_id))
+        elapsed += time.perf_counter() - start
+    return elapsed / events
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--subscribers", type=int, default=1000)
+    parser.add_argument("--slow-share", type=float, default=0.01)
+    parser.add_argument("--slow-send-ms", type=float, default=50)
+    parser.add_argument("--events", type=int, default=100)
+    args = parser.parse_args()
+
+    slow_send = args.slow_send_ms / 1000
+    hub_ms = await bench_hub(make_clients(args.subscribers, args.slow_share, slow_send), args.events) * 1000
+    subscribed_ms = await bench_hub(make_clients(args.subscribers, args.slow_share, slow_send), args.events,
+                                    subscribe=True) * 1000
+    # The sequential loop is as slow as its slowest subscriber, a handful of events is enough to show it
+    sequential_ms = await bench_sequential(make_clients(args.subscribers, args.slow_share, slow_send),
+                                           min(args.events, 5)) * 1000
+    print(f"subscribers: {args.subscribers}, slow: {int(args.subscribers * args.slow_share)}")
+    print(f"broadcast hub publish:   {hub_ms:10.3f} ms per event")
+    print(f"  symbol subscriptions:  {subscribed_ms:10.3f} ms per event")
+    print(f"sequential send loop:    {sequential_ms:10.3f} ms per event")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,283 @@
+"""Load generator for a running server, the Python counterpart of performance_test.js.
+
+Closed-loop workers run a weighted mix of HTTP requests (place, get by ID, list a page, cancel orders) while
+WebSocket subscribers receive the order updates. The report has throughput and latency percentiles per operation
+and the WebSocket delivery rate, as JSON. Operations and orders are drawn from a seeded generator, so runs with the
+same arguments send the same kind of traffic.
+
+Compare a run with an earlier one to catch regressions: the script exits with status 1 if an operation lost more
+than --threshold of its throughput or p99 latency. With --spawn it starts the server of this checkout itself, without
+simulated latency, so runs of different commits measure the server's own cost under the same settings.
+
+Usage: python performance/loadgen.py [--url http://127.0.0.1:8000] [--duration 30] [--concurrency 50]
+                                     [--subscribers 10] [--mix create=4,get=3,list=2,cancel=1] [--seed 1]
+                                     [--spawn] [--output report.json] [--compare baseline.json] [--threshold 0.1]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+import aiohttp
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "server"))
+
+from misc import SUPPORTED_SYMBOLS  # noqa: E402
+
+OPERATIONS = ("create", "get", "list", "cancel")
+# Answers that are part of the workload: cancelling an order that was executed in the meantime is a 400
+EXPECTED_STATUSES = {"create": {201}, "get": {200}, "list": {200}, "cancel": {200, 400}}
+REJECTED_STATUSES = {429, 503}
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    mix = {}
+    for item in spec.split(","):
+        operation, _, weight = item.partition("=")
+        if operation not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"Unknown operation {operation!r}, expected one of {OPERATIONS}")
+        mix[operation] = float(weight or 1)
+    return mix
+
+
+def percentiles(samples: List[float]) -> dict:
+    """Latency summary in milliseconds, nearest-rank percentiles"""
+    if not samples:
+        return {}
+    samples = sorted(samples)
+
+    def rank(p: float) -> float:
+        return samples[min(len(samples) - 1, int(p * len(samples)))] * 1000
+
+    return {"mean": sum(samples) / len(samples) * 1000, "p50": rank(0.5), "p90": rank(0.9), "p99": rank(0.99),
+            "max": samples[-1] * 1000}
+
+
+class OperationStats:
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.errors = 0
+        self.rejected = 0
+
+    def report(self, duration: float) -> dict:
+        return {"requests": len(self.latencies), "errors": self.errors, "rejected": self.rejected,
+                "throughput": len(self.latencies) / duration, "latency_ms": percentiles(self.latencies)}
+
+
+class LoadGenerator:
+    def __init__(self, url: str, mix: Dict[str, float], seed: int):
+        self.url = url.rstrip("/")
+        self.operations = list(mix)
+        self.weights = list(mix.values())
+        self.random = random.Random(seed)
+        self.stats = {operation: OperationStats() for operation in self.operations}
+        self.order_ids: List[int] = []
+        self.pending_ids: List[int] = []
+        self.recording = False
+        self.ws_messages = 0
+        self.ws_delays: List[float] = []
+
+    async def worker(self, session: aiohttp.ClientSession, deadline: float):
+        while time.monotonic() < deadline:
+            operation = self.random.choices(self.operations, self.weights)[0]
+            if operation != "create" and not self.order_ids or operation == "cancel" and not self.pending_ids:
+                operation = "create"
+            stats = self.stats.setdefault(operation, OperationStats())
+            start = time.perf_counter()
+            try:
+                status = await getattr(self, operation)(session)
+            except aiohttp.ClientError:
+                status = None
+            elapsed = time.perf_counter() - start
+            if not self.recording:
+                continue
+            if status in REJECTED_STATUSES:
+                stats.rejected += 1
+            elif status not in EXPECTED_STATUSES[operation]:
+                stats.errors += 1
+            else:
+                stats.latencies.append(elapsed)
+
+    async def create(self, session: aiohttp.ClientSession):
+        order = {"symbol": self.random.choice(SUPPORTED_SYMBOLS), "quantity": self.random.randint(1, 1000)}
+        async with session.post(f"{self.url}/orders", json=order) as response:
+            body = await response.json()
+        if response.status == 201:
+            self.order_ids.append(body["order_id"])
+            self.pending_ids.append(body["order_id"])
+        return response.status
+
+    async def get(self, session: aiohttp.ClientSession):
+        async with session.get(f"{self.url}/orders/{self.random.choice(self.order_ids)}") as response:
+            await response.read()
+            return response.status
+
+    async def list(self, session: aiohttp.ClientSession):
+        params = {"symbol": self.random.choice(SUPPORTED_SYMBOLS), "limit": 100}
+        async with session.get(f"{self.url}/orders", params=params) as response:
+            await response.read()
+            return response.status
+
+    async def cancel(self, session: aiohttp.ClientSession):
+        order_id = self.pending_ids.pop(self.random.randrange(len(self.pending_ids)))
+        async with session.delete(f"{self.url}/orders/{order_id}") as response:
+            await response.read()
+            return response.status
+
+    async def subscriber(self, session: aiohttp.ClientSession, deadline: float):
+        async with session.ws_connect(f"{self.url}/ws") as websocket:
+            while True:
+                try:
+                    message = await websocket.receive(timeout=max(deadline - time.monotonic(), 0.01))
+                except asyncio.TimeoutError:
+                    return
+                if message.type != aiohttp.WSMsgType.TEXT:
+                    return
+                received = time.time()
+                if not self.recording:
+                    continue
+                self.ws_messages += 1
+                update = json.loads(message.data)
+                if isinstance(update, dict) and update.get("status") == "PENDING":
+                    # From the order's creation in the store to its update reaching the client
+                    self.ws_delays.append(received - update["created_time"])
+
+    async def run(self, duration: float, warmup: float, concurrency: int, subscribers: int) -> dict:
+        connector = aiohttp.TCPConnector(limit=concurrency + subscribers)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            settings = await self.server_settings(session)
+            deadline = time.monotonic() + warmup + duration
+            tasks = [asyncio.create_task(self.subscriber(session, deadline)) for _ in range(subscribers)]
+            tasks += [asyncio.create_task(self.worker(session, deadline)) for _ in range(concurrency)]
+            await asyncio.sleep(warmup)
+            self.recording = True
+            start = time.monotonic()
+            await asyncio.gather(*tasks)
+            elapsed = time.monotonic() - start
+
+        total = OperationStats()
+        for stats in self.stats.values():
+            total.latencies += stats.latencies
+            total.errors += stats.errors
+            total.rejected += stats.rejected
+        return {
+            "meta": {"url": self.url, "duration": duration, "concurrency": concurrency, "subscribers": subscribers,
+                     "mix": dict(zip(self.operations, self.weights)), "commit": git_commit(),
+                     "server": settings},
+            "operations": {operation: stats.report(elapsed) for operation, stats in self.stats.items()},
+            "total": total.report(elapsed),
+            "websocket": {"messages": self.ws_messages, "messages_per_second": self.ws_messages / elapsed,
+                          "delivery_latency_ms": percentiles(self.ws_delays)},
+        }
+
+    async def server_settings(self, session: aiohttp.ClientSession) -> Dict[str, str]:
+        """Simulation settings from /metrics, runs are only comparable when they match"""
+        try:
+            async with session.get(f"{self.url}/metrics") as response:
+                text = await response.text() if response.status == 200 else ""
+        except aiohttp.ClientError:
+            text = ""
+        settings = {}
+        for line in text.splitlines():
+            if line.startswith("simulation_info{"):
+                labels = dict(re.findall(r'(\w+)="((?:[^"\\]|\\.)*)"', line))
+                settings[labels["setting"]] = labels["value"]
+        return settings
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report: dict, baseline: dict, threshold: float) -> List[str]:
+    """Operations that lost more than `threshold` of their throughput or p99 latency against the baseline"""
+    if report["meta"].get("server") != baseline["meta"].get("server"):
+        print(f"Warning: server settings differ, {baseline['meta'].get('server')} in the baseline")
+    regressions = []
+    print(f"{'operation':<10} {'throughput':>22} {'p99 ms':>22}")
+    for operation, stats in list(report["operations"].items()) + [("total", report["total"])]:
+        base = baseline["operations"].get(operation) if operation != "total" else baseline["total"]
+        if not base or not stats["latency_ms"] or not base["latency_ms"]:
+            continue
+        throughput = stats["throughput"] / base["throughput"] - 1
+        p99 = stats["latency_ms"]["p99"] / base["latency_ms"]["p99"] - 1
+        print(f"{operation:<10} {stats['throughput']:>12.1f} ({throughput:+7.1%}) "
+              f"{stats['latency_ms']['p99']:>12.2f} ({p99:+7.1%})")
+        if throughput < -threshold or p99 > threshold:
+            regressions.append(operation)
+    return regressions
+
+
+def spawn_server(url: str, env: List[str]) -> subprocess.Popen:
+    server_env = dict(os.environ, BASE_URL=url, LATENCY_PROFILE="zero")
+    server_env.update(item.split("=", 1) for item in env)
+    server = subprocess.Popen([sys.executable, "main.py"], cwd=os.path.join(ROOT, "server"), env=server_env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            asyncio.run(probe(url))
+            return server
+        except (aiohttp.ClientError, OSError):
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError(f"The server didn't start at {url}")
+
+
+async def probe(url: str):
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f"{url}/openapi.json") as response:
+            response.raise_for_status()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=os.getenv("BASE_URL", "http://127.0.0.1:8000"))
+    parser.add_argument("--duration", type=float, default=30, help="seconds measured")
+    parser.add_argument("--warmup", type=float, default=2, help="seconds of load before measuring")
+    parser.add_argument("--concurrency", type=int, default=50, help="HTTP clients, each waits for its last answer")
+    parser.add_argument("--subscribers", type=int, default=10, help="WebSocket clients")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("create=4,get=3,list=2,cancel=1"))
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--spawn", action="store_true", help="start the server of this checkout for the run")
+    parser.add_argument("--server-env", action="append", default=[], metavar="NAME=VALUE",
+                        help="environment of the spawned server, e.g. CLOCK=virtual")
+    parser.add_argument("--output", help="write the report to this file instead of stdout")
+    parser.add_argument("--compare", help="report of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.1, help="share of throughput or p99 that may be lost")
+    args = parser.parse_args()
+
+    server = spawn_server(args.url, args.server_env) if args.spawn else None
+    try:
+        report = asyncio.run(LoadGenerator(args.url, args.mix, args.seed).run(
+            args.duration, args.warmup, args.concurrency, args.subscribers))
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(report, json.load(file), args.threshold)
+        if regressions:
+            print(f"Regressions: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
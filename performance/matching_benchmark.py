@@ -0,0 +1,73 @@
+"""Benchmark for the order books.
+
+For books of growing depth, reports the cost of resting a limit order, of cancelling one and of matching
+crossing orders, each filling one resting order. Cancelled orders stay in the heap until they come up, so
+matching through a book with many cancellations is measured too. The orders live in an order store like in the
+server, so executions and cancellations include the update of its status index, which grows with the store.
+
+Usage: python performance/matching_benchmark.py [--depths 1000,10000,100000,1000000] [--orders 10000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+
+from database import OrderStore  # noqa: E402
+from matching import MatchingEngine  # noqa: E402
+from order_models import OrderSide, OrderStatus  # noqa: E402
+
+
+def fill_book(depth: int, seed: int):
+    """Resting sell orders at random prices, and the seconds it took to rest them"""
+    rng = random.Random(seed)
+    store = OrderStore()
+    orders = store.create_many([("EURUSD", 10, OrderSide.SELL, round(rng.uniform(1, 2), 4)) for _ in range(depth)])
+    engine = MatchingEngine()
+    start = time.perf_counter()
+    for order in orders:
+        engine.rest(order)
+    return store, engine, orders, time.perf_counter() - start
+
+
+def match(store: OrderStore, engine: MatchingEngine, count: int) -> float:
+    """Seconds for `count` market buy orders, each filling exactly one resting order"""
+    buys = store.create_many([("EURUSD", 10, OrderSide.BUY, None)] * count)
+    start = time.perf_counter()
+    for order in buys:
+        engine.submit(order, 0.0)
+    return time.perf_counter() - start
+
+
+def cancel(engine: MatchingEngine, orders) -> float:
+    start = time.perf_counter()
+    for order in orders:
+        order.update_status(OrderStatus.CANCELLED)
+        engine.cancel(order)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--depths", default="1000,10000,100000,1000000")
+    parser.add_argument("--orders", type=int, default=10_000, help="crossing orders per measurement")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{'resting orders':>14} {'rest us':>9} {'cancel us':>10} {'matches/s':>11} {'matches/s after cancels':>24}")
+    for depth in (int(depth) for depth in args.depths.split(",")):
+        count = min(args.orders, depth // 4)
+        store, engine, orders, rest_seconds = fill_book(depth, args.seed)
+        match_seconds = match(store, engine, count)
+        # Half of what is left is cancelled, the next matches skip over those orders
+        cancelled = [order for order in orders if order.status == OrderStatus.PENDING][::2]
+        cancel_seconds = cancel(engine, cancelled)
+        stale_seconds = match(store, engine, count)
+        print(f"{depth:>14,} {rest_seconds / depth * 1e6:>9.2f} {cancel_seconds / len(cancelled) * 1e6:>10.2f} "
+              f"{count / match_seconds:>11,.0f} {count / stale_seconds:>24,.0f}")
+
+
+if __name__ == "__main__":
+    main()
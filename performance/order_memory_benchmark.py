@@ -0,0 +1,77 @@
+"""Memory benchmark for resting orders.
+
+Reports the bytes allocated per order by the order store (order columns and secondary indexes),
+next to the previous representation: one Python object per order, with a per-instance __dict__
+or with __slots__, before any ID lookup or index.
+
+Usage: python performance/order_memory_benchmark.py [--orders 1000000]
+"""
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+
+from database import OrderStore  # noqa: E402
+from order_models import OrderStatus  # noqa: E402
+
+
+class DictOrder:
+    """Order as one object per order, with a per-instance __dict__"""
+
+    def __init__(self, order_id: int, symbol: str, quantity: int):
+        self._on_status_change = None
+        self._order_id = order_id
+        self._status = OrderStatus.PENDING
+        self._symbol = symbol
+        self._quantity = quantity
+        self._created_time = time.time()
+        self._executed_time = None
+
+
+class SlottedOrder:
+    """Order as one object per order, with __slots__"""
+
+    __slots__ = ("_on_status_change", "_order_id", "_status", "_symbol", "_quantity", "_created_time",
+                 "_executed_time")
+    __init__ = DictOrder.__init__
+
+
+def bytes_per_order(create, orders: int) -> float:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    created = create(orders)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del created
+    return (after - before) / orders
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    # Quantities above 256 aren't cached small ints, so every order carries its own int like in real use
+    dict_orders = bytes_per_order(lambda n: [DictOrder(i, "EURUSD", 1000 + i) for i in range(1, n + 1)], args.orders)
+    slotted_orders = bytes_per_order(lambda n: [SlottedOrder(i, "EURUSD", 1000 + i) for i in range(1, n + 1)],
+                                     args.orders)
+
+    def fill_store(n):
+        store = OrderStore()
+        store.create_many([("EURUSD", 1000 + i) for i in range(n)])
+        return store
+
+    store = bytes_per_order(fill_store, args.orders)
+    print(f"orders: {args.orders:,}")
+    print(f"objects with __dict__:    {dict_orders:8.1f} bytes per order")
+    print(f"objects with __slots__:   {slotted_orders:8.1f} bytes per order")
+    print(f"order store with indexes: {store:8.1f} bytes per order")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Micro-benchmark for order lookups in the in-memory order store.
+
+Measures the cost of the GET /orders/{order_id} lookup path (store lookup + get_info) at
+increasing store sizes, next to the previous list-scan lookup for comparison.
+
+Usage: python performance/order_store_benchmark.py [--sizes 1000 10000 ...] [--lookups N]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+
+from database import OrderStore  # noqa: E402
+
+# The list scan is linear, so it's only measured up to this size to keep the run short
+LIST_SCAN_MAX_SIZE = 100_000
+
+
+def fill_store(store: OrderStore, size: int):
+    for _ in range(size - len(store)):
+        store.create(symbol="EURUSD", quantity=10)
+
+
+def bench_store_lookup(store: OrderStore, lookups: int) -> float:
+    ids = [str(random.randint(1, len(store))) for _ in range(lookups)]
+    start = time.perf_counter()
+    for order_id in ids:
+        store.get(order_id).get_info()
+    return (time.perf_counter() - start) / lookups
+
+
+def bench_list_scan(order_ids: list, lookups: int) -> float:
+    ids = [random.randint(1, len(order_ids) - 1) for _ in range(lookups)]
+    start = time.perf_counter()
+    for order_id in ids:
+        _ = order_id in order_ids
+    return (time.perf_counter() - start) / lookups
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000, 1_000_000, 10_000_000])
+    parser.add_argument("--lookups", type=int, default=100_000)
+    args = parser.parse_args()
+
+    store = OrderStore()
+    print(f"{'orders':>12} {'store get (us)':>16} {'list scan (us)':>16}")
+    for size in sorted(args.sizes):
+        fill_store(store, size)
+        store_us = bench_store_lookup(store, args.lookups) * 1e6
+        if size <= LIST_SCAN_MAX_SIZE:
+            list_us = f"{bench_list_scan(list(range(size + 1)), min(args.lookups, 1_000)) * 1e6:16.3f}"
+        else:
+            list_us = f"{'skipped':>16}"
+        print(f"{size:>12,} {store_us:16.3f} {list_us}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Benchmark for the write-ahead log and snapshots of the order store.
+
+Logs N orders (about a third of them executed, a third cancelled), then measures:
+- the logging cost per order with group commit, on top of placing the orders,
+- recovery time from the write-ahead log alone,
+- recovery time from a snapshot.
+
+Usage: python performance/recovery_benchmark.py [--orders 10000000] [--fsync-interval 0.005]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from typing import Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+
+from database import OrderStore  # noqa: E402
+from order_models import OrderStatus  # noqa: E402
+from persistence import OrderPersistence  # noqa: E402
+
+BATCH_SIZE = 10_000
+
+
+async def place_orders(directory: Optional[str], orders: int, fsync_interval: float) -> float:
+    """Places, executes and cancels orders, logging them if a directory is given. Returns the elapsed time."""
+    persistence = OrderPersistence(directory, fsync_interval=fsync_interval,
+                                   snapshot_interval=3600) if directory else None
+    store = OrderStore()
+    if persistence:
+        persistence.recover(store)
+        persistence.start(store)
+    start = time.perf_counter()
+    for batch_start in range(0, orders, BATCH_SIZE):
+        for order in store.create_many([("EURUSD", 10)] * min(BATCH_SIZE, orders - batch_start)):
+            if order.order_id[-1] in "123":
+                order.execute_order()
+            elif order.order_id[-1] in "456":
+                order.update_status(OrderStatus.CANCELLED)
+        if persistence:
+            await persistence.sync()
+    elapsed = time.perf_counter() - start
+    if persistence:
+        await persistence.close()
+    return elapsed
+
+
+async def snapshot(directory: str):
+    persistence = OrderPersistence(directory, fsync_interval=0.005, snapshot_interval=3600)
+    store = OrderStore()
+    persistence.recover(store)
+    persistence.start(store)
+    await persistence.snapshot()
+    await persistence.close()
+
+
+def recover(directory: str) -> float:
+    start = time.perf_counter()
+    OrderPersistence(directory, fsync_interval=0.005, snapshot_interval=3600).recover(OrderStore())
+    return time.perf_counter() - start
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=10_000_000)
+    parser.add_argument("--fsync-interval", type=float, default=0.005)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        logging_time = (await place_orders(directory, args.orders, args.fsync_interval)
+                        - await place_orders(None, args.orders, args.fsync_interval))
+        wal_size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+        wal_recovery = recover(directory)
+        await snapshot(directory)
+        snapshot_size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+        snapshot_recovery = recover(directory)
+
+    print(f"orders: {args.orders:,}")
+    print(f"log cost with group commit: {logging_time / args.orders * 1e6:8.2f} us per order")
+    print(f"recovery from log:          {wal_recovery:8.2f} s ({wal_size / 2 ** 20:.1f} MB)")
+    print(f"recovery from snapshot:     {snapshot_recovery:8.2f} s ({snapshot_size / 2 ** 20:.1f} MB)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,82 @@
+"""Benchmark for order retention.
+
+Places rounds of orders that are executed right away, like a server that runs for days, and reports the memory
+held by the order store after each round, with and without retention. With retention, all but the newest
+`--retain` orders go to an archive on disk, so memory stays flat while it grows with every round without.
+Then compares lookups of orders in memory and in the archive.
+
+Usage: python performance/retention_benchmark.py [--rounds 10] [--orders 1000000] [--retain 100000]
+"""
+import argparse
+import asyncio
+import gc
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+
+from archive import OrderRetention  # noqa: E402
+from database import OrderStore  # noqa: E402
+
+
+def place_round(store: OrderStore, orders: int):
+    for order in store.create_many([("EURUSD", 1000 + i) for i in range(orders)]):
+        order.execute_order(0.0)
+
+
+def bench_lookups(store: OrderStore, first_id: int, last_id: int, lookups: int) -> float:
+    ids = [random.randint(first_id, last_id) for _ in range(lookups)]
+    start = time.perf_counter()
+    for order_id in ids:
+        store.get(order_id).to_json()
+    return (time.perf_counter() - start) / lookups
+
+
+async def run(args, directory: str):
+    store, unbounded = OrderStore(), OrderStore()
+    retention = OrderRetention(max_orders=args.retain, max_age=0, interval=3600, directory=directory)
+    retention.start(store)
+    print(f"{'round':>5} {'orders':>12} {'MB without retention':>21} {'MB with retention':>18} {'archived':>12}")
+    # Memory each store took since the first round, as the sum of what every round added
+    unbounded_memory = retained_memory = 0
+    gc.collect()
+    tracemalloc.start()
+    try:
+        for round_number in range(1, args.rounds + 1):
+            before = tracemalloc.get_traced_memory()[0]
+            place_round(unbounded, args.orders)
+            unbounded_memory += tracemalloc.get_traced_memory()[0] - before
+            before = tracemalloc.get_traced_memory()[0]
+            place_round(store, args.orders)
+            await retention.evict()
+            gc.collect()
+            retained_memory += tracemalloc.get_traced_memory()[0] - before
+            print(f"{round_number:>5} {store.last_id:>12,} {unbounded_memory / 1e6:>21.1f} "
+                  f"{retained_memory / 1e6:>18.1f} {len(retention.archive):>12,}")
+    finally:
+        tracemalloc.stop()
+    archived = len(retention.archive)
+    memory = bench_lookups(store, archived + 1, store.last_id, args.lookups)
+    archive = bench_lookups(store, 1, archived, args.lookups)
+    print(f"lookup in memory:  {memory * 1e6:6.2f} us")
+    print(f"lookup in archive: {archive * 1e6:6.2f} us")
+    await retention.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--orders", type=int, default=1_000_000, help="orders per round")
+    parser.add_argument("--retain", type=int, default=100_000, help="newest orders kept in memory")
+    parser.add_argument("--lookups", type=int, default=100_000)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        asyncio.run(run(args, directory))
+
+
+if __name__ == "__main__":
+    main()
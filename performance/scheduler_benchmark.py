@@ -0,0 +1,83 @@
+"""Benchmark for pending order executions.
+
+Compares memory per pending order and the number of event loop timer handles for the execution
+scheduler against the previous approach of one task sleeping 4-6 seconds per order.
+
+Usage: python performance/scheduler_benchmark.py [--orders 100000]
+"""
+import argparse
+import asyncio
+import gc
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+
+from clock import RealClock  # noqa: E402
+from database import OrderStore  # noqa: E402
+from scheduler import ExecutionScheduler  # noqa: E402
+
+
+async def sleeping_execution(order):
+    await asyncio.sleep(random.uniform(4, 6.0))
+    return order.execute_order()
+
+
+async def measure(schedule_all) -> tuple:
+    """Returns memory allocated by schedule_all() and the number of timer handles once everything is waiting"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    schedule_all()
+    await asyncio.sleep(0)  # let the tasks reach their sleep, which is when the timer handles are created
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return after - before, len(asyncio.get_running_loop()._scheduled)
+
+
+async def bench_tasks(orders) -> tuple:
+    tasks = []
+
+    def schedule_all():
+        tasks.extend(asyncio.create_task(sleeping_execution(order)) for order in orders)
+
+    memory, timers = await measure(schedule_all)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return memory, timers
+
+
+async def bench_scheduler(orders) -> tuple:
+    scheduler = ExecutionScheduler(on_execute=lambda due: None, clock=RealClock())
+    scheduler.start()
+
+    def schedule_all():
+        for order in orders:
+            scheduler.schedule(order, delay=random.uniform(4, 6.0))
+
+    memory, timers = await measure(schedule_all)
+    scheduler.stop()
+    return memory, timers
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=100_000)
+    args = parser.parse_args()
+
+    store = OrderStore()
+    orders = [store.create(symbol="EURUSD", quantity=10) for _ in range(args.orders)]
+
+    task_memory, task_timers = await bench_tasks(orders)
+    wheel_memory, wheel_timers = await bench_scheduler(orders)
+    print(f"pending orders: {args.orders:,}")
+    print(f"{'':24} {'bytes/order':>12} {'timer handles':>14}")
+    print(f"{'sleeping task per order':24} {task_memory / args.orders:12.1f} {task_timers:14,}")
+    print(f"{'execution scheduler':24} {wheel_memory / args.orders:12.1f} {wheel_timers:14,}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,58 @@
+"""Benchmark for encoding order responses.
+
+Renders the bodies of the k6 scenario's requests (place an order, get it by ID, list a page of orders)
+with JSONResponse from a fresh get_info() dict, as the handlers used to, and with RawJSONResponse from
+the cached serialized orders.
+
+Usage: python performance/serialization_benchmark.py [--orders 10000] [--page-size 100]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+
+from fastapi.responses import JSONResponse  # noqa: E402
+
+from database import OrderStore  # noqa: E402
+from responses import RawJSONResponse, json_array  # noqa: E402
+
+
+def per_request(render, store: OrderStore, orders: int, page_size: int) -> float:
+    page, _ = store.page(limit=page_size)
+    start = time.perf_counter()
+    for order_id in range(1, orders + 1):
+        order = store.get(order_id)
+        render([order])  # place order response
+        render([order])  # get order by ID
+        render(page, True)  # list orders
+    return (time.perf_counter() - start) / (orders * 3)
+
+
+def render_dicts(orders, as_list=False):
+    infos = [order.get_info() for order in orders]
+    JSONResponse(content=infos if as_list else infos[0])
+
+
+def render_raw(orders, as_list=False):
+    RawJSONResponse(content=json_array(order.to_json() for order in orders) if as_list else orders[0].to_json())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=10_000)
+    parser.add_argument("--page-size", type=int, default=100)
+    args = parser.parse_args()
+
+    store = OrderStore()
+    store.create_many([("EURUSD", 10)] * args.orders)
+    dicts = per_request(render_dicts, store, args.orders, args.page_size) * 1e6
+    raw = per_request(render_raw, store, args.orders, args.page_size) * 1e6
+    print(f"orders: {args.orders:,}, page size: {args.page_size}")
+    print(f"JSONResponse from get_info():   {dicts:8.2f} us per request")
+    print(f"RawJSONResponse from to_json(): {raw:8.2f} us per request")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+from typing import Dict, Optional
+
+from fastapi import status
+from fastapi.responses import JSONResponse
+from starlette.routing import BaseRoute, Match, Router
+
+from metrics import REJECTED_REQUESTS
+
+
+def parse_route_limits(spec: str) -> Dict[str, int]:
+    """Parses per-route limits given as `<route>=<limit>` pairs separated by semicolons"""
+    limits = {}
+    for item in filter(None, (item.strip() for item in spec.split(";"))):
+        route, separator, limit = item.partition("=")
+        if not separator or not limit.strip().isdigit():
+            raise ValueError(f"Invalid route limit {item!r}, expected <route>=<limit>")
+        limits[route.strip()] = int(limit)
+    return limits
+
+
+class AdmissionControl:
+    """Caps the number of requests each route handles at once, 0 means no limit.
+
+    Routes are named after their handler functions, like latency profiles. Requests over the limit are turned
+    away right away instead of queueing behind the others, so accepted requests keep their latency when the server
+    is saturated.
+    """
+
+    def __init__(self, default_limit: int, route_limits: Dict[str, int], retry_after: int):
+        self.default_limit = default_limit
+        self.route_limits = route_limits
+        self.retry_after = retry_after
+        self.in_flight: Dict[str, int] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.default_limit or any(self.route_limits.values()))
+
+    def limit(self, route: str) -> int:
+        return self.route_limits.get(route, self.default_limit)
+
+    def try_acquire(self, route: str) -> bool:
+        in_flight = self.in_flight.get(route, 0)
+        limit = self.limit(route)
+        if limit and in_flight >= limit:
+            return False
+        self.in_flight[route] = in_flight + 1
+        return True
+
+    def release(self, route: str):
+        self.in_flight[route] -= 1
+
+    def __str__(self) -> str:
+        return ", ".join([f"default={self.default_limit or 'unlimited'}"] +
+                         [f"{route}={limit or 'unlimited'}" for route, limit in self.route_limits.items()])
+
+
+class AdmissionMiddleware:
+    """ASGI middleware applying AdmissionControl before the request is routed, a rejected request costs
+    neither body parsing nor validation. Rejections are answered 429 (Too Many Requests) with Retry-After."""
+
+    def __init__(self, app, admission: AdmissionControl, router: Router):
+        self.app = app
+        self.admission = admission
+        self.router = router
+
+    async def __call__(self, scope, receive, send):
+        route = self._match(scope) if scope["type"] == "http" and self.admission.enabled else None
+        if route is None:
+            await self.app(scope, receive, send)
+            return
+        if not self.admission.try_acquire(route.name):
+            REJECTED_REQUESTS.inc(route.name, "in_flight")
+            # Labels the rejection with its route in the request metrics
+            scope["route"] = route
+            response = JSONResponse(status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                                    content={"detail": "Too many requests, retry later"},
+                                    headers={"Retry-After": str(self.admission.retry_after)})
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.admission.release(route.name)
+
+    def _match(self, scope) -> Optional[BaseRoute]:
+        for route in self.router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route
+        return None
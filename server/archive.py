@@ -0,0 +1,230 @@
+import asyncio
+import bisect
+import logging
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+from array import array
+from typing import List, Optional
+
+from clock import CLOCK, Clock
+from misc import SUPPORTED_SYMBOLS
+from order_models import OrderChunk, OrderStatus
+
+logger = logging.getLogger(__name__)
+
+DATA_FILE = "archive.dat"
+INDEX_FILE = "archive.idx"
+# One record per order ID: order_id, symbol, status and side codes, quantity, created_time, executed_time, price,
+# filled quantity. NaN stands for a missing executed time or price, IDs without an order have status code 0.
+ORDER_RECORD = struct.Struct("<QBBBqdddq")
+# Totals of a chunk: number of orders and their quantity by symbol and status code
+TOTALS = len(SUPPORTED_SYMBOLS) * (len(OrderStatus) + 1)
+# One entry per archived chunk: first order ID, number of records, offset of the first record in the data file,
+# then the totals of the chunk
+CHUNK_ENTRY = struct.Struct(f"<QQQ{2 * TOTALS}q")
+
+
+class OrderArchive:
+    """Append-only store on disk for final orders evicted from the order store, a chunk at a time.
+
+    Orders are fixed-size records in a data file that is memory-mapped for lookups. The index holds one entry
+    per chunk, kept in memory sorted by first order ID, so a lookup is a binary search over the chunks and a
+    single record read, and memory grows by one entry per ORDER_CHUNK_SIZE archived orders.
+
+    The records of a chunk are fsynced before its index entry is written, so after a crash records without
+    an entry are cut off, and a chunk is either archived in full or not at all.
+    """
+
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self._data = open(os.path.join(directory, DATA_FILE), "a+b")
+        self._index = open(os.path.join(directory, INDEX_FILE), "a+b")
+        self._first_ids = array("q")
+        self._counts = array("q")
+        self._offsets = array("q")
+        self._map: Optional[mmap.mmap] = None
+        self.order_counts: List[List[int]] = [[0] * (len(OrderStatus) + 1) for _ in SUPPORTED_SYMBOLS]
+        self.quantities: List[List[int]] = [[0] * (len(OrderStatus) + 1) for _ in SUPPORTED_SYMBOLS]
+        self._load_index()
+
+    def __len__(self) -> int:
+        """Archived orders"""
+        return sum(sum(counts[1:]) for counts in self.order_counts)
+
+    @property
+    def chunks(self) -> int:
+        return len(self._first_ids)
+
+    def has_chunk(self, first_id: int) -> bool:
+        index = bisect.bisect_left(self._first_ids, first_id)
+        return index < len(self._first_ids) and self._first_ids[index] == first_id
+
+    def get(self, order_id: int) -> Optional[OrderChunk]:
+        """An archived order as a chunk of its own, None if it isn't archived"""
+        index = bisect.bisect_right(self._first_ids, order_id) - 1
+        if index < 0 or order_id >= self._first_ids[index] + self._counts[index]:
+            return None
+        offset = self._offsets[index] + (order_id - self._first_ids[index]) * ORDER_RECORD.size
+        if self._map is None or offset + ORDER_RECORD.size > len(self._map):
+            self._remap()
+        (_, symbol, status, side, quantity, created_time, executed_time, price,
+         filled) = ORDER_RECORD.unpack_from(self._map, offset)
+        if not status:
+            return None
+        return OrderChunk([array("B", [symbol]), array("B", [status]), array("q", [quantity]),
+                           array("d", [created_time]), array("d", [executed_time]), array("B", [side]),
+                           array("d", [price]), array("q", [filled])])
+
+    def write(self, first_id: int, chunk: OrderChunk) -> bytes:
+        """Appends the records of a chunk and its index entry to the files, returns the entry for add().
+
+        Only touches the files, so it can run in a thread while lookups go on.
+        """
+        totals = [0] * (2 * TOTALS)
+        records = []
+        columns = zip(chunk.symbols, chunk.statuses, chunk.sides, chunk.quantities, chunk.created_times,
+                      chunk.executed_times, chunk.prices, chunk.filled)
+        for order_id, (symbol, status, side, quantity, created_time, executed_time, price,
+                       filled) in enumerate(columns, first_id):
+            records.append(ORDER_RECORD.pack(order_id, symbol, status, side, quantity, created_time, executed_time,
+                                             price, filled))
+            slot = symbol * (len(OrderStatus) + 1) + status
+            totals[slot] += 1
+            totals[TOTALS + slot] += quantity
+        offset = self._data.seek(0, os.SEEK_END)
+        self._write(self._data, b"".join(records))
+        entry = CHUNK_ENTRY.pack(first_id, len(records), offset, *totals)
+        self._write(self._index, entry)
+        return entry
+
+    def add(self, entry: bytes):
+        """Makes a chunk written by write() visible to lookups"""
+        first_id, count, offset, *totals = CHUNK_ENTRY.unpack(entry)
+        index = bisect.bisect_left(self._first_ids, first_id)
+        self._first_ids.insert(index, first_id)
+        self._counts.insert(index, count)
+        self._offsets.insert(index, offset)
+        statuses = len(OrderStatus) + 1
+        for slot in range(TOTALS):
+            self.order_counts[slot // statuses][slot % statuses] += totals[slot]
+            self.quantities[slot // statuses][slot % statuses] += totals[TOTALS + slot]
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+        self._data.close()
+        self._index.close()
+
+    def _load_index(self):
+        self._index.seek(0)
+        content = self._index.read()
+        data_size = self._data.seek(0, os.SEEK_END)
+        entries = []
+        for start in range(0, len(content) - CHUNK_ENTRY.size + 1, CHUNK_ENTRY.size):
+            entry = content[start:start + CHUNK_ENTRY.size]
+            _, count, offset, *_ = CHUNK_ENTRY.unpack(entry)
+            if offset + count * ORDER_RECORD.size > data_size:
+                break
+            entries.append(entry)
+        # Cut off a torn entry, and records written after the last entry
+        self._index.truncate(len(entries) * CHUNK_ENTRY.size)
+        end = 0
+        for entry in entries:
+            self.add(entry)
+            _, count, offset, *_ = CHUNK_ENTRY.unpack(entry)
+            end = max(end, offset + count * ORDER_RECORD.size)
+        self._data.truncate(end)
+
+    def _remap(self):
+        if self._map is not None:
+            self._map.close()
+        self._map = mmap.mmap(self._data.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @staticmethod
+    def _write(file, data: bytes):
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+
+
+class OrderRetention:
+    """Moves final orders out of the order store into an OrderArchive once they are past the retention limits,
+    see OrderStore.expired_chunks(). Runs every `interval` seconds.
+
+    Orders move a whole chunk at a time, so that the others keep their O(1) lookup by ID. A chunk past the limits
+    that still has a pending order, e.g. a limit order resting in its book, stays in memory until that order is final.
+    Such chunks are counted in `pinned_chunks`.
+
+    The archive lives in `directory`, which has to be kept along with the write-ahead log and its snapshots.
+    Without a directory it goes to a temporary one, removed on close like an in-memory store. With a write-ahead
+    log, chunks are only archived once the final status of their orders is logged on disk, and on start the archive
+    is taken over the log for the chunks it holds (see OrderStore.attach_archive).
+    """
+
+    def __init__(self, max_orders: int, max_age: float, interval: float, directory: Optional[str] = None,
+                 clock: Optional[Clock] = None):
+        self.max_orders = max_orders
+        self.max_age = max_age
+        self.interval = interval
+        self._directory = directory
+        self._temporary = directory is None
+        self._clock = clock or CLOCK
+        self.archive: Optional[OrderArchive] = None
+        self._store = None
+        self._persistence = None
+        self._task: Optional[asyncio.Task] = None
+        self.pinned_chunks = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.max_orders or self.max_age)
+
+    def start(self, store, persistence=None):
+        if self._temporary:
+            self._directory = tempfile.mkdtemp(prefix="order-archive-")
+        self.archive = OrderArchive(self._directory)
+        self._store = store
+        self._persistence = persistence
+        store.attach_archive(self.archive)
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        self._task.cancel()
+        self.archive.close()
+        if self._temporary:
+            shutil.rmtree(self._directory, ignore_errors=True)
+
+    async def evict(self) -> int:
+        """Archives every chunk past the limits, returns the number of orders evicted"""
+        chunk_numbers, pinned = [], 0
+        for chunk_number in self._store.expired_chunks(self.max_orders, self.max_age, self._clock.time()):
+            if self._store.chunk(chunk_number)[1].pending:
+                pinned += 1
+            else:
+                chunk_numbers.append(chunk_number)
+        self.pinned_chunks = pinned
+        if chunk_numbers and self._persistence is not None:
+            # The archive is fsynced right away, the log only every fsync interval. Archived orders that the log still
+            # has as pending after a crash would be archived and pending at once.
+            await self._persistence.sync()
+        evicted = 0
+        for chunk_number in chunk_numbers:
+            first_id, chunk = self._store.chunk(chunk_number)
+            # Final orders don't change anymore, the chunk can be written while the loop goes on
+            entry = await asyncio.to_thread(self.archive.write, first_id, chunk)
+            self.archive.add(entry)
+            evicted += self._store.evict(chunk_number)
+        return evicted
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                evicted = await self.evict()
+                if evicted:
+                    logger.info("Archived %d orders", evicted)
+            except Exception:
+                logger.exception("Failed to archive orders")
@@ -0,0 +1,297 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Iterable, List, NamedTuple, Optional, Set, Tuple, Union
+
+from fastapi import WebSocket, status
+
+from metrics import FANOUT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+DROP = "drop"
+COALESCE = "coalesce"
+POLICIES = (DROP, COALESCE)
+
+
+class OrderUpdate(NamedTuple):
+    order_id: int
+    symbol: str
+    status: str
+    payload: bytes  # Order.to_json()
+
+
+class OrderEvent(NamedTuple):
+    """Updates sent to clients as one message: the order itself, or a JSON array of orders for a batch"""
+
+    updates: List[OrderUpdate]
+    batch: bool = False
+
+
+class TradeEvent(NamedTuple):
+    """A trade between two orders of the order book, sent to clients as one message"""
+
+    symbol: str
+    buy_order_id: int
+    sell_order_id: int
+    payload: bytes  # Trade.to_json()
+
+
+Event = Union[OrderEvent, TradeEvent]
+
+
+class Subscription:
+    """Orders a client subscribed to. An order has to match every filter that has values, any of its values."""
+
+    def __init__(self):
+        self.order_ids: Set[int] = set()
+        self.symbols: Set[str] = set()
+        self.statuses: Set[str] = set()
+
+    def matches(self, update: OrderUpdate) -> bool:
+        return bool((self.order_ids or self.symbols or self.statuses)
+                    and (not self.order_ids or update.order_id in self.order_ids)
+                    and (not self.symbols or update.symbol in self.symbols)
+                    and (not self.statuses or update.status in self.statuses))
+
+    def matches_trade(self, trade: TradeEvent) -> bool:
+        """Trades have no status, subscriptions with a status filter don't get them"""
+        return bool((self.order_ids or self.symbols) and not self.statuses
+                    and (not self.order_ids or trade.buy_order_id in self.order_ids
+                         or trade.sell_order_id in self.order_ids)
+                    and (not self.symbols or trade.symbol in self.symbols))
+
+    def primary(self) -> Tuple[str, Set]:
+        """The most selective filter, which the client is indexed by"""
+        if self.order_ids:
+            return "order_id", self.order_ids
+        if self.symbols:
+            return "symbol", self.symbols
+        return "status", self.statuses
+
+    def to_dict(self) -> dict:
+        return {"order_ids": sorted(self.order_ids), "symbols": sorted(self.symbols),
+                "statuses": sorted(self.statuses)}
+
+
+class ClientChannel:
+    """Bounded send queue of a single WebSocket client, drained by its own writer task."""
+
+    def __init__(self, websocket: WebSocket, max_queue_size: int, policy: str):
+        self.websocket = websocket
+        self._max_queue_size = max_queue_size
+        self._coalesce = policy == COALESCE
+        self.subscription: Optional[Subscription] = None  # None receives every update
+        self._pending: "OrderedDict[Hashable, str]" = OrderedDict()
+        self._ready = asyncio.Event()
+        self._writer: Optional[asyncio.Task] = None
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._pending)
+
+    def start(self):
+        self._writer = asyncio.create_task(self._run())
+
+    def offer(self, key: Hashable, payload: str) -> bool:
+        """Queue a payload without blocking. Returns False if the client can't keep up.
+
+        Payloads with the same key replace each other while queued under the coalesce policy only.
+        """
+        if not self._coalesce:
+            # Every update is sent until the queue overflows
+            key = object()
+        elif key in self._pending:
+            # Client is behind on this order: only the latest state is worth sending
+            self._pending[key] = payload
+            return True
+        if len(self._pending) >= self._max_queue_size:
+            return False
+        self._pending[key] = payload
+        self._ready.set()
+        return True
+
+    def close(self):
+        if self._writer:
+            self._writer.cancel()
+
+    async def _run(self):
+        try:
+            while True:
+                await self._ready.wait()
+                self._ready.clear()
+                while self._pending:
+                    _, payload = self._pending.popitem(last=False)
+                    await self.websocket.send_text(payload)
+        except asyncio.CancelledError:
+            # Cancelled either on disconnect or because the client was too slow
+            try:
+                await self.websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+            except Exception:
+                pass
+        except Exception as exc:
+            logger.debug("WebSocket writer stopped: %s", exc)
+
+
+class BroadcastHub:
+    """Fans order events out to connected WebSocket clients.
+
+    Each event is serialized once by the publisher, decoded to text once and handed to per-client bounded
+    queues, so publishing never waits on a client and one slow subscriber can't delay order placement
+    for everyone else.
+
+    Clients receive every update until they subscribe to some orders. Subscribed clients are kept in an index
+    by the values of their most selective filter, so an update only visits the clients that may want it.
+    They get the orders of a batch that match their filters as a smaller batch.
+    Trades of the order book are messages of their own, for clients subscribed to either order or to the symbol.
+    """
+
+    def __init__(self, max_queue_size: int, policy: str):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown slow consumer policy: {policy}, expected one of {POLICIES}")
+        self._max_queue_size = max_queue_size
+        self._policy = policy
+        self._channels: Dict[WebSocket, ClientChannel] = {}
+        self._firehose: Set[ClientChannel] = set()
+        self._index: Dict[str, Dict[Hashable, Set[ClientChannel]]] = {"order_id": {}, "symbol": {}, "status": {}}
+
+    def __len__(self) -> int:
+        return len(self._channels)
+
+    def __contains__(self, websocket: WebSocket) -> bool:
+        """Whether the client is still connected, slow clients are disconnected by the hub"""
+        return websocket in self._channels
+
+    def queue_depths(self) -> List[int]:
+        return [channel.queue_depth for channel in self._channels.values()]
+
+    def connect(self, websocket: WebSocket) -> ClientChannel:
+        channel = ClientChannel(websocket, self._max_queue_size, self._policy)
+        self._channels[websocket] = channel
+        self._firehose.add(channel)
+        channel.start()
+        return channel
+
+    def disconnect(self, websocket: WebSocket):
+        channel = self._channels.pop(websocket, None)
+        if channel:
+            self._unindex(channel)
+            channel.close()
+
+    def subscribe(self, websocket: WebSocket, order_ids: Iterable[int] = (), symbols: Iterable[str] = (),
+                  statuses: Iterable[str] = ()) -> Optional[Subscription]:
+        """Adds orders to the client's subscription. Subscribing to nothing makes it receive every update again.
+        Returns None for a client that was disconnected."""
+        channel = self._channels.get(websocket)
+        if channel is None:
+            return None
+        self._unindex(channel)
+        order_ids, symbols, statuses = set(order_ids), set(symbols), set(statuses)
+        if order_ids or symbols or statuses:
+            channel.subscription = channel.subscription or Subscription()
+            channel.subscription.order_ids |= order_ids
+            channel.subscription.symbols |= symbols
+            channel.subscription.statuses |= statuses
+        else:
+            channel.subscription = None
+        self._reindex(channel)
+        return channel.subscription
+
+    def unsubscribe(self, websocket: WebSocket, order_ids: Iterable[int] = (), symbols: Iterable[str] = (),
+                    statuses: Iterable[str] = ()) -> Optional[Subscription]:
+        """Removes orders from the client's subscription, a client that unsubscribed from everything gets nothing.
+        Returns None for a client that was disconnected."""
+        channel = self._channels.get(websocket)
+        if channel is None:
+            return None
+        self._unindex(channel)
+        channel.subscription = channel.subscription or Subscription()
+        channel.subscription.order_ids -= set(order_ids)
+        channel.subscription.symbols -= set(symbols)
+        channel.subscription.statuses -= set(statuses)
+        self._reindex(channel)
+        return channel.subscription
+
+    def send(self, websocket: WebSocket, message: str):
+        """Queues a message for one client only"""
+        channel = self._channels.get(websocket)
+        if channel and not channel.offer(object(), message):
+            self.disconnect(websocket)
+
+    def publish(self, event: Event):
+        self.publish_many([event])
+
+    def publish_many(self, events: Iterable[Event]):
+        """Queues order and trade events for every interested client, in order"""
+        start = time.perf_counter()
+        slow: Set[ClientChannel] = set()
+        for event in events:
+            if isinstance(event, TradeEvent):
+                self._publish_trade(event, slow)
+                continue
+            # Single updates are coalesced by order, batches never are
+            key = str(event.updates[0].order_id) if not event.batch else object()
+            if self._firehose:
+                message = self._message(event.updates, event.batch)
+                for channel in self._firehose:
+                    if channel not in slow and not channel.offer(key, message):
+                        slow.add(channel)
+            matched: Dict[ClientChannel, List[OrderUpdate]] = {}
+            for update in event.updates:
+                for channel in self._candidates(update):
+                    if channel.subscription.matches(update):
+                        matched.setdefault(channel, []).append(update)
+            for channel, updates in matched.items():
+                if channel not in slow and not channel.offer(key, self._message(updates, event.batch)):
+                    slow.add(channel)
+        FANOUT_SECONDS.observe(time.perf_counter() - start)
+        for channel in slow:
+            logger.info("Dropping slow WebSocket consumer")
+            self.disconnect(channel.websocket)
+
+    def _publish_trade(self, trade: TradeEvent, slow: Set[ClientChannel]):
+        message = trade.payload.decode()
+        channels = set(self._firehose)
+        for dimension, value in (("order_id", trade.buy_order_id), ("order_id", trade.sell_order_id),
+                                 ("symbol", trade.symbol)):
+            channels.update(channel for channel in self._index[dimension].get(value, ())
+                            if channel.subscription.matches_trade(trade))
+        for channel in channels:
+            # Trades are never coalesced
+            if channel not in slow and not channel.offer(object(), message):
+                slow.add(channel)
+
+    @staticmethod
+    def _message(updates: List[OrderUpdate], batch: bool) -> str:
+        if not batch:
+            return updates[0].payload.decode()
+        return (b"[" + b",".join(update.payload for update in updates) + b"]").decode()
+
+    def _candidates(self, update: OrderUpdate) -> Iterable[ClientChannel]:
+        # A client is only indexed by the values of one filter, so it comes up at most once per update
+        for dimension, value in (("order_id", update.order_id), ("symbol", update.symbol), ("status", update.status)):
+            channels = self._index[dimension].get(value)
+            if channels:
+                yield from channels
+
+    def _reindex(self, channel: ClientChannel):
+        if channel.subscription is None:
+            self._firehose.add(channel)
+            return
+        dimension, values = channel.subscription.primary()
+        for value in values:
+            self._index[dimension].setdefault(value, set()).add(channel)
+
+    def _unindex(self, channel: ClientChannel):
+        self._firehose.discard(channel)
+        if channel.subscription is None:
+            return
+        dimension, values = channel.subscription.primary()
+        index = self._index[dimension]
+        for value in values:
+            channels = index.get(value)
+            if channels is not None:
+                channels.discard(channel)
+                if not channels:
+                    del index[value]
@@ -0,0 +1,217 @@
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import pickle
+import signal
+import struct
+from typing import Dict, List, Optional, Set, Tuple
+
+from fastapi.exceptions import HTTPException
+
+from database import DB
+from service import Events, NewOrder, OrderService
+
+logger = logging.getLogger(__name__)
+
+# Frames on the broker socket: body length, frame kind, body.
+# Requests, responses and order events are pickled, so serialized orders pass through as bytes. Only processes
+# of this server can connect, the socket sits in a directory private to its user (see main.py).
+FRAME_HEADER = struct.Struct(">IB")
+REQUEST, RESPONSE, EVENTS = 1, 2, 3
+
+# OrderService methods workers are allowed to call
+REMOTE_METHODS = {"create_order", "create_orders", "get_order", "list_orders", "cancel_order", "cancel_orders",
+                  "wait_for_order", "advance_clock", "stats", "replay_order", "order_totals"}
+
+
+def write_frame(writer: asyncio.StreamWriter, kind: int, body: bytes):
+    writer.write(FRAME_HEADER.pack(len(body), kind) + body)
+
+
+async def read_frame(reader: asyncio.StreamReader) -> Tuple[int, bytes]:
+    length, kind = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+    return kind, await reader.readexactly(length)
+
+
+class OrderBroker:
+    """Local broker that lets several server workers share one order book.
+
+    The broker process owns the order store, the ID allocator, the execution scheduler and persistence,
+    and serves OrderService calls over a Unix socket. Every order update is sent to all connected workers,
+    which fan it out to their own WebSocket clients.
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._service = OrderService(DB, publish_events=self._broadcast)
+        self._workers: Set[asyncio.StreamWriter] = set()
+        self._dispatches: Set[asyncio.Task] = set()
+
+    async def serve(self, ready: Optional[multiprocessing.Event] = None):
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, stop.set)
+        await self._service.start()
+        server = await asyncio.start_unix_server(self._handle_worker, path=self._path)
+        if ready:
+            ready.set()
+        async with server:
+            await stop.wait()
+            # Let the worker connections wind down before the loop goes away
+            for writer in list(self._workers):
+                writer.close()
+            await asyncio.sleep(0.1)
+        await self._service.stop()
+
+    async def _handle_worker(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._workers.add(writer)
+        try:
+            while True:
+                kind, body = await read_frame(reader)
+                if kind == REQUEST:
+                    task = asyncio.create_task(self._dispatch(writer, *pickle.loads(body)))
+                    self._dispatches.add(task)
+                    task.add_done_callback(self._dispatches.discard)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._workers.discard(writer)
+            writer.close()
+
+    async def _dispatch(self, writer: asyncio.StreamWriter, call_id: int, method: str, args: dict):
+        result, error = None, None
+        try:
+            if method not in REMOTE_METHODS:
+                raise HTTPException(status_code=500, detail=f"Unknown broker method: {method}")
+            result = await getattr(self._service, method)(**args)
+        except HTTPException as exc:
+            error = {"status_code": exc.status_code, "detail": exc.detail, "headers": exc.headers}
+        except Exception:
+            logger.exception("Broker call %s failed", method)
+            error = {"status_code": 500, "detail": "Internal Server Error"}
+        if not writer.is_closing():
+            write_frame(writer, RESPONSE, pickle.dumps((call_id, result, error), pickle.HIGHEST_PROTOCOL))
+
+    def _broadcast(self, events: Events):
+        body = pickle.dumps(events, pickle.HIGHEST_PROTOCOL)
+        for writer in self._workers:
+            write_frame(writer, EVENTS, body)
+
+
+def run_broker(path: str, ready: Optional[multiprocessing.Event] = None):
+    asyncio.run(OrderBroker(path).serve(ready))
+
+
+def start_broker(path: str, timeout: float = 30) -> multiprocessing.Process:
+    """Starts the broker in its own process and waits until it accepts connections"""
+    ready = multiprocessing.Event()
+    process = multiprocessing.Process(target=run_broker, args=(path, ready), name="order-broker", daemon=True)
+    process.start()
+    if not ready.wait(timeout):
+        process.terminate()
+        raise RuntimeError("Order broker didn't start in time")
+    return process
+
+
+class RemoteOrderService:
+    """OrderService of the broker process, called from a server worker.
+
+    Calls are multiplexed over one connection. Order updates from the broker are handed to `publish_events`.
+    """
+
+    def __init__(self, path: str, publish_events):
+        self._path = path
+        self._publish_events = publish_events
+        self._ids = itertools.count()
+        self._calls: Dict[int, asyncio.Future] = {}
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        reader, self._writer = await asyncio.open_unix_connection(self._path)
+        self._reader_task = asyncio.create_task(self._read(reader))
+
+    async def stop(self):
+        self._reader_task.cancel()
+        self._writer.close()
+
+    async def create_order(self, symbol: str, quantity: int, side: Optional[str] = None,
+                           price: Optional[float] = None, idempotency_key: Optional[str] = None,
+                           fingerprint: Optional[str] = None) -> bytes:
+        return await self._call("create_order", symbol=symbol, quantity=quantity, side=side, price=price,
+                                idempotency_key=idempotency_key, fingerprint=fingerprint)
+
+    async def replay_order(self, idempotency_key: str, fingerprint: str) -> Optional[bytes]:
+        return await self._call("replay_order", idempotency_key=idempotency_key, fingerprint=fingerprint)
+
+    async def create_orders(self, orders: List[NewOrder]) -> List[bytes]:
+        return await self._call("create_orders", orders=orders)
+
+    async def get_order(self, order_id: str) -> Optional[bytes]:
+        return await self._call("get_order", order_id=order_id)
+
+    async def wait_for_order(self, order_id: str, order_status: Optional[str] = None,
+                             timeout: float = 30) -> Optional[bytes]:
+        return await self._call("wait_for_order", order_id=order_id, order_status=order_status, timeout=timeout)
+
+    async def list_orders(self, cursor: Optional[int] = None, limit: Optional[int] = None,
+                          symbol: Optional[str] = None,
+                          order_status: Optional[str] = None) -> Tuple[List[bytes], Optional[int]]:
+        orders, next_cursor = await self._call("list_orders", cursor=cursor, limit=limit, symbol=symbol,
+                                               order_status=order_status)
+        return orders, next_cursor
+
+    async def cancel_order(self, order_id: str) -> bytes:
+        return await self._call("cancel_order", order_id=order_id)
+
+    async def cancel_orders(self, order_ids: Optional[List[str]] = None, symbol: Optional[str] = None) -> List[dict]:
+        return await self._call("cancel_orders", order_ids=order_ids, symbol=symbol)
+
+    async def advance_clock(self, seconds: float) -> dict:
+        return await self._call("advance_clock", seconds=seconds)
+
+    async def order_totals(self) -> dict:
+        return await self._call("order_totals")
+
+    async def stats(self) -> dict:
+        return await self._call("stats")
+
+    async def _call(self, method: str, **args):
+        if self._reader_task.done():
+            raise HTTPException(status_code=503, detail="Order broker is unavailable")
+        call_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._calls[call_id] = future
+        write_frame(self._writer, REQUEST, pickle.dumps((call_id, method, args), pickle.HIGHEST_PROTOCOL))
+        try:
+            return await future
+        finally:
+            self._calls.pop(call_id, None)
+
+    async def _read(self, reader: asyncio.StreamReader):
+        try:
+            while True:
+                kind, body = await read_frame(reader)
+                if kind == EVENTS:
+                    self._publish_events(pickle.loads(body))
+                elif kind == RESPONSE:
+                    call_id, result, error = pickle.loads(body)
+                    future = self._calls.get(call_id)
+                    if future is None or future.done():
+                        continue
+                    if error is not None:
+                        future.set_exception(HTTPException(**error))
+                    else:
+                        future.set_result(result)
+        except asyncio.IncompleteReadError:
+            logger.error("Lost connection to the order broker")
+        except Exception:
+            # A reset connection or a frame that can't be read, nothing more can be read after it
+            logger.exception("Lost connection to the order broker")
+        finally:
+            # Calls in flight would never be answered anymore
+            for future in self._calls.values():
+                if not future.done():
+                    future.set_exception(HTTPException(status_code=503, detail="Order broker is unavailable"))
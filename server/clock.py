@@ -0,0 +1,74 @@
+import asyncio
+import heapq
+import itertools
+import time
+from typing import List, Optional, Tuple, Union
+
+from settings import CLOCK as CLOCK_MODE
+
+REAL = "real"
+VIRTUAL = "virtual"
+CLOCK_MODES = (REAL, VIRTUAL)
+
+
+class RealClock:
+    """Wall clock time and asyncio sleeps"""
+
+    virtual = False
+
+    def time(self) -> float:
+        return time.time()
+
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+    async def sleep(self, delay: float):
+        await asyncio.sleep(delay)
+
+
+class VirtualClock:
+    """Deterministic clock that only moves when it is advanced.
+
+    Sleeps finish as soon as the clock is advanced past their deadline, in deadline order, however much
+    real time that takes. `time()` starts at the wall clock time the clock was created.
+    """
+
+    virtual = True
+
+    def __init__(self, start: Optional[float] = None):
+        self._now = start if start is not None else time.time()
+        self._sleepers: List[Tuple[float, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+
+    def time(self) -> float:
+        return self._now
+
+    def monotonic(self) -> float:
+        return self._now
+
+    async def sleep(self, delay: float):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._sleepers, (self._now + max(delay, 0), next(self._sequence), future))
+        await future
+
+    def advance(self, seconds: float) -> float:
+        if seconds < 0:
+            raise ValueError("The clock can't go backwards")
+        self._now += seconds
+        while self._sleepers and self._sleepers[0][0] <= self._now:
+            _, _, future = heapq.heappop(self._sleepers)
+            if not future.done():
+                future.set_result(None)
+        return self._now
+
+
+Clock = Union[RealClock, VirtualClock]
+
+
+def make_clock(mode: str) -> Clock:
+    if mode not in CLOCK_MODES:
+        raise ValueError(f"Unknown clock: {mode}, expected one of {CLOCK_MODES}")
+    return VirtualClock() if mode == VIRTUAL else RealClock()
+
+
+CLOCK = make_clock(CLOCK_MODE)
@@ -1,2 +1,307 @@
-DB = {}
-ORDER_IDS = [0]
+import bisect
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from clock import CLOCK, Clock
+from misc import ORDER_CHUNK_SIZE, SUPPORTED_SYMBOLS
+from archive import OrderArchive
+from order_models import COLUMN_TYPECODES, SYMBOL_CODES, Order, OrderChunk, OrderColumns, OrderSide, OrderStatus
+
+# order_id, symbol, quantity, status, created_time, executed_time, side, price, filled_quantity
+OrderRow = Tuple[int, str, int, OrderStatus, float, Optional[float], Optional[OrderSide], Optional[float], int]
+
+
+class OrderStoreListener:
+    """Gets notified of every order added to the store, every status transition and every partial fill"""
+
+    def order_created(self, order: Order):
+        pass
+
+    def order_status_changed(self, order: Order, old_status: OrderStatus):
+        pass
+
+    def order_filled(self, order: Order, quantity: int):
+        pass
+
+
+class OrderStore:
+    """In-memory order storage keyed by integer order ID.
+
+    IDs come from a monotonic counter, and order N sits at index N - 1 of the OrderColumns arrays,
+    so allocation, lookup and cancellation are O(1) regardless of how many orders the store holds.
+    get() and page() hand out lightweight Order views over those arrays.
+
+    Secondary indexes keep the IDs of every symbol, every status and every (symbol, status) pair as sorted
+    arrays. Symbols never change and IDs only grow, so symbol arrays are append-only. Status arrays are kept
+    current on every transition through Order.update_status; transitions land near the end of their target
+    array, so they stay cheap. Every filtered page walks the one array that matches all of its filters, so it
+    costs O(log n + page size).
+
+    The number of orders and their total quantity by symbol and status are kept current the same way,
+    so totals() costs O(number of symbols) however many orders there are.
+
+    With an archive attached, chunks of old final orders can be evicted to it (see archive.py). They leave
+    the columns and the indexes, so pages and exports no longer list them, but get() still finds them in
+    the archive and totals() still counts them.
+    """
+
+    def __init__(self, clock: Optional[Clock] = None, chunk_size: int = ORDER_CHUNK_SIZE):
+        self._clock = clock or CLOCK
+        self._columns = OrderColumns(on_status_change=self._status_changed, on_fill=self._filled,
+                                     chunk_size=chunk_size)
+        self._count = 0
+        self._by_symbol: List[array] = [array("q") for _ in SUPPORTED_SYMBOLS]
+        self._by_status: Dict[OrderStatus, array] = {order_status: array("q") for order_status in OrderStatus}
+        # Per symbol, then per status
+        self._by_symbol_status: List[Dict[OrderStatus, array]] = [
+            {order_status: array("q") for order_status in OrderStatus} for _ in SUPPORTED_SYMBOLS]
+        # Per symbol, indexed by status code
+        self._order_counts: List[List[int]] = [[0] * (len(OrderStatus) + 1) for _ in SUPPORTED_SYMBOLS]
+        self._quantities: List[List[int]] = [[0] * (len(OrderStatus) + 1) for _ in SUPPORTED_SYMBOLS]
+        self._listeners: List[OrderStoreListener] = []
+        self._archive: Optional[OrderArchive] = None
+        # Views of archived orders, which are never updated
+        self._archived_columns = OrderColumns(serialized_cache_size=0)
+
+    def create(self, symbol: str, quantity: int, side: Optional[OrderSide] = None,
+               price: Optional[float] = None) -> Order:
+        return self._insert(symbol, quantity, side, price)
+
+    def create_many(self, orders: List[tuple]) -> List[Order]:
+        """Creates orders from (symbol, quantity) pairs or (symbol, quantity, side, price), with consecutive IDs"""
+        return [self._insert(*order) for order in orders]
+
+    def restore_many(self, orders: Iterable[OrderRow], last_id: int = 0):
+        """Bulk loads persisted orders given as OrderRow tuples.
+
+        Orders have to come in ID order and after every order already in the store. Listeners aren't notified.
+        """
+        columns = self._columns
+        for order_id, symbol, quantity, order_status, created_time, executed_time, side, price, filled in orders:
+            if order_id > len(columns) + 1:
+                columns.append_missing(order_id - len(columns) - 1)
+            columns.append(symbol, quantity, order_status, created_time, executed_time, side, price, filled)
+            symbol_code = SYMBOL_CODES[symbol]
+            self._by_symbol[symbol_code].append(order_id)
+            self._by_status[order_status].append(order_id)
+            self._by_symbol_status[symbol_code][order_status].append(order_id)
+            self._order_counts[symbol_code][order_status.value] += 1
+            self._quantities[symbol_code][order_status.value] += quantity
+            self._count += 1
+        if last_id > len(columns):
+            columns.append_missing(last_id - len(columns))
+
+    def dump(self) -> List[array]:
+        """Copies of the columns in memory and of the indexes, to be loaded back with load()"""
+        return self._columns.dump() + [ids[:] for ids in self._indexes()]
+
+    def load(self, arrays: List[array]):
+        """Replaces the whole content of the store with arrays from dump(). Listeners aren't notified."""
+        layout = COLUMN_TYPECODES + "q" * (1 + len(self._indexes()))
+        if len(arrays) != len(layout) or any(values.typecode != typecode for values, typecode in zip(arrays, layout)):
+            raise ValueError("Arrays don't match the order store layout")
+        columns, indexes = arrays[:len(COLUMN_TYPECODES) + 1], arrays[len(COLUMN_TYPECODES) + 1:]
+        self._columns.load(columns)
+        for target, values in zip(self._indexes(), indexes):
+            target[:] = values
+        self._count = sum(len(chunk) - chunk.statuses.count(0) for _, chunk in self._columns.live_chunks())
+        self._recount()
+
+    def attach_archive(self, archive: "OrderArchive"):
+        """Looks up evicted orders in `archive` from now on. Chunks already in the archive, which the write-ahead
+        log may have brought back, are evicted again.
+
+        Orders only reach the archive once final, so the archive wins over the log for those chunks, even if orders
+        there are still pending, e.g. when the log was written by a server that archived before its log was on disk.
+        """
+        self._archive = archive
+        for chunk_number, _ in list(self._columns.live_chunks()):
+            if archive.has_chunk(self._columns.first_id(chunk_number)):
+                self._drop(chunk_number)
+        self._recount()
+
+    def expired_chunks(self, max_orders: int, max_age: float, now: float) -> List[int]:
+        """Numbers of the chunks in memory that are either older than the newest `max_orders` orders or were created
+        more than `max_age` seconds before `now`. 0 disables a limit. The last chunk never expires.
+
+        Only chunks without pending orders can be evicted, the others stay in memory until their last order is final.
+        """
+        columns = self._columns
+        chunk_numbers = []
+        for chunk_number, chunk in columns.live_chunks():
+            if chunk_number == len(columns.chunks) - 1:
+                continue
+            last_id = columns.first_id(chunk_number) + len(chunk) - 1
+            if (max_orders and len(columns) - last_id >= max_orders
+                    or max_age and max(chunk.created_times) <= now - max_age):
+                chunk_numbers.append(chunk_number)
+        return chunk_numbers
+
+    def chunk(self, chunk_number: int) -> Tuple[int, OrderChunk]:
+        """First order ID and columns of a chunk in memory"""
+        return self._columns.first_id(chunk_number), self._columns.chunks[chunk_number]
+
+    def evict(self, chunk_number: int) -> int:
+        """Drops a chunk of final orders that has been archived, returns the number of orders it held"""
+        if self._columns.chunks[chunk_number].pending:
+            raise ValueError(f"Chunk {chunk_number} has pending orders")
+        return self._drop(chunk_number)
+
+    def _drop(self, chunk_number: int) -> int:
+        chunk = self._columns.drop(chunk_number)
+        first_id = self._columns.first_id(chunk_number)
+        last_id = first_id + len(chunk) - 1
+        for ids in self._indexes():
+            del ids[bisect.bisect_left(ids, first_id):bisect.bisect_right(ids, last_id)]
+        serialized = self._columns.serialized
+        for order_id in range(first_id, last_id + 1):
+            serialized.pop(order_id, None)
+        evicted = len(chunk) - chunk.statuses.count(0)
+        self._count -= evicted
+        return evicted
+
+    def totals(self) -> Dict[str, Dict[OrderStatus, Tuple[int, int]]]:
+        """Number of orders and their total quantity by symbol and status"""
+        return {symbol: {order_status: (self._order_counts[code][order_status.value],
+                                        self._quantities[code][order_status.value]) for order_status in OrderStatus}
+                for code, symbol in enumerate(SUPPORTED_SYMBOLS)}
+
+    def add_listener(self, listener: OrderStoreListener):
+        self._listeners.append(listener)
+
+    @property
+    def last_id(self) -> int:
+        return len(self._columns)
+
+    def _recount(self):
+        """Rebuilds the totals from the columns and the archive, after they were loaded"""
+        if self._archive is not None:
+            counts = [symbol_counts[:] for symbol_counts in self._archive.order_counts]
+            quantities = [symbol_quantities[:] for symbol_quantities in self._archive.quantities]
+        else:
+            counts = [[0] * (len(OrderStatus) + 1) for _ in SUPPORTED_SYMBOLS]
+            quantities = [[0] * (len(OrderStatus) + 1) for _ in SUPPORTED_SYMBOLS]
+        for _, chunk in self._columns.live_chunks():
+            for symbol_code, status_code, quantity in zip(chunk.symbols, chunk.statuses, chunk.quantities):
+                # Reserved IDs without an order have status code 0, which no total reads
+                counts[symbol_code][status_code] += 1
+                quantities[symbol_code][status_code] += quantity
+        self._order_counts, self._quantities = counts, quantities
+
+    def _indexes(self) -> List[array]:
+        return (self._by_symbol + list(self._by_status.values())
+                + [ids for by_status in self._by_symbol_status for ids in by_status.values()])
+
+    def _insert(self, symbol: str, quantity: int, side: Optional[OrderSide] = None,
+                price: Optional[float] = None) -> Order:
+        self._columns.append(symbol, quantity, OrderStatus.PENDING, self._clock.time(), side=side, price=price)
+        order_id = len(self._columns)
+        symbol_code = SYMBOL_CODES[symbol]
+        self._by_symbol[symbol_code].append(order_id)
+        self._by_status[OrderStatus.PENDING].append(order_id)
+        self._by_symbol_status[symbol_code][OrderStatus.PENDING].append(order_id)
+        self._order_counts[symbol_code][OrderStatus.PENDING.value] += 1
+        self._quantities[symbol_code][OrderStatus.PENDING.value] += quantity
+        self._count += 1
+        order = Order(self._columns, order_id)
+        for listener in self._listeners:
+            listener.order_created(order)
+        return order
+
+    def get(self, order_id: Union[int, str]) -> Optional[Order]:
+        try:
+            order_id = int(order_id)
+        except ValueError:
+            return None
+        if not 0 < order_id <= len(self._columns):
+            return None
+        chunk, index = self._columns.locate(order_id)
+        if chunk is None:
+            archived = self._archive.get(order_id) if self._archive is not None else None
+            return Order(self._archived_columns, order_id, archived) if archived is not None else None
+        if chunk.statuses[index]:
+            return Order(self._columns, order_id, chunk, index)
+        return None
+
+    def values(self) -> Iterator[Order]:
+        return (Order(self._columns, order_id) for order_id in self._iter_ids(None, None))
+
+    def page(self, cursor: Optional[int] = None, limit: Optional[int] = None, symbol: Optional[str] = None,
+             status: Optional[OrderStatus] = None) -> Tuple[List[Order], Optional[int]]:
+        """Orders with an ID greater than `cursor`, in ID order, optionally filtered by symbol and status.
+
+        Returns the orders and the cursor of the next page, which is None once there are no more orders.
+        """
+        orders = []
+        for order_id in self._iter_ids(symbol, status, after=cursor):
+            if limit is not None and len(orders) == limit:
+                return orders, orders[-1]._order_id
+            orders.append(Order(self._columns, order_id))
+        return orders, None
+
+    def _iter_ids(self, symbol: Optional[str], status: Optional[OrderStatus], after: Optional[int] = None):
+        if symbol is not None and symbol not in SYMBOL_CODES:
+            return
+        # Every index only holds orders in memory that match it, so whichever matches both filters is walked as is
+        if symbol is not None and status is not None:
+            ids = self._by_symbol_status[SYMBOL_CODES[symbol]][status]
+        elif symbol is not None:
+            ids = self._by_symbol[SYMBOL_CODES[symbol]]
+        elif status is not None:
+            ids = self._by_status[status]
+        else:
+            yield from self._iter_live_ids(after)
+            return
+        start = bisect.bisect_right(ids, after) if after is not None else 0
+        for index in range(start, len(ids)):
+            yield ids[index]
+
+    def _iter_live_ids(self, after: Optional[int]):
+        """IDs of the orders in memory, after `after`"""
+        columns = self._columns
+        for chunk_number, chunk in columns.live_chunks():
+            first_id = columns.first_id(chunk_number)
+            if after is not None and first_id + len(chunk) <= after + 1:
+                continue
+            start = max(after - first_id + 1, 0) if after is not None else 0
+            statuses = chunk.statuses
+            for offset in range(start, len(statuses)):
+                if statuses[offset]:
+                    yield first_id + offset
+
+    def _status_changed(self, order: Order, old_status: OrderStatus):
+        order_id = order._order_id
+        symbol_code = order._chunk.symbols[order._index]
+        for by_status in (self._by_status, self._by_symbol_status[symbol_code]):
+            old_ids = by_status[old_status]
+            del old_ids[bisect.bisect_left(old_ids, order_id)]
+            bisect.insort(by_status[order.status], order_id)
+        counts, quantities = self._order_counts[symbol_code], self._quantities[symbol_code]
+        quantity = order.quantity
+        counts[old_status.value] -= 1
+        counts[order.status.value] += 1
+        quantities[old_status.value] -= quantity
+        quantities[order.status.value] += quantity
+        for listener in self._listeners:
+            listener.order_status_changed(order, old_status)
+
+    def _filled(self, order: Order, quantity: int):
+        for listener in self._listeners:
+            listener.order_filled(order, quantity)
+
+    def count(self, status: OrderStatus) -> int:
+        return len(self._by_status[status])
+
+    def serialization_stats(self) -> Tuple[int, int, float]:
+        """Hits and misses of the serialized order cache, and the time spent serializing on misses"""
+        columns = self._columns
+        return columns.serialized_hits, columns.serialized_misses, columns.serialized_seconds
+
+    def __contains__(self, order_id: Union[int, str]) -> bool:
+        return self.get(order_id) is not None
+
+    def __len__(self) -> int:
+        return self._count
+
+
+DB = OrderStore()
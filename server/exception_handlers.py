@@ -47,3 +47,33 @@ class OrderNotFoundError(Exception):
 
 async def order_not_found_exception_handler(request: Request, exc: OrderNotFoundError) -> JSONResponse:
     return JSONResponse(status_code=422, content={"detail": exc.message})
+
+
+class StatusValidationError(Exception):
+    def __init__(self, message: str):
+        super().__init__(message)
+        self.message = message
+
+
+async def status_validation_exception_handler(request: Request, exc: StatusValidationError) -> JSONResponse:
+    return JSONResponse(status_code=422, content={"detail": exc.message})
+
+
+class SideValidationError(Exception):
+    def __init__(self, message: str):
+        super().__init__(message)
+        self.message = message
+
+
+async def side_validation_exception_handler(request: Request, exc: SideValidationError) -> JSONResponse:
+    return JSONResponse(status_code=422, content={"detail": exc.message})
+
+
+class PriceValidationError(Exception):
+    def __init__(self, message: str):
+        super().__init__(message)
+        self.message = message
+
+
+async def price_validation_exception_handler(request: Request, exc: PriceValidationError) -> JSONResponse:
+    return JSONResponse(status_code=422, content={"detail": exc.message})
@@ -0,0 +1,99 @@
+import asyncio
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+from fastapi import status
+from fastapi.exceptions import HTTPException
+
+from clock import CLOCK, Clock
+
+
+class IdempotentResult:
+    __slots__ = ("fingerprint", "expires", "future")
+
+    def __init__(self, fingerprint: str, future: asyncio.Future):
+        self.fingerprint = fingerprint
+        self.expires = None
+        self.future = future
+
+
+class IdempotencyCache:
+    """Results of requests made with an Idempotency-Key, so retries get the original answer.
+
+    A bounded LRU cache whose entries also expire `ttl` seconds after the request completed. Only completed requests
+    are evicted, requests in flight stay past `max_size` until they complete. Requests that fail
+    aren't kept and may be retried with the same key. A request whose key is still being served waits for that
+    request instead of running again. A key reused with a different request body (`fingerprint`) is answered 422.
+    """
+
+    def __init__(self, max_size: int, ttl: float, clock: Optional[Clock] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock or CLOCK
+        self._results: "OrderedDict[str, IdempotentResult]" = OrderedDict()
+        self.hits = 0
+        self.coalesced = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+    async def lookup(self, key: str, fingerprint: str) -> Optional[bytes]:
+        """The result of an earlier request with this key, waiting for it if it is in flight"""
+        result = self._results.get(key)
+        if result is None:
+            return None
+        if result.expires is not None and result.expires <= self._clock.monotonic():
+            del self._results[key]
+            return None
+        if result.fingerprint != fingerprint:
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                                detail="Idempotency-Key was already used with a different request")
+        self._results.move_to_end(key)
+        if result.future.done():
+            self.hits += 1
+        else:
+            self.coalesced += 1
+        # Shielded, a waiter that goes away doesn't cancel the request it waits for
+        return await asyncio.shield(result.future)
+
+    async def run(self, key: str, fingerprint: str, request: Callable[[], Awaitable[bytes]]) -> bytes:
+        """Runs `request` once per key, later calls with the key get its result"""
+        cached = await self.lookup(key, fingerprint)
+        if cached is not None:
+            return cached
+        self.misses += 1
+        result = IdempotentResult(fingerprint, asyncio.get_running_loop().create_future())
+        self._results[key] = result
+        self._evict()
+        try:
+            payload = await request()
+        except BaseException as exc:
+            if self._results.get(key) is result:
+                del self._results[key]
+            if isinstance(exc, asyncio.CancelledError):
+                result.future.cancel()
+            else:
+                result.future.set_exception(exc)
+                # Marks the exception as retrieved, no request may be waiting for it
+                result.future.exception()
+            raise
+        result.expires = self._clock.monotonic() + self.ttl
+        result.future.set_result(payload)
+        self._evict()
+        return payload
+
+    def _evict(self):
+        """Drops the least recently used completed requests past `max_size`"""
+        excess = len(self._results) - self.max_size
+        if excess <= 0:
+            return
+        # Requests in flight would run again for a duplicate, they are skipped
+        keys = []
+        for key, result in self._results.items():
+            if result.future.done():
+                keys.append(key)
+                if len(keys) == excess:
+                    break
+        for key in keys:
+            del self._results[key]
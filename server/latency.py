@@ -0,0 +1,133 @@
+import asyncio
+import math
+import random
+from typing import Dict, List
+
+from metrics import add_simulated_latency
+
+
+class LatencyProfile:
+    """Distribution of a simulated delay, in seconds"""
+
+    def __init__(self, spec: str):
+        self.spec = spec
+
+    def sample(self) -> float:
+        raise NotImplementedError
+
+    def __str__(self) -> str:
+        return self.spec
+
+
+class ZeroLatency(LatencyProfile):
+    def sample(self) -> float:
+        return 0.0
+
+
+class FixedLatency(LatencyProfile):
+    def __init__(self, spec: str, delay: float):
+        super().__init__(spec)
+        self._delay = delay
+
+    def sample(self) -> float:
+        return self._delay
+
+
+class UniformLatency(LatencyProfile):
+    def __init__(self, spec: str, low: float, high: float):
+        super().__init__(spec)
+        self._low = low
+        self._high = high
+
+    def sample(self) -> float:
+        return random.uniform(self._low, self._high)
+
+
+class LogNormalLatency(LatencyProfile):
+    """Log-normal delays around `median`, plus a `spike` added to a `spike_probability` share of them"""
+
+    def __init__(self, spec: str, median: float, sigma: float, spike_probability: float = 0.0, spike: float = 0.0):
+        super().__init__(spec)
+        self._mu = math.log(median)
+        self._sigma = sigma
+        self._spike_probability = spike_probability
+        self._spike = spike
+
+    def sample(self) -> float:
+        delay = random.lognormvariate(self._mu, self._sigma)
+        if self._spike_probability and random.random() < self._spike_probability:
+            delay += self._spike
+        return delay
+
+
+class ReplayLatency(LatencyProfile):
+    """Delays drawn from recorded ones, a file with one delay in seconds per line"""
+
+    def __init__(self, spec: str, path: str):
+        super().__init__(spec)
+        with open(path) as file:
+            self._samples: List[float] = [float(line) for line in file if line.strip()]
+        if not self._samples:
+            raise ValueError(f"Latency profile {spec}: {path} has no recorded delays")
+
+    def sample(self) -> float:
+        return random.choice(self._samples)
+
+
+def parse_profile(spec: str) -> LatencyProfile:
+    """Parses `zero`, `fixed:<delay>`, `uniform:<low>,<high>`,
+    `lognormal:<median>,<sigma>[,<spike probability>,<spike>]` or `replay:<path>`. Delays are in seconds.
+    """
+    spec = spec.strip()
+    kind, _, args = spec.partition(":")
+    try:
+        if kind == "zero" and not args:
+            return ZeroLatency(spec)
+        if kind == "replay" and args:
+            return ReplayLatency(spec, args)
+        values = [float(value) for value in args.split(",")] if args else []
+        if kind == "fixed" and len(values) == 1 and values[0] >= 0:
+            return FixedLatency(spec, *values)
+        if kind == "uniform" and len(values) == 2 and 0 <= values[0] <= values[1]:
+            return UniformLatency(spec, *values)
+        if kind == "lognormal" and len(values) in (2, 4) and values[0] > 0 and all(v >= 0 for v in values):
+            return LogNormalLatency(spec, *values)
+    except ValueError as exc:
+        raise ValueError(f"Invalid latency profile {spec!r}: {exc}") from None
+    raise ValueError(f"Invalid latency profile {spec!r}, expected zero, fixed:<delay>, uniform:<low>,<high>, "
+                     f"lognormal:<median>,<sigma>[,<spike probability>,<spike>] or replay:<path>")
+
+
+def parse_route_profiles(spec: str) -> Dict[str, LatencyProfile]:
+    """Parses per-route overrides given as `<route>=<profile>` pairs separated by semicolons"""
+    profiles = {}
+    for item in filter(None, (item.strip() for item in spec.split(";"))):
+        route, separator, profile = item.partition("=")
+        if not separator:
+            raise ValueError(f"Invalid route latency profile {item!r}, expected <route>=<profile>")
+        profiles[route.strip()] = parse_profile(profile)
+    return profiles
+
+
+class SimulatedLatency:
+    """Artificial delay of the HTTP handlers, with a default profile and per-route overrides.
+
+    Routes are named after their handler functions, e.g. `create_order` or `get_orders`.
+    """
+
+    def __init__(self, default: LatencyProfile, routes: Dict[str, LatencyProfile]):
+        self.default = default
+        self.routes = routes
+
+    def profile(self, route: str) -> LatencyProfile:
+        return self.routes.get(route, self.default)
+
+    async def sleep(self, route: str):
+        delay = self.profile(route).sample()
+        # Without a delay the handler doesn't even yield, so benchmarks see the server's own cost
+        if delay > 0:
+            add_simulated_latency(route, delay)
+            await asyncio.sleep(delay)
+
+    def __str__(self) -> str:
+        return ", ".join([f"default={self.default}"] + [f"{route}={profile}" for route, profile in self.routes.items()])
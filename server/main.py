@@ -1,24 +1,76 @@
-import asyncio
+import hashlib
+import json
 import logging
-import os
-import random
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, List, Optional, Union
 
-from typing import List, Union
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, BackgroundTasks, status
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Body, Header, Query, status
 from fastapi.exceptions import RequestValidationError, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from pydantic import ValidationError
 
-from order_models import Order, CreateOrderRequest, OrderStatus
+from order_models import (AdvanceClockRequest, CreateOrderRequest, CancelOrdersRequest, OrderStatus,
+                          SubscriptionRequest)
 from exception_handlers import (validation_exception_handler, quantity_validation_exception_handler,
                                 symbol_validation_exception_handler, quantity_type_validation_exception_handler,
-                                order_not_found_exception_handler, QuantityValidationError, SymbolValidationError,
-                                OrderNotFoundError, QuantityTypeValidationError, )
+                                order_not_found_exception_handler, status_validation_exception_handler,
+                                QuantityValidationError, SymbolValidationError, OrderNotFoundError,
+                                QuantityTypeValidationError, StatusValidationError, side_validation_exception_handler,
+                                price_validation_exception_handler, SideValidationError, PriceValidationError, )
 
-from database import DB, ORDER_IDS
+from database import DB
+from broadcast import BroadcastHub
+from service import OrderService
+from broker import RemoteOrderService
+from responses import RawJSONResponse, dumps, json_array, json_object
+from clock import CLOCK
+from latency import SimulatedLatency, ZeroLatency, parse_profile, parse_route_profiles
+from admission import AdmissionControl, AdmissionMiddleware, parse_route_limits
+from metrics import (REGISTRY, INFO, MetricsMiddleware, EventLoopMonitor, record_service_stats,
+                     record_queue_depths, record_in_flight)
+from misc import SUPPORTED_SYMBOLS, MAX_PAGE_SIZE, MAX_BATCH_SIZE, EXPORT_CHUNK_SIZE, MAX_WAIT_TIMEOUT
+from settings import (WS_QUEUE_SIZE, WS_SLOW_CONSUMER_POLICY, BROKER_SOCKET, LATENCY_PROFILE, LATENCY_ROUTE_PROFILES,
+                      EXECUTION_DELAY_PROFILE, MAX_IN_FLIGHT, MAX_IN_FLIGHT_ROUTES, RETRY_AFTER, RETENTION_MAX_ORDERS,
+                      RETENTION_MAX_AGE)
 
-app = FastAPI()
-clients: List[WebSocket] = []
+logger = logging.getLogger(__name__)
+
+latency = SimulatedLatency(parse_profile(LATENCY_PROFILE), parse_route_profiles(LATENCY_ROUTE_PROFILES))
+if CLOCK.virtual:
+    # Requests are answered right away, only order execution waits for the clock to be advanced
+    latency.default, latency.routes = ZeroLatency("zero"), {}
+admission = AdmissionControl(MAX_IN_FLIGHT, parse_route_limits(MAX_IN_FLIGHT_ROUTES), retry_after=RETRY_AFTER)
+hub = BroadcastHub(max_queue_size=WS_QUEUE_SIZE, policy=WS_SLOW_CONSUMER_POLICY)
+# With several workers the order book is shared through the broker process, otherwise it lives right here
+service = (RemoteOrderService(BROKER_SOCKET, publish_events=hub.publish_many) if BROKER_SOCKET
+           else OrderService(DB, publish_events=hub.publish_many))
+loop_monitor = EventLoopMonitor()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    route_names = {route.name for route in app.routes}
+    for setting, routes in (("LATENCY_ROUTE_PROFILES", latency.routes), ("MAX_IN_FLIGHT_ROUTES", admission.route_limits)):
+        unknown_routes = set(routes) - route_names
+        if unknown_routes:
+            raise ValueError(f"{setting} names unknown routes: {', '.join(sorted(unknown_routes))}")
+    logger.info("Latency profiles: %s, execution delay: %s, %s clock", latency, EXECUTION_DELAY_PROFILE,
+                "virtual" if CLOCK.virtual else "real")
+    logger.info("In-flight request limits: %s", admission)
+    INFO.set(1, "latency", str(latency))
+    INFO.set(1, "execution_delay", EXECUTION_DELAY_PROFILE)
+    INFO.set(1, "clock", "virtual" if CLOCK.virtual else "real")
+    INFO.set(1, "retention_max_orders", str(RETENTION_MAX_ORDERS))
+    INFO.set(1, "retention_max_age", str(RETENTION_MAX_AGE))
+    await service.start()
+    loop_monitor.start()
+    yield
+    loop_monitor.stop()
+    await service.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Custom error handlers
 app.add_exception_handler(RequestValidationError, validation_exception_handler)
@@ -26,6 +78,12 @@ app.add_exception_handler(SymbolValidationError, symbol_validation_exception_han
 app.add_exception_handler(QuantityValidationError, quantity_validation_exception_handler)
 app.add_exception_handler(OrderNotFoundError, order_not_found_exception_handler)
 app.add_exception_handler(QuantityTypeValidationError, quantity_type_validation_exception_handler)
+app.add_exception_handler(StatusValidationError, status_validation_exception_handler)
+app.add_exception_handler(SideValidationError, side_validation_exception_handler)
+app.add_exception_handler(PriceValidationError, price_validation_exception_handler)
+
+# Rejects requests over the in-flight limits, inside CORS so that rejections carry the CORS headers too
+app.add_middleware(AdmissionMiddleware, admission=admission, router=app.router)
 
 # Middleware to resolve possible websocket origins conflicts
 app.add_middleware(CORSMiddleware,
@@ -34,97 +92,247 @@ app.add_middleware(CORSMiddleware,
                    allow_methods=["*"],
                    allow_headers=["*"],
                    )
+# Outermost, so that the request timings include everything the other middleware does
+app.add_middleware(MetricsMiddleware)
+
+
+def validate_order_filters(symbol: Optional[str], order_status: Optional[str]):
+    if symbol is not None and symbol not in SUPPORTED_SYMBOLS:
+        raise SymbolValidationError(f'Symbol: {symbol} is not supported')
+    if order_status is not None and order_status not in OrderStatus.__members__:
+        raise StatusValidationError(f'Status: {order_status} is not supported')
+
+
+async def export_orders_ndjson(symbol: Optional[str], order_status: Optional[str]) -> AsyncIterator[bytes]:
+    # Walks the store page by page, so memory stays constant however many orders there are
+    cursor = None
+    while True:
+        orders, cursor = await service.list_orders(cursor=cursor, limit=EXPORT_CHUNK_SIZE, symbol=symbol,
+                                                   order_status=order_status)
+        if orders:
+            yield b"".join(order + b"\n" for order in orders)
+        if cursor is None:
+            break
+
+
+def validate_order_request(item: Any) -> Union[CreateOrderRequest, str]:
+    """Validates one item of a batch, returns the error message instead of raising it"""
+    try:
+        return CreateOrderRequest.model_validate(item)
+    except (SymbolValidationError, QuantityValidationError, QuantityTypeValidationError, SideValidationError,
+            PriceValidationError) as exc:
+        return exc.message
+    except ValidationError as exc:
+        return exc.errors()[0]['msg']
+
+
+def handle_subscription_message(websocket: WebSocket, message: str):
+    """Applies a subscribe or unsubscribe message. Anything that isn't a JSON object with an action is ignored."""
+    try:
+        data = json.loads(message)
+    except ValueError:
+        return
+    if not isinstance(data, dict) or "action" not in data:
+        return
+    try:
+        request = SubscriptionRequest.model_validate(data)
+    except (SymbolValidationError, StatusValidationError) as exc:
+        hub.send(websocket, dumps({"error": exc.message}).decode())
+        return
+    except ValidationError as exc:
+        hub.send(websocket, dumps({"error": exc.errors()[0]['msg']}).decode())
+        return
+    if websocket not in hub:
+        return
+    update = hub.subscribe if request.action == "subscribe" else hub.unsubscribe
+    subscription = update(websocket, order_ids=request.order_ids, symbols=request.symbols, statuses=request.statuses)
+    hub.send(websocket, dumps({"subscription": subscription.to_dict() if subscription else None}).decode())
+
+
+# The body is validated by the handler, after retries with an Idempotency-Key were answered
+@app.post("/orders", openapi_extra={"requestBody": {"content": {"application/json": {
+    "schema": CreateOrderRequest.model_json_schema()}}}})
+async def create_order(order: Any = Body(...),
+                       idempotency_key: Optional[str] = Header(None, max_length=255)) -> RawJSONResponse:
+    await latency.sleep("create_order")
+    fingerprint = None
+    if idempotency_key is not None:
+        # Of the parsed body, so that retries formatted differently still match
+        canonical = json.dumps(order, sort_keys=True, separators=(",", ":")).encode()
+        fingerprint = hashlib.blake2b(canonical, digest_size=16).hexdigest()
+        order_info = await service.replay_order(idempotency_key, fingerprint)
+        if order_info is not None:
+            return RawJSONResponse(status_code=status.HTTP_201_CREATED, content=order_info)
+    try:
+        order = CreateOrderRequest.model_validate(order)
+    except ValidationError as exc:
+        raise RequestValidationError(exc.errors())
+    order_info = await service.create_order(symbol=order.symbol, quantity=order.quantity, side=order.side,
+                                            price=order.price, idempotency_key=idempotency_key,
+                                            fingerprint=fingerprint)
+
+    return RawJSONResponse(status_code=status.HTTP_201_CREATED,
+                           content=order_info)
 
 
-@app.post("/orders")
-async def create_order(order: CreateOrderRequest, background_tasks: BackgroundTasks) -> JSONResponse:
-    await asyncio.sleep(random.uniform(0.1, 1))
-    ORDER_IDS.append(ORDER_IDS[-1] + 1)
-    new_id = ORDER_IDS[-1]
-    new_order = Order(order_id=new_id, symbol=order.symbol, quantity=order.quantity)
-    await broadcast_message(new_order.get_info())
-    background_tasks.add_task(process_order, new_order)
-    DB[str(new_id)] = new_order
+@app.post("/orders/batch")
+async def create_orders_batch(orders: List[Any] = Body(..., max_length=MAX_BATCH_SIZE)) -> RawJSONResponse:
+    await latency.sleep("create_orders_batch")
+    validated = [validate_order_request(item) for item in orders]
+    valid = [request for request in validated if isinstance(request, CreateOrderRequest)]
+    created = iter(await service.create_orders([(request.symbol, request.quantity, request.side, request.price)
+                                                for request in valid]))
 
-    return JSONResponse(status_code=status.HTTP_201_CREATED,
-                        content=new_order.get_info())
+    results = []
+    for request in validated:
+        if isinstance(request, CreateOrderRequest):
+            results.append(json_object({"status_code": status.HTTP_201_CREATED}, order=next(created)))
+        else:
+            results.append(dumps({"status_code": status.HTTP_422_UNPROCESSABLE_ENTITY, "detail": request}))
+
+    return RawJSONResponse(status_code=status.HTTP_200_OK, content=json_array(results))
+
+
+@app.post("/orders/cancel")
+async def cancel_orders(request: CancelOrdersRequest) -> RawJSONResponse:
+    await latency.sleep("cancel_orders")
+    if (request.order_ids is None) == (request.symbol is None):
+        raise HTTPException(status_code=422, detail="Either order_ids or symbol must be provided")
+    order_ids = [str(order_id) for order_id in request.order_ids] if request.order_ids is not None else None
+    results = await service.cancel_orders(order_ids=order_ids, symbol=request.symbol)
+    results = [json_object({"order_id": result["order_id"], "status_code": result["status_code"]},
+                           order=result["order"]) if "order" in result else dumps(result) for result in results]
+
+    return RawJSONResponse(status_code=status.HTTP_200_OK, content=json_array(results))
+
+
+@app.get("/orders/export")
+async def export_orders(symbol: Optional[str] = None,
+                        order_status: Optional[str] = Query(None, alias="status")) -> StreamingResponse:
+    await latency.sleep("export_orders")
+    validate_order_filters(symbol, order_status)
+    return StreamingResponse(export_orders_ndjson(symbol, order_status), media_type="application/x-ndjson")
 
 
 @app.get("/orders/{order_id}")
-async def get_order(order_id: str) -> JSONResponse:
-    await asyncio.sleep(random.uniform(0.1, 1))
-    if int(order_id) not in ORDER_IDS and int(order_id) != 0:
+async def get_order(order_id: str) -> Response:
+    await latency.sleep("get_order")
+    order_info = await service.get_order(order_id)
+    if not order_info:
         return JSONResponse(status_code=status.HTTP_404_NOT_FOUND,
                             content={"detail": f"Order with ID: {order_id} does not exist"})
-    return JSONResponse(status_code=status.HTTP_200_OK,
-                        content=DB[order_id].get_info())
+    return RawJSONResponse(status_code=status.HTTP_200_OK,
+                           content=order_info)
+
+
+@app.get("/orders/{order_id}/wait")
+async def wait_for_order(order_id: str,
+                         order_status: Optional[str] = Query(None, alias="status"),
+                         timeout: float = Query(30, gt=0, le=MAX_WAIT_TIMEOUT)) -> Response:
+    await latency.sleep("wait_for_order")
+    validate_order_filters(None, order_status)
+    order_info = await service.wait_for_order(order_id, order_status=order_status, timeout=timeout)
+    if not order_info:
+        return JSONResponse(status_code=status.HTTP_404_NOT_FOUND,
+                            content={"detail": f"Order with ID: {order_id} does not exist"})
+    return RawJSONResponse(status_code=status.HTTP_200_OK,
+                           content=order_info)
 
 
 @app.delete("/orders/{order_id}")
-async def delete_order(order_id: str) -> JSONResponse:
-    await asyncio.sleep(random.uniform(0.1, 1))
-    order = DB.get(order_id)
-    if not order:
-        raise HTTPException(status_code=404, detail=f"Order with ID: {order_id} does not exist")
-    if order.status == order.status.EXECUTED:
-        raise HTTPException(status_code=400, detail=f"Order with ID: {order_id} has already been executed")
-    elif order.status == order.status.PENDING:
-        DB[order_id].update_status(OrderStatus.CANCELLED)
-        await broadcast_message(order.get_info())
-        return JSONResponse(status_code=status.HTTP_200_OK,
-                            content=order.get_info())
-    elif order.status == order.status.CANCELLED:
-        raise HTTPException(status_code=400, detail=f"Order with ID: {order_id} has already been canceled")
+async def delete_order(order_id: str) -> RawJSONResponse:
+    await latency.sleep("delete_order")
+    order_info = await service.cancel_order(order_id)
+    return RawJSONResponse(status_code=status.HTTP_200_OK,
+                           content=order_info)
 
 
 @app.get("/orders")
-async def get_orders() -> JSONResponse:
-    await asyncio.sleep(random.uniform(0.1, 1))
-    orders = [order.get_info() for order in DB.values()]
+async def get_orders(symbol: Optional[str] = None,
+                     order_status: Optional[str] = Query(None, alias="status"),
+                     limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+                     cursor: Optional[int] = Query(None, ge=0)) -> Response:
+    await latency.sleep("get_orders")
+    validate_order_filters(symbol, order_status)
+    orders, next_cursor = await service.list_orders(cursor=cursor, limit=limit, symbol=symbol,
+                                                    order_status=order_status)
     if orders:
-        return JSONResponse(status_code=status.HTTP_200_OK, content=orders)
+        # The next page starts after the last returned order, the header is omitted on the last page
+        headers = {"X-Next-Cursor": str(next_cursor)} if next_cursor is not None else None
+        return RawJSONResponse(status_code=status.HTTP_200_OK, content=json_array(orders), headers=headers)
 
     return JSONResponse(status_code=status.HTTP_200_OK, content={"message": "No orders found"})
 
 
+@app.get("/stats")
+async def get_stats() -> RawJSONResponse:
+    await latency.sleep("get_stats")
+    totals = await service.order_totals()
+    return RawJSONResponse(status_code=status.HTTP_200_OK, content=dumps(totals))
+
+
+@app.post("/clock/advance")
+async def advance_clock(request: AdvanceClockRequest) -> JSONResponse:
+    clock = await service.advance_clock(seconds=request.seconds)
+    return JSONResponse(status_code=status.HTTP_200_OK, content=clock)
+
+
+@app.get("/metrics")
+async def metrics() -> Response:
+    # Only the HTTP timings are per worker, the order book numbers come from the service wherever it runs
+    record_service_stats(await service.stats())
+    record_queue_depths(hub.queue_depths())
+    record_in_flight(admission.in_flight)
+    return Response(content=REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
-    clients.append(websocket)
+    hub.connect(websocket)
     try:
-        while True:
-            await websocket.receive_text()
+        # Until the client disconnects, or the hub drops it for being too slow
+        while websocket in hub:
+            handle_subscription_message(websocket, await websocket.receive_text())
     except WebSocketDisconnect:
         pass
     finally:
-        clients.remove(websocket)
-
-
-async def broadcast_message(message: dict):
-    for client in clients:
-        await client.send_json(message)
-
-
-async def process_order(order: Order):
-    order_info = await order.execute_order()
-    await broadcast_message(order_info) if order_info else None
+        hub.disconnect(websocket)
 
 
 if __name__ == "__main__":
+    import os
+    import tempfile
     import uvicorn
     from urllib.parse import urlparse
 
-    inside_docker = os.getenv("INSIDE_DOCKER")
-    logging.info(f"INSIDE_DOCKER: {inside_docker}")
-    if not inside_docker:
-        import dotenv
-        dotenv.load_dotenv()
-        logging.info("Loaded .env file")
+    from settings import INSIDE_DOCKER, BASE_URL, WORKERS
 
-    parsed_url = urlparse(os.getenv("BASE_URL"))
-    hostname = parsed_url.hostname if not inside_docker else "0.0.0.0"
+    logging.info(f"INSIDE_DOCKER: {INSIDE_DOCKER}")
+    parsed_url = urlparse(BASE_URL)
+    hostname = parsed_url.hostname if not INSIDE_DOCKER else "0.0.0.0"
 
     port = parsed_url.port
     logging.info(f"Starting server at {hostname}:{port}")
 
-    uvicorn.run(app, host=hostname, port=port)
+    if WORKERS > 1:
+        from broker import start_broker
+
+        # Workers are separate processes that import this module again, they find the broker through the environment.
+        # The socket directory is only accessible to this user, no other process may talk to the broker.
+        broker_socket = BROKER_SOCKET or os.path.join(tempfile.mkdtemp(prefix="trading-broker-"), "broker.sock")
+        broker = start_broker(broker_socket)
+        os.environ["BROKER_SOCKET"] = broker_socket
+        logging.info(f"Order broker listening on {broker_socket}, starting {WORKERS} workers")
+        try:
+            uvicorn.run("main:app", host=hostname, port=port, workers=WORKERS,
+                        app_dir=os.path.dirname(os.path.abspath(__file__)))
+        finally:
+            broker.terminate()
+            broker.join()
+            if os.path.exists(broker_socket):
+                os.remove(broker_socket)
+            if not BROKER_SOCKET:
+                os.rmdir(os.path.dirname(broker_socket))
+    else:
+        uvicorn.run(app, host=hostname, port=port)
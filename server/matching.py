@@ -0,0 +1,115 @@
+import heapq
+import json
+from typing import Dict, List, NamedTuple, Tuple
+
+from misc import SUPPORTED_SYMBOLS
+from order_models import Order, OrderSide, OrderStatus
+
+
+class Trade(NamedTuple):
+    symbol: str
+    price: float
+    quantity: int
+    buy_order_id: int
+    sell_order_id: int
+    time: float
+
+    def to_json(self) -> bytes:
+        return json.dumps({"type": "trade", **self._asdict()}, separators=(",", ":")).encode()
+
+
+class OrderBook:
+    """Resting limit orders of one symbol, matched by price-time priority.
+
+    Each side is a heap of (price key, order ID, order): asks keyed by price and bids by the negated price, so the
+    best price comes first on both sides, and the lower, older order ID first within a price. Orders that are filled
+    or cancelled stay in the heap until they come up, and are then skipped (lazy deletion), so a cancellation is O(1).
+    The heap is rebuilt once more than half of it is stale.
+    """
+
+    def __init__(self, symbol: str):
+        self.symbol = symbol
+        self._sides: Dict[OrderSide, List[Tuple[float, int, Order]]] = {OrderSide.BUY: [], OrderSide.SELL: []}
+        self._depth = {OrderSide.BUY: 0, OrderSide.SELL: 0}
+        self.trade_count = 0
+
+    def depth(self, side: OrderSide) -> int:
+        """Resting orders on one side"""
+        return self._depth[side]
+
+    def match(self, order: Order, time: float) -> Tuple[List[Trade], List[Order]]:
+        """Fills `order` against the other side as far as its limit price allows, at the prices of the resting orders.
+
+        The rest of a limit order rests in the book, the rest of a market order is cancelled.
+        Returns the trades and the resting orders they filled.
+        """
+        side = order.side
+        opposite = OrderSide.SELL if side == OrderSide.BUY else OrderSide.BUY
+        book = self._sides[opposite]
+        limit = order.price
+        trades, counterparties = [], []
+        remaining = order.remaining_quantity
+        while remaining and book:
+            _, _, resting = book[0]
+            if resting.status != OrderStatus.PENDING:
+                heapq.heappop(book)
+                continue
+            price = resting.price
+            if limit is not None and (price > limit if side == OrderSide.BUY else price < limit):
+                break
+            quantity = min(remaining, resting.remaining_quantity)
+            resting.fill(quantity, time)
+            order.fill(quantity, time)
+            remaining -= quantity
+            buy, sell = (order, resting) if side == OrderSide.BUY else (resting, order)
+            trades.append(Trade(self.symbol, price, quantity, int(buy.order_id), int(sell.order_id), time))
+            counterparties.append(resting)
+            self.trade_count += 1
+            if not resting.remaining_quantity:
+                heapq.heappop(book)
+                self._depth[opposite] -= 1
+        if remaining:
+            if limit is None:
+                order.update_status(OrderStatus.CANCELLED)
+            else:
+                self.rest(order)
+        return trades, counterparties
+
+    def rest(self, order: Order):
+        """Adds a pending limit order to the book without matching it"""
+        side = order.side
+        key = -order.price if side == OrderSide.BUY else order.price
+        heapq.heappush(self._sides[side], (key, int(order.order_id), order))
+        self._depth[side] += 1
+
+    def cancel(self, order: Order):
+        """Accounts for a resting order that was cancelled, its heap entry is dropped when it comes up"""
+        side = order.side
+        self._depth[side] -= 1
+        book = self._sides[side]
+        if len(book) > 2 * self._depth[side] + 64:
+            book[:] = [entry for entry in book if entry[2].status == OrderStatus.PENDING]
+            heapq.heapify(book)
+
+
+class MatchingEngine:
+    """One order book per supported symbol"""
+
+    def __init__(self):
+        self.books = {symbol: OrderBook(symbol) for symbol in SUPPORTED_SYMBOLS}
+
+    def submit(self, order: Order, time: float) -> Tuple[List[Trade], List[Order]]:
+        return self.books[order.symbol].match(order, time)
+
+    def rest(self, order: Order):
+        self.books[order.symbol].rest(order)
+
+    def cancel(self, order: Order):
+        if order.side is not None and order.price is not None:
+            self.books[order.symbol].cancel(order)
+
+    def depth(self) -> Dict[str, Dict[str, int]]:
+        return {symbol: {side.name: book.depth(side) for side in OrderSide} for symbol, book in self.books.items()}
+
+    def trade_counts(self) -> Dict[str, int]:
+        return {symbol: book.trade_count for symbol, book in self.books.items()}
@@ -0,0 +1,264 @@
+import asyncio
+import bisect
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Seconds, from a fast handler up to the simulated latency and execution delays
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+Labels = Tuple[str, ...]
+
+
+def format_labels(labelnames: Sequence[str], labels: Labels, extra: str = "") -> str:
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(labelnames, labels)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Metric:
+    """Metric in the Prometheus text format. Updates are plain dict and list operations, cheap enough
+    to stay on in production."""
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"] + self.samples()
+        return "\n".join(lines) + "\n"
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def set(self, value: float, *labels: str):
+        """Sets a total counted somewhere else, e.g. in the broker process"""
+        self._values[labels] = value
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{format_labels(self.labelnames, labels)} {value}" for labels, value in self._values.items()]
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Labels, float] = {}
+
+    def set(self, value: float, *labels: str):
+        self._values[labels] = value
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{format_labels(self.labelnames, labels)} {value}" for labels, value in self._values.items()]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self._buckets = tuple(buckets)
+        # labels -> [count per bucket (the last one is +Inf), sum]
+        self._values: Dict[Labels, list] = {}
+
+    def observe(self, value: float, *labels: str):
+        counts = self._values.get(labels)
+        if counts is None:
+            counts = self._values[labels] = [0] * (len(self._buckets) + 1) + [0.0]
+        counts[bisect.bisect_left(self._buckets, value)] += 1
+        counts[-1] += value
+
+    def samples(self) -> List[str]:
+        lines = []
+        for labels, counts in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self._buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+                lines.append(f"{self.name}_bucket{format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, labels)} {counts[-1]}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "".join(metric.render() for metric in self._metrics)
+
+
+REGISTRY = Registry()
+
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "http_request_duration_seconds", "Time to answer HTTP requests, simulated latency included",
+    ("route", "method", "status")))
+PROCESSING_SECONDS = REGISTRY.register(Histogram(
+    "http_request_processing_seconds", "Time to answer HTTP requests without the simulated latency",
+    ("route", "method")))
+IN_FLIGHT = REGISTRY.register(Gauge(
+    "in_flight_requests", "Requests being served, by route with admission control", ("route",)))
+REJECTED_REQUESTS = REGISTRY.register(Counter(
+    "rejected_requests_total", "Requests turned away by admission control", ("route", "reason")))
+SIMULATED_LATENCY_SECONDS = REGISTRY.register(Counter(
+    "simulated_latency_seconds_total", "Simulated latency added to HTTP requests", ("route",)))
+FANOUT_SECONDS = REGISTRY.register(Histogram(
+    "websocket_fanout_duration_seconds", "Time to queue order events for the WebSocket clients",
+    buckets=(0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1)))
+WEBSOCKET_CLIENTS = REGISTRY.register(Gauge("websocket_clients", "Connected WebSocket clients"))
+WEBSOCKET_QUEUED = REGISTRY.register(Gauge(
+    "websocket_queued_messages", "Messages waiting in the WebSocket send queues", ("aggregate",)))
+EVENT_LOOP_LAG_SECONDS = REGISTRY.register(Histogram(
+    "event_loop_lag_seconds", "How late the event loop runs a timer",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1)))
+ORDERS = REGISTRY.register(Gauge("orders", "Orders in the order store, in memory", ("status",)))
+ARCHIVED_ORDERS = REGISTRY.register(Gauge("archived_orders", "Final orders moved from memory to the archive on disk"))
+PINNED_CHUNKS = REGISTRY.register(Gauge(
+    "retention_pinned_chunks", "Chunks of orders past the retention limits kept in memory by a pending order"))
+ORDER_BOOK_DEPTH = REGISTRY.register(Gauge(
+    "order_book_depth", "Limit orders resting in the order books", ("symbol", "side")))
+TRADES = REGISTRY.register(Counter("trades_total", "Trades of the order books", ("symbol",)))
+PENDING_EXECUTIONS = REGISTRY.register(Gauge("pending_executions", "Orders waiting for their execution"))
+REJECTED_ORDERS = REGISTRY.register(Counter(
+    "rejected_orders_total", "Orders rejected because too many orders were waiting for execution"))
+PARKED_REQUESTS = REGISTRY.register(Gauge("parked_wait_requests", "Requests waiting for an order status change"))
+IDEMPOTENCY_KEYS = REGISTRY.register(Gauge("idempotency_keys", "Idempotency keys whose answer is kept for retries"))
+IDEMPOTENCY_LOOKUPS = REGISTRY.register(Counter(
+    "idempotency_lookups_total", "Orders placed with an idempotency key, by whether the key was known", ("result",)))
+SERIALIZED_CACHE = REGISTRY.register(Counter(
+    "serialized_order_cache_lookups_total", "Lookups of serialized orders", ("result",)))
+SERIALIZATION_SECONDS = REGISTRY.register(Counter(
+    "order_serialization_seconds_total", "Time spent serializing orders missing from the cache"))
+INFO = REGISTRY.register(Gauge(
+    "simulation_info", "Simulation settings: latency profiles per route, execution delay, clock and retention",
+    ("setting", "value")))
+
+# Simulated latency of the current request, a one item list so that the handler can add to it
+_simulated_latency: ContextVar[Optional[list]] = ContextVar("simulated_latency", default=None)
+
+
+def add_simulated_latency(route: str, delay: float):
+    SIMULATED_LATENCY_SECONDS.inc(route, amount=delay)
+    spent = _simulated_latency.get()
+    if spent is not None:
+        spent[0] += delay
+
+
+def record_service_stats(stats: dict):
+    """Sets the metrics that come from OrderService.stats()"""
+    for order_status, count in stats["orders"].items():
+        ORDERS.set(count, order_status)
+    for symbol, sides in stats["book_depth"].items():
+        for side, depth in sides.items():
+            ORDER_BOOK_DEPTH.set(depth, symbol, side)
+    for symbol, count in stats["trades"].items():
+        TRADES.set(count, symbol)
+    PENDING_EXECUTIONS.set(stats["pending_executions"])
+    REJECTED_ORDERS.set(stats["rejected_orders"])
+    PARKED_REQUESTS.set(stats["parked_wait_requests"])
+    ARCHIVED_ORDERS.set(stats["archived_orders"])
+    PINNED_CHUNKS.set(stats["pinned_chunks"])
+    IDEMPOTENCY_KEYS.set(stats["idempotency_keys"])
+    for result, count in stats["idempotency_lookups"].items():
+        IDEMPOTENCY_LOOKUPS.set(count, result)
+    SERIALIZED_CACHE.set(stats["serialized_cache_hits"], "hit")
+    SERIALIZED_CACHE.set(stats["serialized_cache_misses"], "miss")
+    SERIALIZATION_SECONDS.set(stats["serialization_seconds"])
+
+
+def record_queue_depths(depths: List[int]):
+    WEBSOCKET_CLIENTS.set(len(depths))
+    WEBSOCKET_QUEUED.set(sum(depths), "total")
+    WEBSOCKET_QUEUED.set(max(depths, default=0), "max")
+
+
+def record_in_flight(in_flight: Dict[str, int]):
+    for route, count in in_flight.items():
+        IN_FLIGHT.set(count, route)
+
+
+class MetricsMiddleware:
+    """ASGI middleware that times every HTTP request by route, method and status code"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status_code = 500
+        simulated = [0.0]
+        _simulated_latency.set(simulated)
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            route, method = route_name(scope), scope["method"]
+            REQUEST_SECONDS.observe(elapsed, route, method, str(status_code))
+            PROCESSING_SECONDS.observe(max(elapsed - simulated[0], 0), route, method)
+
+
+def route_name(scope) -> str:
+    # Routes are named after their handler functions
+    route = scope.get("route")
+    if route is not None:
+        return route.name
+    endpoint = scope.get("endpoint")
+    return getattr(endpoint, "__name__", "unmatched")
+
+
+class EventLoopMonitor:
+    """Measures how late a timer fires every `interval` seconds, which is how long the loop was busy"""
+
+    def __init__(self, interval: float = 0.5):
+        self._interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self._interval
+            await asyncio.sleep(self._interval)
+            EVENT_LOOP_LAG_SECONDS.observe(max(loop.time() - expected, 0))
@@ -1 +1,8 @@
 SUPPORTED_SYMBOLS = ["EURUSD", "USDEUR", "CADUSD", "USDCAD"]
+MAX_PAGE_SIZE = 1000
+EXPORT_CHUNK_SIZE = 1000
+MAX_BATCH_SIZE = 1000
+MAX_QUANTITY = 2 ** 63 - 1  # Quantities are stored as signed 64-bit integers
+SERIALIZED_CACHE_SIZE = 100_000  # Orders whose serialized JSON is kept around, about 150 bytes each
+ORDER_CHUNK_SIZE = 16384  # Consecutive orders per chunk of order columns, the unit of archiving (a power of two)
+MAX_WAIT_TIMEOUT = 300  # Seconds a GET /orders/{order_id}/wait request may be parked
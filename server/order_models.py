@@ -1,17 +1,26 @@
-import asyncio
-import random
-from pydantic import BaseModel, field_validator
+import json
+import math
+import time
+from array import array
+from collections import OrderedDict
+
+from pydantic import BaseModel, Field, field_validator, model_validator
 from enum import Enum, auto
 from datetime import datetime
-from typing import Any
+from typing import Any, Callable, Iterator, List, Literal, Optional, Tuple
 
-from misc import SUPPORTED_SYMBOLS
-from exception_handlers import QuantityValidationError, SymbolValidationError, QuantityTypeValidationError
+from misc import SUPPORTED_SYMBOLS, MAX_BATCH_SIZE, MAX_QUANTITY, SERIALIZED_CACHE_SIZE, ORDER_CHUNK_SIZE
+from exception_handlers import (QuantityValidationError, SymbolValidationError, QuantityTypeValidationError,
+                                StatusValidationError, SideValidationError, PriceValidationError)
 
 
 class CreateOrderRequest(BaseModel):
     symbol: str
     quantity: Any  # Set to Any to allow for validation to be done in the field_validator with custom error messages
+    # Orders with a side go to the symbol's order book, as limit orders with a price or as market orders without.
+    # Orders without one are executed after the simulated execution delay.
+    side: Optional[str] = None
+    price: Any = None
 
     @field_validator("symbol")
     def symbol_must_be_supported(cls, value):
@@ -36,6 +45,68 @@ class CreateOrderRequest(BaseModel):
             raise QuantityValidationError('Quantity must be greater than zero')
         return value
 
+    @field_validator("quantity")
+    def quantity_must_fit(cls, value):
+        if value > MAX_QUANTITY:
+            raise QuantityValidationError(f'Quantity must not exceed {MAX_QUANTITY}')
+        return value
+
+    @field_validator("side")
+    def side_must_be_supported(cls, value):
+        if value is not None and value not in OrderSide.__members__:
+            raise SideValidationError(f'Side: {str(value)} is not supported')
+        return value
+
+    @field_validator("price")
+    def price_must_be_positive(cls, value):
+        if value is None:
+            return value
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not 0 < value < math.inf:
+            raise PriceValidationError('Price must be a positive number')
+        return float(value)
+
+    @model_validator(mode="after")
+    def price_needs_side(self):
+        if self.price is not None and self.side is None:
+            raise PriceValidationError('Price requires a side')
+        return self
+
+
+class CancelOrdersRequest(BaseModel):
+    order_ids: Optional[List[int]] = Field(None, max_length=MAX_BATCH_SIZE)
+    symbol: Optional[str] = None
+
+    @field_validator("symbol")
+    def symbol_must_be_supported(cls, value):
+        if value is not None and value not in SUPPORTED_SYMBOLS:
+            raise SymbolValidationError(f'Symbol: {str(value)} is not supported')
+        return value
+
+
+class SubscriptionRequest(BaseModel):
+    action: Literal["subscribe", "unsubscribe"]
+    order_ids: List[int] = []
+    symbols: List[str] = []
+    statuses: List[str] = []
+
+    @field_validator("symbols")
+    def symbols_must_be_supported(cls, value):
+        for symbol in value:
+            if symbol not in SUPPORTED_SYMBOLS:
+                raise SymbolValidationError(f'Symbol: {str(symbol)} is not supported')
+        return value
+
+    @field_validator("statuses")
+    def statuses_must_be_supported(cls, value):
+        for order_status in value:
+            if order_status not in OrderStatus.__members__:
+                raise StatusValidationError(f'Status: {str(order_status)} is not supported')
+        return value
+
+
+class AdvanceClockRequest(BaseModel):
+    seconds: float = Field(..., gt=0)
+
 
 class OrderStatus(Enum):
     PENDING = auto()
@@ -43,20 +114,173 @@ class OrderStatus(Enum):
     CANCELLED = auto()
 
 
+class OrderSide(Enum):
+    BUY = auto()
+    SELL = auto()
+
+
+# Symbols, statuses and sides are kept as one-byte codes. Status code 0 marks an ID without an order,
+# side code 0 an order without a side.
+SYMBOL_CODES = {symbol: code for code, symbol in enumerate(SUPPORTED_SYMBOLS)}
+STATUS_CODES = (None,) + tuple(OrderStatus)
+SIDE_CODES = (None,) + tuple(OrderSide)
+
+
+# Column typecodes: symbol, status and side codes, quantity, created time, executed time, price, filled quantity
+COLUMN_TYPECODES = "BBqddBdq"
+
+
+class OrderChunk:
+    """Columns of up to ORDER_CHUNK_SIZE consecutive order IDs, and how many of those orders are pending"""
+
+    __slots__ = ("symbols", "statuses", "quantities", "created_times", "executed_times", "sides", "prices", "filled",
+                 "pending")
+
+    def __init__(self, arrays: Optional[List[array]] = None):
+        if arrays is None:
+            arrays = [array(typecode) for typecode in COLUMN_TYPECODES]
+        (self.symbols, self.statuses, self.quantities, self.created_times, self.executed_times, self.sides,
+         self.prices, self.filled) = arrays
+        self.pending = self.statuses.count(OrderStatus.PENDING.value)
+
+    def arrays(self) -> List[array]:
+        return [self.symbols, self.statuses, self.quantities, self.created_times, self.executed_times,
+                self.sides, self.prices, self.filled]
+
+    def __len__(self) -> int:
+        return len(self.statuses)
+
+
+class OrderColumns:
+    """Order data as a struct of arrays, one slot per order ID (order N lives at index N - 1).
+
+    An order takes 43 bytes here instead of a Python object with its own ints, floats and __dict__.
+    A missing executed time or price is stored as NaN. The arrays are split in chunks of
+    `chunk_size` orders, so that old chunks can be dropped (see OrderStore.evict) without moving
+    the others. Order views hold their chunk, a dropped chunk lives on as long as a view of it.
+
+    The serialized JSON of recently used orders is kept in a bounded LRU cache, so an order that is
+    broadcast, returned and polled is encoded once per status instead of on every use.
+    """
+
+    def __init__(self, on_status_change: Optional[Callable[["Order", OrderStatus], None]] = None,
+                 on_fill: Optional[Callable[["Order", int], None]] = None,
+                 serialized_cache_size: int = SERIALIZED_CACHE_SIZE, chunk_size: int = ORDER_CHUNK_SIZE):
+        if chunk_size & (chunk_size - 1):
+            raise ValueError("Chunk size must be a power of two")
+        self.chunk_size = chunk_size
+        self._shift = chunk_size.bit_length() - 1
+        self._mask = chunk_size - 1
+        self.chunks: List[Optional[OrderChunk]] = []
+        self._length = 0
+        self.on_status_change = on_status_change
+        self.on_fill = on_fill
+        self.serialized: "OrderedDict[int, bytes]" = OrderedDict()
+        self.serialized_cache_size = serialized_cache_size
+        self.serialized_hits = 0
+        self.serialized_misses = 0
+        self.serialized_seconds = 0.0
+
+    def append(self, symbol: str, quantity: int, status: OrderStatus, created_time: float,
+               executed_time: Optional[float] = None, side: Optional[OrderSide] = None, price: Optional[float] = None,
+               filled: int = 0):
+        # Check everything up front, a half-appended order would shift every later one
+        symbol_code = SYMBOL_CODES[symbol]
+        if not 0 < quantity <= MAX_QUANTITY:
+            raise ValueError(f"Quantity must be between 1 and {MAX_QUANTITY}")
+        if not 0 <= filled <= quantity:
+            raise ValueError("Filled quantity must be between 0 and the quantity")
+        chunk = self._last_chunk()
+        chunk.symbols.append(symbol_code)
+        chunk.statuses.append(status.value)
+        chunk.quantities.append(quantity)
+        chunk.created_times.append(created_time)
+        chunk.executed_times.append(math.nan if executed_time is None else executed_time)
+        chunk.sides.append(side.value if side is not None else 0)
+        chunk.prices.append(math.nan if price is None else price)
+        chunk.filled.append(filled)
+        chunk.pending += status == OrderStatus.PENDING
+        self._length += 1
+
+    def append_missing(self, count: int):
+        """Reserves IDs that have no order behind them"""
+        while count:
+            chunk = self._last_chunk()
+            missing = min(count, self.chunk_size - len(chunk))
+            for column in chunk.arrays():
+                column.extend(array(column.typecode, bytes(missing * column.itemsize)))
+            self._length += missing
+            count -= missing
+
+    def locate(self, order_id: int) -> Tuple[Optional[OrderChunk], int]:
+        """Chunk of an allocated order ID, None once dropped, and the order's index in it"""
+        index = order_id - 1
+        return self.chunks[index >> self._shift], index & self._mask
+
+    def first_id(self, chunk_number: int) -> int:
+        return (chunk_number << self._shift) + 1
+
+    def drop(self, chunk_number: int) -> OrderChunk:
+        """Forgets a full chunk, its IDs stay allocated"""
+        if chunk_number >= len(self.chunks) - 1:
+            raise ValueError("The last chunk can't be dropped")
+        chunk, self.chunks[chunk_number] = self.chunks[chunk_number], None
+        return chunk
+
+    def live_chunks(self) -> Iterator[Tuple[int, OrderChunk]]:
+        return ((number, chunk) for number, chunk in enumerate(self.chunks) if chunk is not None)
+
+    def dump(self) -> List[array]:
+        """The columns of the chunks in memory end to end, and the numbers of those chunks"""
+        arrays = [array(typecode) for typecode in COLUMN_TYPECODES]
+        numbers = array("q")
+        for number, chunk in self.live_chunks():
+            for target, column in zip(arrays, chunk.arrays()):
+                target.extend(column)
+            numbers.append(number)
+        return arrays + [numbers]
+
+    def load(self, arrays: List[array]):
+        """Replaces every chunk with arrays from dump()"""
+        *columns, numbers = arrays
+        self.chunks = [None] * (numbers[-1] + 1 if numbers else 0)
+        start = 0
+        for number in numbers:
+            end = start + self.chunk_size
+            self.chunks[number] = OrderChunk([column[start:end] for column in columns])
+            start = end
+        self._length = (numbers[-1] << self._shift) + len(self.chunks[-1]) if numbers else 0
+        self.serialized.clear()
+
+    def _last_chunk(self) -> OrderChunk:
+        if self._length == len(self.chunks) << self._shift:
+            self.chunks.append(OrderChunk())
+        return self.chunks[-1]
+
+    def __len__(self) -> int:
+        return self._length
+
+
 class Order:
-    def __init__(self, order_id: int, symbol: str, quantity: int):
-        if quantity <= 0:
-            raise ValueError("Quantity must be greater than zero")
+    """Lightweight view of one order in OrderColumns.
+
+    Views are created on demand and hold no order data themselves, so two views of the same order
+    always agree.
+    """
+
+    __slots__ = ("_columns", "_chunk", "_order_id", "_index")
+
+    def __init__(self, columns: OrderColumns, order_id: int, chunk: Optional[OrderChunk] = None, index: int = 0):
+        self._columns = columns
         self._order_id = order_id
-        self._status = OrderStatus.PENDING
-        self._symbol = symbol
-        self._quantity = quantity
-        self._created_time = datetime.now().timestamp()
-        self._executed_time = None
+        if chunk is None:
+            chunk, index = columns.locate(order_id)
+        self._chunk = chunk
+        self._index = index
 
     @property
     def status(self) -> OrderStatus:
-        return self._status
+        return STATUS_CODES[self._chunk.statuses[self._index]]
 
     @property
     def order_id(self) -> str:
@@ -64,35 +288,100 @@ class Order:
 
     @property
     def symbol(self) -> str:
-        return self._symbol
+        return SUPPORTED_SYMBOLS[self._chunk.symbols[self._index]]
 
     @property
     def quantity(self) -> int:
-        return self._quantity
+        return self._chunk.quantities[self._index]
+
+    @property
+    def created_time(self) -> float:
+        return self._chunk.created_times[self._index]
+
+    @property
+    def executed_time(self) -> Optional[float]:
+        executed_time = self._chunk.executed_times[self._index]
+        return None if math.isnan(executed_time) else executed_time
+
+    @property
+    def side(self) -> Optional[OrderSide]:
+        return SIDE_CODES[self._chunk.sides[self._index]]
+
+    @property
+    def price(self) -> Optional[float]:
+        """Limit price, None for market orders and orders without a side"""
+        price = self._chunk.prices[self._index]
+        return None if math.isnan(price) else price
+
+    @property
+    def filled_quantity(self) -> int:
+        return self._chunk.filled[self._index]
+
+    @property
+    def remaining_quantity(self) -> int:
+        return self._chunk.quantities[self._index] - self._chunk.filled[self._index]
 
     def update_status(self, new_status: OrderStatus):
         if not isinstance(new_status, OrderStatus):
             raise ValueError("Invalid status type")
-        self._status = new_status
+        old_status = self.status
+        self._chunk.statuses[self._index] = new_status.value
+        self._chunk.pending += (new_status == OrderStatus.PENDING) - (old_status == OrderStatus.PENDING)
+        self._columns.serialized.pop(self._order_id, None)
+        if self._columns.on_status_change and old_status != new_status:
+            self._columns.on_status_change(self, old_status)
 
     def get_info(self):
+        side = self.side
         return {
             "order_id": self._order_id,
-            "status": self._status.name,  # Assuming status is an enum
-            "symbol": self._symbol,
-            "quantity": self._quantity,
-            "created_time": self._created_time.isoformat() if hasattr(self._created_time,
-                                                                      'isoformat') else self._created_time,
-            "executed_time": self._executed_time.isoformat() if hasattr(self._executed_time,
-                                                                        'isoformat') else self._executed_time
+            "status": self.status.name,
+            "symbol": self.symbol,
+            "quantity": self.quantity,
+            "created_time": self.created_time,
+            "executed_time": self.executed_time,
+            "side": side.name if side is not None else None,
+            "price": self.price,
+            "filled_quantity": self.filled_quantity
         }
 
+    def to_json(self) -> bytes:
+        """get_info() as compact JSON, cached until the next status change or fill"""
+        cache = self._columns.serialized
+        payload = cache.get(self._order_id)
+        if payload is not None:
+            cache.move_to_end(self._order_id)
+            self._columns.serialized_hits += 1
+            return payload
+        start = time.perf_counter()
+        payload = json.dumps(self.get_info(), separators=(",", ":")).encode()
+        self._columns.serialized_misses += 1
+        self._columns.serialized_seconds += time.perf_counter() - start
+        cache[self._order_id] = payload
+        if len(cache) > self._columns.serialized_cache_size:
+            cache.popitem(last=False)
+        return payload
+
     def __str__(self) -> str:
         return f"Order ID: {self.order_id}, Status: {self.status.name}, Stock: {self.symbol}, Quantity: {self.quantity}"
 
-    async def execute_order(self):
-        await asyncio.sleep(random.uniform(4, 6.0))
-        if self.status == OrderStatus.PENDING:
-            self.update_status(OrderStatus.EXECUTED)
-            self._executed_time = datetime.now().timestamp()
-            return self.get_info()
+    def execute_order(self, executed_time: Optional[float] = None) -> bool:
+        """Executes a pending order in full, returns whether it was pending"""
+        if self.status != OrderStatus.PENDING:
+            return False
+        self._chunk.executed_times[self._index] = (executed_time if executed_time is not None
+                                                     else datetime.now().timestamp())
+        self._chunk.filled[self._index] = self.quantity
+        self.update_status(OrderStatus.EXECUTED)
+        return True
+
+    def fill(self, quantity: int, executed_time: float):
+        """Fills part of a pending order, the fill that completes it executes it"""
+        if self.status != OrderStatus.PENDING or not 0 < quantity <= self.remaining_quantity:
+            raise ValueError(f"Can't fill {quantity} of order {self._order_id}")
+        self._chunk.filled[self._index] += quantity
+        self._columns.serialized.pop(self._order_id, None)
+        if self._columns.on_fill:
+            self._columns.on_fill(self, quantity)
+        if not self.remaining_quantity:
+            self.execute_order(executed_time)
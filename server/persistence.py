@@ -0,0 +1,301 @@
+import asyncio
+import gc
+import glob
+import logging
+import math
+import os
+import struct
+from array import array
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+from database import OrderStore, OrderStoreListener
+from misc import SUPPORTED_SYMBOLS
+from order_models import SIDE_CODES, SYMBOL_CODES, Order, OrderStatus
+
+logger = logging.getLogger(__name__)
+
+# Write-ahead log records. Symbols, statuses and sides are stored as small integer codes.
+CREATE, EXECUTE, CANCEL, CREATE_SIDED, FILL = 1, 2, 3, 4, 5
+CREATE_RECORD = struct.Struct("<BQBqd")  # type, order_id, symbol, quantity, created_time
+EXECUTE_RECORD = struct.Struct("<BQd")  # type, order_id, executed_time
+CANCEL_RECORD = struct.Struct("<BQ")  # type, order_id
+CREATE_SIDED_RECORD = struct.Struct("<BQBqdBd")  # type, order_id, symbol, quantity, created_time, side, price or NaN
+FILL_RECORD = struct.Struct("<BQq")  # type, order_id, filled quantity so far
+RECORDS = {CREATE: CREATE_RECORD, EXECUTE: EXECUTE_RECORD, CANCEL: CANCEL_RECORD, CREATE_SIDED: CREATE_SIDED_RECORD,
+           FILL: FILL_RECORD}
+
+# Snapshots hold the arrays of OrderStore.dump() as they are in memory, in native byte order
+SNAPSHOT_MAGIC = b"ORDSNAP1"
+SNAPSHOT_HEADER = struct.Struct("<8sI")  # magic, array count
+ARRAY_HEADER = struct.Struct("<cQ")  # typecode, length
+
+
+def segment_path(directory: str, kind: str, segment: int) -> str:
+    extension = "log" if kind == "wal" else "bin"
+    return os.path.join(directory, f"{kind}-{segment:08d}.{extension}")
+
+
+def list_segments(directory: str, kind: str) -> List[Tuple[int, str]]:
+    paths = glob.glob(os.path.join(directory, f"{kind}-*.*"))
+    return sorted((int(os.path.basename(path).split("-")[1].split(".")[0]), path) for path in paths)
+
+
+class OrderPersistence(OrderStoreListener):
+    """Write-ahead log of order events with periodic snapshots of the whole store.
+
+    Records are appended to an in-memory buffer and group-committed: a flusher task writes and fsyncs
+    everything buffered every `fsync_interval` seconds, so one fsync covers all orders placed in between.
+    `sync()` waits until everything logged so far is on disk.
+
+    A snapshot starts a new log segment and writes the store's arrays to a binary file as they are;
+    segments and snapshots before it are then deleted. Recovery loads the latest snapshot and replays
+    the segments written after it. Order transitions only go from PENDING to a final status and fill records
+    hold the filled quantity so far, so replaying an event that the snapshot already contains is harmless.
+    """
+
+    def __init__(self, directory: str, fsync_interval: float, snapshot_interval: float):
+        self._directory = directory
+        self._fsync_interval = fsync_interval
+        self._snapshot_interval = snapshot_interval
+        self._store: Optional[OrderStore] = None
+        self._segment = 0
+        self._file: Optional[BinaryIO] = None
+        self._buffer: List[bytes] = []
+        self._appended = 0
+        self._durable = 0
+        self._snapshot_appended = 0
+        self._waiters: List[Tuple[int, asyncio.Future]] = []
+        self._lock: Optional[asyncio.Lock] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def recover(self, store: OrderStore) -> List[Order]:
+        """Loads the persisted orders into the store and returns the ones still pending execution"""
+        os.makedirs(self._directory, exist_ok=True)
+        snapshots = list_segments(self._directory, "snapshot")
+        segments = list_segments(self._directory, "wal")
+        # Orders created in the log are rebuilt as plain rows first: order_id -> [symbol, quantity, status,
+        # created, executed, side, price, filled]. Millions of new objects trigger a lot of pointless garbage collections,
+        # so the collector is off meanwhile.
+        rows: Dict[int, list] = {}
+        base = 0
+        gc.disable()
+        try:
+            if snapshots:
+                base, path = snapshots[-1]
+                store.load(self._load_snapshot(path))
+            for segment, path in segments:
+                if segment >= base:
+                    self._replay_segment(path, store, rows)
+            store.restore_many((order_id, *rows[order_id]) for order_id in sorted(rows))
+        finally:
+            gc.enable()
+        # Never append to a recovered segment, its tail may be torn
+        self._segment = max([base] + [segment for segment, _ in segments]) + 1
+        pending, _ = store.page(status=OrderStatus.PENDING)
+        # A market order is cancelled right after it was matched, a crash in between leaves it pending. It can't rest
+        # in a book without a price, so it's cancelled now, logged once the log is started.
+        for order in pending:
+            if order.side is not None and order.price is None:
+                order.update_status(OrderStatus.CANCELLED)
+                self.order_status_changed(order, OrderStatus.PENDING)
+        pending = [order for order in pending if order.status == OrderStatus.PENDING]
+        logger.info("Recovered %d orders, %d pending", len(store), len(pending))
+        return pending
+
+    def start(self, store: OrderStore):
+        self._store = store
+        self._lock = asyncio.Lock()
+        self._file = open(segment_path(self._directory, "wal", self._segment), "ab")
+        store.add_listener(self)
+        self._tasks = [asyncio.create_task(self._run_flusher()), asyncio.create_task(self._run_snapshots())]
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        async with self._lock:
+            try:
+                await self._flush()
+            finally:
+                self._file.close()
+
+    async def sync(self):
+        target = self._appended
+        if self._durable >= target:
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append((target, waiter))
+        await waiter
+
+    async def snapshot(self):
+        async with self._lock:
+            await self._flush()
+            self._next_segment()
+            arrays = self._store.dump()
+            count = len(self._store)
+            segment = self._segment
+            self._snapshot_appended = self._appended
+        # Events logged while the snapshot is written go to the new segment and are replayed on top of it
+        await asyncio.to_thread(self._write_snapshot, segment, arrays)
+        for kind in ("wal", "snapshot"):
+            for old_segment, path in list_segments(self._directory, kind):
+                if old_segment < segment:
+                    os.remove(path)
+        logger.info("Snapshot of %d orders written", count)
+
+    def order_created(self, order: Order):
+        if order.side is None:
+            self._append(CREATE_RECORD.pack(CREATE, int(order.order_id), SYMBOL_CODES[order.symbol], order.quantity,
+                                            order.created_time))
+        else:
+            price = order.price
+            self._append(CREATE_SIDED_RECORD.pack(CREATE_SIDED, int(order.order_id), SYMBOL_CODES[order.symbol],
+                                                  order.quantity, order.created_time, order.side.value,
+                                                  math.nan if price is None else price))
+
+    def order_filled(self, order: Order, quantity: int):
+        self._append(FILL_RECORD.pack(FILL, int(order.order_id), order.filled_quantity))
+
+    def order_status_changed(self, order: Order, old_status: OrderStatus):
+        if order.status == OrderStatus.EXECUTED:
+            self._append(EXECUTE_RECORD.pack(EXECUTE, int(order.order_id), order.executed_time))
+        elif order.status == OrderStatus.CANCELLED:
+            self._append(CANCEL_RECORD.pack(CANCEL, int(order.order_id)))
+
+    def _append(self, record: bytes):
+        self._buffer.append(record)
+        self._appended += 1
+
+    async def _flush(self):
+        """Writes and fsyncs the buffered records. Records stay buffered until they are on disk, a failed flush
+        is retried by the next one."""
+        if not self._buffer:
+            return
+        count, flushed = len(self._buffer), self._appended
+        write = asyncio.ensure_future(asyncio.to_thread(self._write, self._file, b"".join(self._buffer)))
+        cancelled = False
+        while not write.done():
+            try:
+                await asyncio.wait([write])
+            except asyncio.CancelledError:
+                # The thread can't be stopped, and nothing may touch the file before it is done with it
+                cancelled = True
+        if write.exception() is not None:
+            # The records may be partly written, and after a failed fsync the file can't be trusted anymore. They are
+            # written again to a new segment, a torn tail only ends the replay of its own segment and records replayed
+            # twice are harmless.
+            self._next_segment()
+            raise write.exception()
+        del self._buffer[:count]
+        self._durable = flushed
+        waiting = []
+        for target, waiter in self._waiters:
+            if target <= flushed:
+                if not waiter.done():
+                    waiter.set_result(None)
+            else:
+                waiting.append((target, waiter))
+        self._waiters = waiting
+        if cancelled:
+            raise asyncio.CancelledError()
+
+    def _next_segment(self):
+        """Appends to a new log segment from now on"""
+        file = open(segment_path(self._directory, "wal", self._segment + 1), "ab")
+        try:
+            self._file.close()
+        except OSError:
+            # Flushing what a failed write left behind, those records go to the new segment anyway
+            logger.warning("Failed to close write-ahead log segment %d", self._segment, exc_info=True)
+        self._file = file
+        self._segment += 1
+
+    @staticmethod
+    def _write(file: BinaryIO, data: bytes):
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+
+    async def _run_flusher(self):
+        while True:
+            await asyncio.sleep(self._fsync_interval)
+            try:
+                async with self._lock:
+                    await self._flush()
+            except Exception:
+                logger.exception("Failed to flush the write-ahead log")
+
+    async def _run_snapshots(self):
+        while True:
+            await asyncio.sleep(self._snapshot_interval)
+            if self._appended == self._snapshot_appended:
+                continue
+            try:
+                await self.snapshot()
+            except Exception:
+                logger.exception("Failed to write a snapshot")
+
+    def _write_snapshot(self, segment: int, arrays: List[array]):
+        path = segment_path(self._directory, "snapshot", segment)
+        with open(path + ".tmp", "wb") as file:
+            file.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, len(arrays)))
+            for values in arrays:
+                file.write(ARRAY_HEADER.pack(values.typecode.encode(), len(values)))
+                file.write(values)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(path + ".tmp", path)
+
+    @staticmethod
+    def _load_snapshot(path: str) -> List[array]:
+        with open(path, "rb") as file:
+            magic, count = SNAPSHOT_HEADER.unpack(file.read(SNAPSHOT_HEADER.size))
+            if magic != SNAPSHOT_MAGIC:
+                raise ValueError(f"{path} is not an order snapshot")
+            arrays = []
+            for _ in range(count):
+                typecode, length = ARRAY_HEADER.unpack(file.read(ARRAY_HEADER.size))
+                values = array(typecode.decode())
+                values.fromfile(file, length)
+                arrays.append(values)
+        return arrays
+
+    @staticmethod
+    def _replay_segment(path: str, store: OrderStore, rows: Dict[int, list]):
+        with open(path, "rb") as file:
+            data = file.read()
+        # Orders up to here come from the snapshot, the rest are rebuilt as rows
+        snapshot_last_id = store.last_id
+        offset = 0
+        while offset < len(data):
+            record = RECORDS.get(data[offset])
+            if record is None or offset + record.size > len(data):
+                logger.warning("Write-ahead log %s ends with a torn record at offset %d", path, offset)
+                break
+            fields = record.unpack_from(data, offset)
+            offset += record.size
+            kind, order_id = fields[0], fields[1]
+            row = rows.get(order_id)
+            if kind == CREATE or kind == CREATE_SIDED:
+                if row is None and order_id > snapshot_last_id:
+                    symbol, quantity, created_time = fields[2:5]
+                    side, price = (SIDE_CODES[fields[5]], fields[6]) if kind == CREATE_SIDED else (None, math.nan)
+                    rows[order_id] = [SUPPORTED_SYMBOLS[symbol], quantity, OrderStatus.PENDING, created_time, None,
+                                      side, None if math.isnan(price) else price, 0]
+            elif row is None:
+                # A transition of an order from the snapshot
+                order = store.get(order_id)
+                if order is not None and order.status == OrderStatus.PENDING:
+                    if kind == EXECUTE:
+                        order.execute_order(fields[2])
+                    elif kind == CANCEL:
+                        order.update_status(OrderStatus.CANCELLED)
+                    elif order.filled_quantity < fields[2] < order.quantity:
+                        # The fill that completes an order is followed by its execution record
+                        order.fill(fields[2] - order.filled_quantity, math.nan)
+            elif row[2] == OrderStatus.PENDING:
+                if kind == EXECUTE:
+                    row[2], row[4], row[7] = OrderStatus.EXECUTED, fields[2], row[1]
+                elif kind == CANCEL:
+                    row[2] = OrderStatus.CANCELLED
+                elif fields[2] < row[1]:
+                    row[7] = max(row[7], fields[2])
@@ -0,0 +1,26 @@
+import json
+from typing import Iterable
+
+from fastapi.responses import Response
+
+
+class RawJSONResponse(Response):
+    """Response for content that is already serialized JSON, such as Order.to_json(); it is sent as is"""
+
+    media_type = "application/json"
+
+
+def dumps(content) -> bytes:
+    """JSON encoding used for everything sent to clients, same as JSONResponse"""
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def json_array(items: Iterable[bytes]) -> bytes:
+    return b"[" + b",".join(items) + b"]"
+
+
+def json_object(fields: dict, **raw: bytes) -> bytes:
+    """Serializes `fields`, followed by already serialized values under the keys given as keyword arguments"""
+    body = dumps(fields)
+    raw_fields = b"".join(b',"%s":%s' % (key.encode(), value) for key, value in raw.items())
+    return body[:-1] + raw_fields + b"}" if fields else b"{" + raw_fields[1:] + b"}"
@@ -0,0 +1,90 @@
+import asyncio
+import logging
+import math
+from typing import Callable, Dict, List, Optional
+
+from clock import Clock
+from order_models import Order
+
+logger = logging.getLogger(__name__)
+
+
+class ExecutionScheduler:
+    """Hashed timer wheel that executes pending orders when their execution time comes.
+
+    One driver task advances the wheel every tick and hands all due orders to `on_execute` as a batch,
+    instead of every order keeping its own sleeping coroutine and timer handle. Cancelled orders are
+    removed from their slot right away. Time comes from `clock`, so the wheel turns in virtual time as well.
+    """
+
+    def __init__(self, on_execute: Callable[[List[Order]], None], clock: Clock,
+                 tick: float = 0.05, slots: int = 256):
+        self._on_execute = on_execute
+        self._clock = clock
+        self.tick = tick
+        self._wheel: List[Dict[str, Order]] = [{} for _ in range(slots)]
+        self._deadlines: Dict[str, int] = {}  # order_id -> deadline tick
+        self._last_tick = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._driver: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def __contains__(self, order_id: str) -> bool:
+        return order_id in self._deadlines
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._last_tick = self._current_tick()
+        self._driver = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._driver:
+            self._driver.cancel()
+
+    def schedule(self, order: Order, delay: float):
+        deadline_tick = max(math.ceil((self._clock.monotonic() + delay) / self.tick), self._last_tick + 1)
+        order_id = order.order_id
+        self._deadlines[order_id] = deadline_tick
+        self._wheel[deadline_tick % len(self._wheel)][order_id] = order
+        if self._wakeup:
+            self._wakeup.set()
+
+    def cancel(self, order_id: str) -> bool:
+        deadline_tick = self._deadlines.pop(order_id, None)
+        if deadline_tick is None:
+            return False
+        del self._wheel[deadline_tick % len(self._wheel)][order_id]
+        return True
+
+    def run_due(self):
+        """Execute every order whose deadline has passed. Orders are executed at most one tick late."""
+        current_tick = self._current_tick()
+        # Past one full rotation every slot has been due at least once, there's no point going round again
+        ticks = min(current_tick - self._last_tick, len(self._wheel))
+        due = []
+        for tick in range(current_tick - ticks + 1, current_tick + 1):
+            slot = self._wheel[tick % len(self._wheel)]
+            if not slot:
+                continue
+            for order_id in [order_id for order_id in slot if self._deadlines[order_id] <= current_tick]:
+                del self._deadlines[order_id]
+                due.append(slot.pop(order_id))
+        self._last_tick = max(self._last_tick, current_tick)
+        if due:
+            self._on_execute(due)
+
+    def _current_tick(self) -> int:
+        return math.floor(self._clock.monotonic() / self.tick)
+
+    async def _run(self):
+        while True:
+            if not self._deadlines:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            await self._clock.sleep(self.tick)
+            try:
+                self.run_due()
+            except Exception:
+                logger.exception("Failed to execute due orders")
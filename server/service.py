@@ -0,0 +1,295 @@
+import asyncio
+import os
+from typing import Callable, Dict, List, Optional, Tuple
+
+from fastapi import status
+from fastapi.exceptions import HTTPException
+
+from archive import OrderRetention
+from clock import CLOCK, Clock
+from broadcast import Event, OrderEvent, OrderUpdate, TradeEvent
+from database import OrderStore, OrderStoreListener
+from idempotency import IdempotencyCache
+from latency import LatencyProfile, parse_profile
+from matching import MatchingEngine
+from order_models import Order, OrderSide, OrderStatus
+from persistence import OrderPersistence
+from scheduler import ExecutionScheduler
+from settings import (WAL_DIR, WAL_FSYNC_INTERVAL, WAL_SNAPSHOT_INTERVAL, EXECUTION_DELAY_PROFILE,
+                      MAX_PENDING_EXECUTIONS, RETRY_AFTER, IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_TTL,
+                      RETENTION_MAX_ORDERS, RETENTION_MAX_AGE, RETENTION_INTERVAL)
+
+# Order updates and trades for the WebSocket clients
+Events = List[Event]
+# symbol, quantity, side, price
+NewOrder = Tuple[str, int, Optional[str], Optional[float]]
+
+
+def order_update(order: Order) -> OrderUpdate:
+    return OrderUpdate(int(order.order_id), order.symbol, order.status.name, order.to_json())
+
+
+class OrderWaiters(OrderStoreListener):
+    """Futures of requests parked until an order changes status, resolved right in the status transition"""
+
+    def __init__(self):
+        self._waiters: Dict[int, List[asyncio.Future]] = {}
+
+    def add(self, order: Order) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(int(order.order_id), []).append(future)
+        return future
+
+    def discard(self, order: Order, future: asyncio.Future):
+        futures = self._waiters.get(int(order.order_id))
+        if futures and future in futures:
+            futures.remove(future)
+            if not futures:
+                del self._waiters[int(order.order_id)]
+
+    def order_status_changed(self, order: Order, old_status: OrderStatus):
+        for future in self._waiters.pop(int(order.order_id), ()):
+            if not future.done():
+                future.set_result(order.status)
+
+    def __len__(self) -> int:
+        return sum(len(futures) for futures in self._waiters.values())
+
+
+class OrderService:
+    """Order operations on top of the order store, the order books, the execution scheduler and persistence.
+
+    Orders with a side are matched in their symbol's order book, the others are executed by the scheduler after
+    the simulated execution delay.
+
+    Arguments are plain data and orders come back serialized (Order.to_json), ready to be sent
+    as they are, so the same methods can be served to other processes by the broker (see broker.py).
+    Order updates are handed to `publish_events`.
+    """
+
+    def __init__(self, store: OrderStore, publish_events: Callable[[Events], None],
+                 execution_delay: Optional[LatencyProfile] = None, clock: Optional[Clock] = None):
+        self._store = store
+        self._publish_events = publish_events
+        self.execution_delay = execution_delay or parse_profile(EXECUTION_DELAY_PROFILE)
+        # Orders are rejected while this many are waiting for execution, 0 means no limit
+        self.max_pending_executions = MAX_PENDING_EXECUTIONS
+        self._rejected_orders = 0
+        self._clock = clock or CLOCK
+        self._scheduler = ExecutionScheduler(on_execute=self._execute_orders, clock=self._clock)
+        self._engine = MatchingEngine()
+        self._idempotency = IdempotencyCache(IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_TTL, clock=self._clock)
+        self._waiters = OrderWaiters()
+        store.add_listener(self._waiters)
+        self._persistence = OrderPersistence(WAL_DIR, fsync_interval=WAL_FSYNC_INTERVAL,
+                                             snapshot_interval=WAL_SNAPSHOT_INTERVAL) if WAL_DIR else None
+        # The archive goes along with the write-ahead log, so that recovery finds the orders it holds
+        self._retention = OrderRetention(RETENTION_MAX_ORDERS, RETENTION_MAX_AGE, RETENTION_INTERVAL,
+                                         directory=os.path.join(WAL_DIR, "archive") if WAL_DIR else None,
+                                         clock=self._clock)
+
+    async def start(self):
+        self._scheduler.start()
+        recovered = self._persistence.recover(self._store) if self._persistence else []
+        if self._retention.enabled:
+            self._retention.start(self._store, self._persistence)
+        # Pending orders are executed as if they had just been placed, limit orders go back to their book. Orders of
+        # chunks already archived are final, whatever the log says.
+        for order in recovered:
+            order = self._store.get(order.order_id)
+            if order.status != OrderStatus.PENDING:
+                continue
+            if order.side is not None:
+                self._engine.rest(order)
+            else:
+                self._schedule(order)
+        if self._persistence:
+            self._persistence.start(self._store)
+
+    async def stop(self):
+        self._scheduler.stop()
+        if self._persistence:
+            await self._persistence.close()
+        if self._retention.enabled:
+            await self._retention.close()
+
+    async def create_order(self, symbol: str, quantity: int, side: Optional[str] = None,
+                           price: Optional[float] = None, idempotency_key: Optional[str] = None,
+                           fingerprint: Optional[str] = None) -> bytes:
+        """Places an order. With an idempotency key, the order is only placed by the first request with that key."""
+        if idempotency_key is not None:
+            return await self._idempotency.run(idempotency_key, fingerprint,
+                                               lambda: self._create_order(symbol, quantity, side, price))
+        return await self._create_order(symbol, quantity, side, price)
+
+    async def replay_order(self, idempotency_key: str, fingerprint: str) -> Optional[bytes]:
+        """The order placed by an earlier create_order with this idempotency key, None if there is none"""
+        return await self._idempotency.lookup(idempotency_key, fingerprint)
+
+    async def _create_order(self, symbol: str, quantity: int, side: Optional[str],
+                            price: Optional[float]) -> bytes:
+        if side is None:
+            self._admit(1)
+        order = self._store.create(symbol=symbol, quantity=quantity, side=OrderSide[side] if side else None,
+                                   price=price)
+        events = self._place(order)
+        await self._wait_durable()
+        payload = order.to_json()
+        self._publish_events([OrderEvent([order_update(order)])] + events)
+        return payload
+
+    async def create_orders(self, orders: List[NewOrder]) -> List[bytes]:
+        self._admit(sum(side is None for _, _, side, _ in orders))
+        new_orders = self._store.create_many([(symbol, quantity, OrderSide[side] if side else None, price)
+                                              for symbol, quantity, side, price in orders])
+        events = []
+        for order in new_orders:
+            events += self._place(order)
+        updates = [order_update(order) for order in new_orders]
+        if updates:
+            await self._wait_durable()
+            self._publish_events([OrderEvent(updates, batch=True)] + events)
+        return [update.payload for update in updates]
+
+    async def get_order(self, order_id: str) -> Optional[bytes]:
+        order = self._store.get(order_id)
+        return order.to_json() if order else None
+
+    async def wait_for_order(self, order_id: str, order_status: Optional[str] = None,
+                             timeout: float = 30) -> Optional[bytes]:
+        """Waits until the order has `order_status` or any final status, for at most `timeout` seconds.
+
+        Returns the order as it is then, or None if it doesn't exist. Without a status, waits for any change.
+        """
+        order = self._store.get(order_id)
+        if order is None:
+            return None
+        target = OrderStatus[order_status] if order_status else None
+        # Orders only ever leave PENDING, so there's nothing to wait for once they have
+        if order.status == OrderStatus.PENDING and order.status != target:
+            changed = self._waiters.add(order)
+            # Real time even on the virtual clock, which may never move while the client waits
+            timer = asyncio.ensure_future(asyncio.sleep(timeout))
+            try:
+                await asyncio.wait((changed, timer), return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                timer.cancel()
+                self._waiters.discard(order, changed)
+            await self._wait_durable()
+        return order.to_json()
+
+    async def list_orders(self, cursor: Optional[int] = None, limit: Optional[int] = None,
+                          symbol: Optional[str] = None,
+                          order_status: Optional[str] = None) -> Tuple[List[bytes], Optional[int]]:
+        orders, next_cursor = self._store.page(cursor=cursor, limit=limit, symbol=symbol,
+                                               status=OrderStatus[order_status] if order_status else None)
+        return [order.to_json() for order in orders], next_cursor
+
+    async def cancel_order(self, order_id: str) -> bytes:
+        order = self._cancel(order_id)
+        await self._wait_durable()
+        payload = order.to_json()
+        self._publish_events([OrderEvent([order_update(order)])])
+        return payload
+
+    async def cancel_orders(self, order_ids: Optional[List[str]] = None, symbol: Optional[str] = None) -> List[dict]:
+        """Cancels the given orders, or all pending orders of a symbol.
+
+        Returns one result per order, with the serialized order under "order" or an error under "detail".
+        """
+        if symbol is not None:
+            pending, _ = self._store.page(symbol=symbol, status=OrderStatus.PENDING)
+            order_ids = [order.order_id for order in pending]
+
+        results, cancelled = [], []
+        for order_id in order_ids:
+            try:
+                order = self._cancel(order_id)
+            except HTTPException as exc:
+                results.append({"order_id": int(order_id), "status_code": exc.status_code, "detail": exc.detail})
+                continue
+            cancelled.append(order)
+            results.append({"order_id": int(order_id), "status_code": status.HTTP_200_OK, "order": order.to_json()})
+        if cancelled:
+            await self._wait_durable()
+            self._publish_events([OrderEvent([order_update(order) for order in cancelled], batch=True)])
+        return results
+
+    async def advance_clock(self, seconds: float) -> dict:
+        """Moves the virtual clock forward, executing orders as they become due on the way"""
+        if not self._clock.virtual:
+            raise HTTPException(status_code=409, detail="The server doesn't run on a virtual clock")
+        target = self._clock.monotonic() + seconds
+        # Tick by tick while orders are waiting, so they are executed at their due time rather than at the target
+        while self._scheduler and self._clock.monotonic() < target:
+            self._clock.advance(min(self._scheduler.tick, target - self._clock.monotonic()))
+            self._scheduler.run_due()
+        self._clock.advance(max(target - self._clock.monotonic(), 0))
+        return {"time": self._clock.time()}
+
+    async def order_totals(self) -> dict:
+        """Number of orders and their total quantity by symbol and status, from counters kept by the store"""
+        return {symbol: {order_status.name: {"orders": count, "quantity": quantity}
+                         for order_status, (count, quantity) in totals.items()}
+                for symbol, totals in self._store.totals().items()}
+
+    async def stats(self) -> dict:
+        """Sizes of the order book and the queues behind it, for /metrics"""
+        hits, misses, seconds = self._store.serialization_stats()
+        return {"orders": {order_status.name: self._store.count(order_status) for order_status in OrderStatus},
+                "book_depth": self._engine.depth(),
+                "trades": self._engine.trade_counts(),
+                "pending_executions": len(self._scheduler),
+                "rejected_orders": self._rejected_orders,
+                "parked_wait_requests": len(self._waiters),
+                "archived_orders": len(self._retention.archive) if self._retention.enabled else 0,
+                "pinned_chunks": self._retention.pinned_chunks,
+                "idempotency_keys": len(self._idempotency),
+                "idempotency_lookups": {"hit": self._idempotency.hits, "coalesced": self._idempotency.coalesced,
+                                        "miss": self._idempotency.misses},
+                "serialized_cache_hits": hits,
+                "serialized_cache_misses": misses,
+                "serialization_seconds": seconds}
+
+    def _admit(self, count: int):
+        """Rejects new orders rather than letting the execution backlog grow without bound"""
+        if self.max_pending_executions and len(self._scheduler) + count > self.max_pending_executions:
+            self._rejected_orders += count
+            raise HTTPException(status_code=503, detail="Too many orders are waiting for execution, retry later",
+                                headers={"Retry-After": str(RETRY_AFTER)})
+
+    def _cancel(self, order_id: str) -> Order:
+        order = self._store.get(order_id)
+        if not order:
+            raise HTTPException(status_code=404, detail=f"Order with ID: {order_id} does not exist")
+        if order.status == order.status.EXECUTED:
+            raise HTTPException(status_code=400, detail=f"Order with ID: {order_id} has already been executed")
+        elif order.status == order.status.CANCELLED:
+            raise HTTPException(status_code=400, detail=f"Order with ID: {order_id} has already been canceled")
+        order.update_status(OrderStatus.CANCELLED)
+        self._scheduler.cancel(order.order_id)
+        self._engine.cancel(order)
+        return order
+
+    def _place(self, order: Order) -> Events:
+        """Matches an order with a side in its book, or schedules its execution. Returns the events of its trades."""
+        if order.side is None:
+            self._schedule(order)
+            return []
+        trades, counterparties = self._engine.submit(order, self._clock.time())
+        # Serialized right away, so the updates show each order as the trades left it
+        return ([TradeEvent(trade.symbol, trade.buy_order_id, trade.sell_order_id, trade.to_json()) for trade in trades]
+                + [OrderEvent([order_update(resting)]) for resting in counterparties])
+
+    def _schedule(self, order: Order):
+        self._scheduler.schedule(order, delay=self.execution_delay.sample())
+
+    def _execute_orders(self, orders: List[Order]):
+        # Orders that became due on the same tick are broadcast together
+        executed_time = self._clock.time()
+        self._publish_events([OrderEvent([order_update(order)]) for order in orders
+                              if order.execute_order(executed_time)])
+
+    async def _wait_durable(self):
+        if self._persistence:
+            await self._persistence.sync()
@@ -0,0 +1,63 @@
+import os
+
+INSIDE_DOCKER = os.getenv("INSIDE_DOCKER")
+if not INSIDE_DOCKER:
+    # If we are running the server locally, settings come from the .env file.
+    # If we are running the server inside the docker container, they are already present in the environment.
+    import dotenv
+    dotenv.load_dotenv()
+
+BASE_URL = os.getenv("BASE_URL")
+
+# WebSocket fan-out: size of the per-client send queue and what to do with clients that can't keep up.
+# "coalesce" keeps only the latest update per order while a client is behind, "drop" sends every update and
+# disconnects it right away.
+# Clients whose queue overflows are disconnected under both policies.
+WS_QUEUE_SIZE = int(os.getenv("WS_QUEUE_SIZE", 1024))
+WS_SLOW_CONSUMER_POLICY = os.getenv("WS_SLOW_CONSUMER_POLICY", "coalesce")
+
+# Write-ahead log and snapshots of the order store, orders are only kept in memory unless WAL_DIR is set.
+# Log records are fsynced in batches every WAL_FSYNC_INTERVAL seconds, snapshots are written every
+# WAL_SNAPSHOT_INTERVAL seconds.
+WAL_DIR = os.getenv("WAL_DIR")
+WAL_FSYNC_INTERVAL = float(os.getenv("WAL_FSYNC_INTERVAL", 0.005))
+WAL_SNAPSHOT_INTERVAL = float(os.getenv("WAL_SNAPSHOT_INTERVAL", 300))
+
+# Number of server worker processes. With more than one, the order book lives in a broker process that all
+# workers talk to over the BROKER_SOCKET Unix socket (a temporary path by default).
+WORKERS = int(os.getenv("WORKERS", 1))
+BROKER_SOCKET = os.getenv("BROKER_SOCKET")
+
+# Simulated latency, see latency.py for the profile syntax. LATENCY_PROFILE applies to every HTTP handler unless
+# LATENCY_ROUTE_PROFILES overrides it for some of them, e.g. "create_order=zero;get_orders=fixed:0.05".
+# EXECUTION_DELAY_PROFILE is the time from placing an order to its execution.
+LATENCY_PROFILE = os.getenv("LATENCY_PROFILE", "uniform:0.1,1")
+LATENCY_ROUTE_PROFILES = os.getenv("LATENCY_ROUTE_PROFILES", "")
+EXECUTION_DELAY_PROFILE = os.getenv("EXECUTION_DELAY_PROFILE", "uniform:4,6")
+
+# "real" or "virtual". On a virtual clock time only moves through POST /clock/advance, which executes the orders that
+# became due right away, and HTTP handlers don't simulate latency. Meant for tests and reproducible simulations.
+CLOCK = os.getenv("CLOCK", "real")
+
+# Admission control. MAX_IN_FLIGHT caps the requests every HTTP handler serves at once, MAX_IN_FLIGHT_ROUTES overrides
+# it for some of them, e.g. "create_order=200;get_orders=50". Requests over the limit are answered 429. Orders are
+# answered 503 while MAX_PENDING_EXECUTIONS orders are waiting for execution. 0 means no limit, which is the default.
+# Rejections come with a Retry-After header of RETRY_AFTER seconds. With several workers, in-flight limits are per worker.
+MAX_IN_FLIGHT = int(os.getenv("MAX_IN_FLIGHT", 0))
+MAX_IN_FLIGHT_ROUTES = os.getenv("MAX_IN_FLIGHT_ROUTES", "")
+MAX_PENDING_EXECUTIONS = int(os.getenv("MAX_PENDING_EXECUTIONS", 0))
+RETRY_AFTER = int(os.getenv("RETRY_AFTER", 1))
+
+# Answers to POST /orders requests with an Idempotency-Key header are kept for retries with the same key, for
+# IDEMPOTENCY_TTL seconds after the order was placed and for at most IDEMPOTENCY_CACHE_SIZE keys, least recently
+# used first out.
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", 100_000))
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", 600))
+
+# Retention of final orders. Once every order of a chunk of ORDER_CHUNK_SIZE consecutive orders is executed or
+# cancelled, and the chunk is either older than the newest RETENTION_MAX_ORDERS orders or was created more than
+# RETENTION_MAX_AGE seconds ago, it moves out of memory into an archive on disk, checked every RETENTION_INTERVAL
+# seconds. 0 disables a limit, both are off by default.
+RETENTION_MAX_ORDERS = int(os.getenv("RETENTION_MAX_ORDERS", 0))
+RETENTION_MAX_AGE = float(os.getenv("RETENTION_MAX_AGE", 0))
+RETENTION_INTERVAL = float(os.getenv("RETENTION_INTERVAL", 1))
@@ -1,14 +1,17 @@
+import asyncio
 import os
-import time
 
 import pytest
+import pytest_asyncio
 import logging
 import urllib3
 
 
-from tests.utils.api_client import TradingAPIClient
+from tests.utils.api_client import TradingAPIClient, AsyncTradingAPIClient
 
 SUPPORTED_SYMBOLS = ["EURUSD", "USDEUR", "CADUSD", "USDCAD"]
+# Long enough for any order placed so far to be executed
+EXECUTION_TIMEOUT = 60
 
 
 @pytest.fixture(scope="session", autouse=True)
@@ -24,6 +27,13 @@ def setup_logging():
 def trading_api_client():
     client = TradingAPIClient()
     yield client
+    client.close()
+
+
+@pytest_asyncio.fixture(scope="function")
+async def async_trading_api_client():
+    async with AsyncTradingAPIClient() as client:
+        yield client
 
 
 @pytest.fixture(scope="function")
@@ -33,29 +43,47 @@ def place_order_correct_and_get_id(trading_api_client):
 
 
 @pytest.fixture(scope="function")
-def place_order_wait_for_execution_and_get_id(trading_api_client):
+def advance_clock(trading_api_client):
+    """Executes every order placed so far right away if the server runs on a virtual clock.
+    Returns False on a real clock, orders are then executed in their own time."""
+    def advance() -> bool:
+        return trading_api_client.advance_clock(seconds=EXECUTION_TIMEOUT).status_code == 200
+    return advance
+
+
+@pytest.fixture(scope="function")
+def place_order_wait_for_execution_and_get_id(trading_api_client, advance_clock):
     response = trading_api_client.place_order(symbol="EURUSD", quantity=4)
     if response.status_code != 201:
         logging.error(f"Failed to place order: {response.json()}")
     order_id = response.json()["order_id"]
-    order_status = trading_api_client.get_order_by_id(order_id).json()["status"]
-    while order_status != "EXECUTED":
-        time.sleep(2)
-        response = trading_api_client.get_order_by_id(order_id)
-        if response.status_code != 200:
-            logging.error(f"Failed to get order: {response.json()}")
-        order_status = response.json()["status"]
+    advance_clock()
+    response = trading_api_client.wait_for_order(order_id, status="EXECUTED", timeout=EXECUTION_TIMEOUT)
+    if response.status_code != 200 or response.json()["status"] != "EXECUTED":
+        logging.error(f"Order wasn't executed: {response.json()}")
 
     return order_id
 
 
+def run_async(coroutine):
+    # On a loop of its own, sync fixtures may run while pytest-asyncio has a loop set up
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+async def cancel_pending_orders():
+    # All symbols at once, each bulk cancel takes every pending order of its symbol
+    async with AsyncTradingAPIClient() as client:
+        await asyncio.gather(*(client.cancel_orders(symbol=symbol) for symbol in SUPPORTED_SYMBOLS))
+
+
 @pytest.fixture(scope="function")
-def delete_all_orders(trading_api_client):
+def delete_all_orders():
     yield
-    orders = trading_api_client.get_orders()
-    orders = [x['order_id'] for x in orders.json() if x['status'] == "PENDING"]
-    for order_id in orders:
-        trading_api_client.delete_order(order_id=str(order_id))
+    run_async(cancel_pending_orders())
 
 
 @pytest.fixture(scope="function")
@@ -1,5 +1,10 @@
+import asyncio
+import json
+import uuid
 from http import HTTPStatus
 
+import pytest
+
 
 def test_place_order(trading_api_client, delete_all_orders):
     response = trading_api_client.place_order(quantity=10, symbol="EURUSD")
@@ -24,12 +29,75 @@ def test_place_order_with_negative_quantity(trading_api_client):
     assert response.json()['detail'] == "Quantity must be greater than zero"
 
 
+def test_place_order_with_too_large_quantity(trading_api_client):
+    response = trading_api_client.place_order(quantity=2 ** 63, symbol="EURUSD")
+    assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+    assert response.json()['detail'] == "Quantity must not exceed 9223372036854775807"
+
+
 def test_place_order_with_incorrect_quantity_type(trading_api_client):
     response = trading_api_client.place_order(quantity="10.12", symbol="EURUSD")
     assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
     assert response.json()['detail'] == "Quantity must be an integer"
 
 
+def test_place_order_with_unsupported_side(trading_api_client):
+    response = trading_api_client.place_order(quantity=10, symbol="EURUSD", side="HOLD")
+    assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+    assert response.json()['detail'] == "Side: HOLD is not supported"
+
+
+def test_place_order_with_price_without_side(trading_api_client):
+    response = trading_api_client.place_order(quantity=10, symbol="EURUSD", price=1.5)
+    assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+    assert response.json()['detail'] == "Price requires a side"
+
+
+def test_place_limit_orders_match(trading_api_client, delete_all_orders):
+    sell = trading_api_client.place_order(quantity=10, symbol="USDEUR", side="SELL", price=0.9).json()
+    assert sell['status'] == "PENDING"
+    buy = trading_api_client.place_order(quantity=4, symbol="USDEUR", side="BUY", price=0.95).json()
+    # Filled at the price of the resting order
+    assert buy['status'] == "EXECUTED"
+    assert buy['filled_quantity'] == 4
+    sell = trading_api_client.get_order_by_id(sell['order_id']).json()
+    assert sell['status'] == "PENDING"
+    assert sell['filled_quantity'] == 4
+    # The rest of a market order that finds no more liquidity is cancelled
+    market = trading_api_client.place_order(quantity=10, symbol="USDEUR", side="BUY").json()
+    assert market['status'] == "CANCELLED"
+    assert market['filled_quantity'] == 6
+    assert trading_api_client.get_order_by_id(sell['order_id']).json()['status'] == "EXECUTED"
+
+
+def test_place_order_with_idempotency_key(trading_api_client, delete_all_orders):
+    key = str(uuid.uuid4())
+    first = trading_api_client.place_order(quantity=10, symbol="EURUSD", idempotency_key=key)
+    retry = trading_api_client.place_order(quantity=10, symbol="EURUSD", idempotency_key=key)
+    assert first.status_code == retry.status_code == HTTPStatus.CREATED
+    assert retry.json()['order_id'] == first.json()['order_id']
+    # The same order with its fields in another order and other whitespace
+    reformatted = trading_api_client.session.post(trading_api_client.create_order_url,
+                                                  data=json.dumps({"quantity": 10, "symbol": "EURUSD"}, indent=2),
+                                                  headers={"Content-Type": "application/json", "Idempotency-Key": key})
+    assert reformatted.status_code == HTTPStatus.CREATED
+    assert reformatted.json()['order_id'] == first.json()['order_id']
+    other = trading_api_client.place_order(quantity=11, symbol="EURUSD", idempotency_key=key)
+    assert other.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+    assert other.json()['detail'] == "Idempotency-Key was already used with a different request"
+
+
+@pytest.mark.asyncio
+async def test_place_concurrent_orders_with_same_idempotency_key(async_trading_api_client, delete_all_orders):
+    key = str(uuid.uuid4())
+    responses = await asyncio.gather(*(async_trading_api_client.place_order(quantity=5, symbol="EURUSD",
+                                                                            idempotency_key=key)
+                                       for _ in range(20)))
+    # Duplicates in flight wait for the first request instead of placing orders of their own
+    assert all(response.status_code == HTTPStatus.CREATED for response in responses)
+    assert len({response.json()['order_id'] for response in responses}) == 1
+
+
 def test_get_order_by_id(trading_api_client, place_order_correct_and_get_id):
     order_id = place_order_correct_and_get_id
     response = trading_api_client.get_order_by_id(order_id=order_id)
@@ -70,3 +138,157 @@ def test_delete_executed_order(trading_api_client, place_order_wait_for_executio
 
     assert response.status_code == HTTPStatus.BAD_REQUEST
     assert response.json()['detail'] == f"Order with ID: {order_id} has already been executed"
+
+
+def test_wait_for_order_executed(trading_api_client, advance_clock, place_order_correct_and_get_id):
+    order_id = place_order_correct_and_get_id
+    advance_clock()
+    response = trading_api_client.wait_for_order(order_id, status="EXECUTED", timeout=30)
+    assert response.status_code == HTTPStatus.OK
+    assert response.json()['status'] == "EXECUTED"
+
+
+def test_wait_for_cancelled_order(trading_api_client, place_order_correct_and_get_id):
+    order_id = place_order_correct_and_get_id
+    trading_api_client.delete_order(order_id=order_id)
+    # The order can't be executed anymore, so the request returns right away
+    response = trading_api_client.wait_for_order(order_id, status="EXECUTED", timeout=30)
+    assert response.status_code == HTTPStatus.OK
+    assert response.json()['status'] == "CANCELLED"
+
+
+def test_wait_for_order_timeout(trading_api_client, place_order_correct_and_get_id):
+    order_id = place_order_correct_and_get_id
+    # Orders take longer than that to be executed, and a virtual clock doesn't move at all
+    response = trading_api_client.wait_for_order(order_id, status="EXECUTED", timeout=1)
+    assert response.status_code == HTTPStatus.OK
+    assert response.json()['status'] == "PENDING"
+
+
+def test_wait_for_order_with_incorrect_id(trading_api_client):
+    response = trading_api_client.wait_for_order(999999, status="EXECUTED", timeout=1)
+    assert response.status_code == HTTPStatus.NOT_FOUND
+    assert response.json()['detail'] == "Order with ID: 999999 does not exist"
+
+
+def test_get_orders_paginated(trading_api_client, delete_all_orders):
+    order_ids = [trading_api_client.place_order(quantity=1, symbol="USDCAD").json()['order_id'] for _ in range(3)]
+    first_page = trading_api_client.get_orders(limit=2, cursor=order_ids[0] - 1)
+    assert first_page.status_code == HTTPStatus.OK
+    assert [x['order_id'] for x in first_page.json()] == order_ids[:2]
+    assert first_page.headers['X-Next-Cursor'] == str(order_ids[1])
+    second_page = trading_api_client.get_orders(limit=2, cursor=first_page.headers['X-Next-Cursor'])
+    assert second_page.status_code == HTTPStatus.OK
+    assert second_page.json()[0]['order_id'] == order_ids[2]
+
+
+def test_get_orders_filtered_by_symbol_and_status(trading_api_client, place_order_correct_and_get_id):
+    order_id = place_order_correct_and_get_id
+    trading_api_client.delete_order(order_id=order_id)
+    response = trading_api_client.get_orders(symbol="EURUSD", status="CANCELLED")
+    assert response.status_code == HTTPStatus.OK
+    assert order_id in [x['order_id'] for x in response.json()]
+    assert all(x['symbol'] == "EURUSD" and x['status'] == "CANCELLED" for x in response.json())
+
+
+def test_get_orders_with_unsupported_status(trading_api_client):
+    response = trading_api_client.get_orders(status="FILLED")
+    assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+    assert response.json()['detail'] == "Status: FILLED is not supported"
+
+
+def test_export_orders(trading_api_client, place_order_correct_and_get_id, delete_all_orders):
+    order_id = place_order_correct_and_get_id
+    response = trading_api_client.export_orders(symbol="EURUSD", status="PENDING")
+    assert response.status_code == HTTPStatus.OK
+    assert response.headers['Content-Type'] == "application/x-ndjson"
+    orders = [json.loads(line) for line in response.text.splitlines()]
+    assert order_id in [x['order_id'] for x in orders]
+    assert all(x['symbol'] == "EURUSD" and x['status'] == "PENDING" for x in orders)
+
+
+def test_place_orders_batch(trading_api_client, delete_all_orders):
+    response = trading_api_client.place_orders_batch([{"symbol": "EURUSD", "quantity": 5},
+                                                      {"symbol": "EURUSDD", "quantity": 5},
+                                                      {"symbol": "USDCAD", "quantity": -5}])
+    assert response.status_code == HTTPStatus.OK
+    results = response.json()
+    assert [x['status_code'] for x in results] == [HTTPStatus.CREATED, HTTPStatus.UNPROCESSABLE_ENTITY,
+                                                   HTTPStatus.UNPROCESSABLE_ENTITY]
+    assert results[0]['order']['status'] == "PENDING"
+    assert results[1]['detail'] == "Symbol: EURUSDD is not supported"
+    assert results[2]['detail'] == "Quantity must be greater than zero"
+
+
+def test_cancel_orders_by_id(trading_api_client, place_order_correct_and_get_id):
+    order_id = place_order_correct_and_get_id
+    incorrect_order_id = 999999
+    response = trading_api_client.cancel_orders(order_ids=[order_id, incorrect_order_id])
+    assert response.status_code == HTTPStatus.OK
+    results = response.json()
+    assert results[0]['status_code'] == HTTPStatus.OK
+    assert results[0]['order']['status'] == "CANCELLED"
+    assert results[1]['status_code'] == HTTPStatus.NOT_FOUND
+    assert results[1]['detail'] == f"Order with ID: {incorrect_order_id} does not exist"
+
+
+def test_cancel_orders_by_symbol(trading_api_client):
+    order_ids = [x['order']['order_id'] for x in trading_api_client.place_orders_batch(
+        [{"symbol": "CADUSD", "quantity": 1}] * 3).json()]
+    response = trading_api_client.cancel_orders(symbol="CADUSD")
+    assert response.status_code == HTTPStatus.OK
+    cancelled = [x['order_id'] for x in response.json() if x['order']['status'] == "CANCELLED"]
+    assert set(order_ids) <= set(cancelled)
+
+
+def test_advance_clock(trading_api_client, delete_all_orders):
+    order = trading_api_client.place_order(quantity=10, symbol="EURUSD").json()
+    response = trading_api_client.advance_clock(seconds=60)
+    if response.status_code == HTTPStatus.CONFLICT:
+        # The server runs on the real clock
+        assert response.json()['detail'] == "The server doesn't run on a virtual clock"
+        return
+    assert response.status_code == HTTPStatus.OK
+    executed = trading_api_client.get_order_by_id(order['order_id']).json()
+    assert executed['status'] == "EXECUTED"
+    assert order['created_time'] < executed['executed_time'] <= order['created_time'] + 60
+
+
+def test_metrics(trading_api_client):
+    trading_api_client.place_order(quantity=10, symbol="EURUSD")
+    response = trading_api_client.get_metrics()
+    assert response.status_code == HTTPStatus.OK
+    assert response.headers['content-type'].startswith("text/plain")
+    samples = dict(line.rsplit(" ", 1) for line in response.text.splitlines() if not line.startswith("#"))
+    assert "# TYPE http_request_duration_seconds histogram" in response.text
+    assert int(samples['orders{status="PENDING"}']) + int(samples['orders{status="EXECUTED"}']) >= 1
+    assert 'websocket_queued_messages{aggregate="max"}' in samples
+    assert "pending_executions" in samples
+
+
+def test_get_stats(trading_api_client, delete_all_orders):
+    before = trading_api_client.get_stats().json()['USDCAD']
+    order_id = trading_api_client.place_order(quantity=7, symbol="USDCAD").json()['order_id']
+    response = trading_api_client.get_stats()
+    assert response.status_code == HTTPStatus.OK
+    placed = response.json()['USDCAD']
+    assert placed['PENDING']['orders'] == before['PENDING']['orders'] + 1
+    assert placed['PENDING']['quantity'] == before['PENDING']['quantity'] + 7
+    trading_api_client.delete_order(order_id)
+    cancelled = trading_api_client.get_stats().json()['USDCAD']
+    assert cancelled['PENDING'] == before['PENDING']
+    assert cancelled['CANCELLED']['orders'] == before['CANCELLED']['orders'] + 1
+    assert cancelled['CANCELLED']['quantity'] == before['CANCELLED']['quantity'] + 7
+
+
+@pytest.mark.asyncio
+async def test_place_orders_under_admission_control(async_trading_api_client, delete_all_orders):
+    responses = await asyncio.gather(*(async_trading_api_client.place_order(quantity=1, symbol="EURUSD")
+                                       for _ in range(200)))
+    # Without limits every order is placed, over the limits the server turns requests away right away
+    for response in responses:
+        assert response.status_code in (HTTPStatus.CREATED, HTTPStatus.TOO_MANY_REQUESTS,
+                                        HTTPStatus.SERVICE_UNAVAILABLE)
+        if response.status_code != HTTPStatus.CREATED:
+            assert int(response.headers['Retry-After']) >= 0
+            assert response.json()['detail'].endswith("retry later")
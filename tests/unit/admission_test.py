@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+from fastapi.exceptions import HTTPException
+from starlette.routing import Route, Router
+
+from admission import AdmissionControl, AdmissionMiddleware
+from clock import VirtualClock
+from database import OrderStore
+from service import OrderService
+
+
+def test_admission_control_limits_in_flight_requests():
+    admission = AdmissionControl(1, {"get_orders": 2}, retry_after=1)
+    assert admission.try_acquire("create_order")
+    assert not admission.try_acquire("create_order")
+    # Other routes have limits of their own
+    assert admission.try_acquire("get_orders")
+    assert admission.try_acquire("get_orders")
+    assert not admission.try_acquire("get_orders")
+    admission.release("create_order")
+    assert admission.try_acquire("create_order")
+
+
+async def call(app, path: str):
+    """Status code and headers of a GET request to an ASGI app"""
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    await app({"type": "http", "method": "GET", "path": path, "root_path": "", "headers": [], "query_string": b""},
+              receive, send)
+    return messages[0]["status"], dict(messages[0]["headers"])
+
+
+@pytest.mark.asyncio
+async def test_admission_middleware_rejects_requests_over_the_limit():
+    release = asyncio.Event()
+
+    async def app(scope, receive, send):
+        await release.wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    admission = AdmissionControl(1, {}, retry_after=3)
+    router = Router(routes=[Route("/orders", lambda request: None, name="create_order")])
+    middleware = AdmissionMiddleware(app, admission, router)
+    first = asyncio.ensure_future(call(middleware, "/orders"))
+    await asyncio.sleep(0)
+    status_code, headers = await call(middleware, "/orders")
+    assert status_code == 429
+    assert headers[b"retry-after"] == b"3"
+    release.set()
+    assert (await first)[0] == 200
+    assert admission.in_flight["create_order"] == 0
+    assert (await call(middleware, "/orders"))[0] == 200
+
+
+@pytest.mark.asyncio
+async def test_orders_rejected_over_max_pending_executions():
+    service = OrderService(OrderStore(), publish_events=lambda events: None, clock=VirtualClock())
+    service.max_pending_executions = 2
+    await service.create_order("EURUSD", 1)
+    with pytest.raises(HTTPException) as rejected:
+        await service.create_orders([("EURUSD", 1, None, None)] * 2)
+    assert rejected.value.status_code == 503
+    assert int(rejected.value.headers["Retry-After"]) >= 0
+    await service.create_order("EURUSD", 1)
+    with pytest.raises(HTTPException) as rejected:
+        await service.create_order("EURUSD", 1)
+    assert rejected.value.status_code == 503
+    # Limit orders rest in their book, they don't wait for execution
+    await service.create_order("EURUSD", 1, side="BUY", price=1.0)
+    assert (await service.stats())["rejected_orders"] == 3
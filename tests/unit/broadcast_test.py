@@ -0,0 +1,73 @@
+import asyncio
+import json
+
+import pytest
+
+from broadcast import COALESCE, DROP, BroadcastHub, OrderEvent, OrderUpdate
+
+
+class RecordingWebSocket:
+    """A client that reads what it is sent once `reading` is set"""
+
+    def __init__(self):
+        self.reading = asyncio.Event()
+        self.messages = []
+
+    async def send_text(self, payload: str):
+        await self.reading.wait()
+        self.messages.append(payload)
+
+    async def close(self, code: int):
+        pass
+
+
+class StalledWebSocket:
+    """A client that never reads what it is sent"""
+
+    def __init__(self):
+        self.closed = False
+
+    async def send_text(self, payload: str):
+        await asyncio.Event().wait()
+
+    async def close(self, code: int):
+        self.closed = True
+
+
+def order_event(order_id: int, order_status: str = "PENDING") -> OrderEvent:
+    payload = b'{"order_id":%d,"status":"%s"}' % (order_id, order_status.encode())
+    return OrderEvent([OrderUpdate(order_id, "EURUSD", order_status, payload)])
+
+
+@pytest.mark.asyncio
+async def test_subscribe_after_slow_consumer_was_dropped():
+    hub = BroadcastHub(max_queue_size=1, policy=DROP)
+    websocket = StalledWebSocket()
+    hub.connect(websocket)
+    # The first message is being sent, the second waits in the queue and the third doesn't fit
+    for order_id in range(1, 4):
+        hub.publish(order_event(order_id))
+        await asyncio.sleep(0)
+    assert websocket not in hub
+    assert hub.subscribe(websocket, symbols=["EURUSD"]) is None
+    assert hub.unsubscribe(websocket, symbols=["EURUSD"]) is None
+    await asyncio.sleep(0)
+    assert websocket.closed
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("policy,statuses", [(DROP, ["PENDING", "PENDING", "EXECUTED"]),
+                                             (COALESCE, ["PENDING", "EXECUTED"])], ids=[DROP, COALESCE])
+async def test_updates_of_a_queued_order(policy, statuses):
+    hub = BroadcastHub(max_queue_size=4, policy=policy)
+    websocket = RecordingWebSocket()
+    hub.connect(websocket)
+    # Order 1 is being sent while order 2 is queued and then executed
+    for order_id, order_status in [(1, "PENDING"), (2, "PENDING"), (2, "EXECUTED")]:
+        hub.publish(order_event(order_id, order_status))
+        await asyncio.sleep(0)
+    websocket.reading.set()
+    for _ in range(5):
+        await asyncio.sleep(0)
+    assert websocket in hub
+    assert [json.loads(message)["status"] for message in websocket.messages] == statuses
@@ -0,0 +1,63 @@
+import asyncio
+import json
+
+import pytest
+from fastapi.exceptions import HTTPException
+
+from broker import REQUEST, RESPONSE, OrderBroker, RemoteOrderService, read_frame, write_frame
+
+
+@pytest.mark.asyncio
+async def test_remote_calls_reach_the_broker(tmp_path):
+    path = str(tmp_path / "broker.sock")
+    broker = OrderBroker(path)
+    server = await asyncio.start_unix_server(broker._handle_worker, path=path)
+    events = []
+    remote = RemoteOrderService(path, publish_events=events.extend)
+    await remote.start()
+    try:
+        order = json.loads(await remote.create_order("EURUSD", 5))
+        assert order["status"] == "PENDING"
+        assert json.loads(await remote.get_order(str(order["order_id"]))) == order
+        with pytest.raises(HTTPException) as error:
+            await remote.cancel_order("0")
+        assert error.value.status_code == 404
+        # Order updates come back to every worker
+        for _ in range(100):
+            if events:
+                break
+            await asyncio.sleep(0.01)
+        assert events[0].updates[0].order_id == order["order_id"]
+    finally:
+        await remote.stop()
+        server.close()
+        await server.wait_closed()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("failure", ["reset", "garbage"])
+async def test_calls_in_flight_fail_when_the_connection_breaks(tmp_path, failure):
+    async def handle_worker(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        kind, _ = await read_frame(reader)
+        assert kind == REQUEST
+        if failure == "reset":
+            writer.transport.abort()
+        else:
+            write_frame(writer, RESPONSE, b"not a pickle")
+            await writer.drain()
+
+    path = str(tmp_path / "broker.sock")
+    server = await asyncio.start_unix_server(handle_worker, path=path)
+    remote = RemoteOrderService(path, publish_events=lambda events: None)
+    await remote.start()
+    try:
+        with pytest.raises(HTTPException) as error:
+            await asyncio.wait_for(remote.get_order("1"), timeout=5)
+        assert error.value.status_code == 503
+        # Later calls are turned away right away
+        with pytest.raises(HTTPException):
+            await remote.get_order("1")
+    finally:
+        await remote.stop()
+        server.close()
+        await server.wait_closed()
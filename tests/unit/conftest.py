@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Unit tests import the server modules the way the server does, without a running server
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "server"))
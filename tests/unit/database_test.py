@@ -0,0 +1,37 @@
+import itertools
+
+from database import OrderStore
+from misc import SUPPORTED_SYMBOLS
+from order_models import OrderStatus
+
+
+def new_store() -> OrderStore:
+    """Orders of every symbol, some of them executed or cancelled"""
+    store = OrderStore(chunk_size=4)
+    orders = store.create_many([(SUPPORTED_SYMBOLS[i % len(SUPPORTED_SYMBOLS)], i + 1) for i in range(30)])
+    for order in orders[::3]:
+        order.execute_order(100.0)
+    for order in orders[1::5]:
+        if order.status == OrderStatus.PENDING:
+            order.update_status(OrderStatus.CANCELLED)
+    return store
+
+
+def paged_ids(store: OrderStore, symbol: str, status: OrderStatus) -> list:
+    ids, cursor = [], None
+    while True:
+        orders, cursor = store.page(cursor=cursor, limit=2, symbol=symbol, status=status)
+        ids += [order.order_id for order in orders]
+        if cursor is None:
+            return ids
+
+
+def test_page_filtered_by_symbol_and_status():
+    store = new_store()
+    restored = OrderStore(chunk_size=4)
+    restored.load(store.dump())
+    for symbol, status in itertools.product(SUPPORTED_SYMBOLS, OrderStatus):
+        expected = [order.order_id for order in store.values() if order.symbol == symbol and order.status == status]
+        assert expected
+        assert paged_ids(store, symbol, status) == expected
+        assert paged_ids(restored, symbol, status) == expected
@@ -0,0 +1,32 @@
+import asyncio
+
+import pytest
+
+from idempotency import IdempotencyCache
+
+
+@pytest.mark.asyncio
+async def test_requests_in_flight_are_not_evicted():
+    cache = IdempotencyCache(max_size=1, ttl=600)
+    release = asyncio.Event()
+    calls = []
+
+    async def place(payload: bytes) -> bytes:
+        calls.append(payload)
+        await release.wait()
+        return payload
+
+    first = asyncio.ensure_future(cache.run("first", "a", lambda: place(b"1")))
+    await asyncio.sleep(0)
+    # A newer request would evict the first one as least recently used while it is still in flight
+    second = asyncio.ensure_future(cache.run("second", "b", lambda: place(b"2")))
+    await asyncio.sleep(0)
+    duplicate = asyncio.ensure_future(cache.run("first", "a", lambda: place(b"1")))
+    await asyncio.sleep(0)
+    assert len(cache) == 2
+    release.set()
+    assert await asyncio.gather(first, second, duplicate) == [b"1", b"2", b"1"]
+    assert calls == [b"1", b"2"]
+    assert cache.coalesced == 1
+    # Back to the limit once they are done
+    assert len(cache) == 1
@@ -0,0 +1,126 @@
+import asyncio
+import threading
+
+import pytest
+
+from database import OrderStore
+from order_models import OrderSide, OrderStatus
+from persistence import CREATE, CREATE_RECORD, OrderPersistence, list_segments
+
+
+def new_persistence(directory) -> OrderPersistence:
+    return OrderPersistence(str(directory), fsync_interval=0.001, snapshot_interval=3600)
+
+
+def start_persistence(directory, store: OrderStore) -> OrderPersistence:
+    persistence = new_persistence(directory)
+    persistence.recover(store)
+    persistence.start(store)
+    return persistence
+
+
+def order_infos(store: OrderStore) -> list:
+    return [order.get_info() for order in store.values()]
+
+
+@pytest.mark.asyncio
+async def test_recover_from_snapshot_and_log_with_torn_record(tmp_path):
+    store = OrderStore()
+    persistence = start_persistence(tmp_path, store)
+    executed, cancelled, _ = store.create_many([("EURUSD", 5), ("USDEUR", 6), ("CADUSD", 7)])
+    executed.execute_order(100.0)
+    await persistence.snapshot()
+    # Logged after the snapshot, replayed on top of it
+    cancelled.update_status(OrderStatus.CANCELLED)
+    store.create("USDCAD", 10, OrderSide.SELL, 1.5).fill(4, 101.0)
+    await persistence.sync()
+    await persistence.close()
+    assert len(list_segments(str(tmp_path), "snapshot")) == 1
+    # A crash in the middle of a write leaves part of a record behind
+    _, path = list_segments(str(tmp_path), "wal")[-1]
+    with open(path, "ab") as file:
+        file.write(CREATE_RECORD.pack(CREATE, 5, 0, 1, 102.0)[:-3])
+
+    recovered = OrderStore()
+    pending = new_persistence(tmp_path).recover(recovered)
+    assert order_infos(recovered) == order_infos(store)
+    assert [order.order_id for order in pending] == ["3", "4"]
+    assert recovered.get(5) is None
+
+
+@pytest.mark.asyncio
+async def test_recover_market_order_without_its_cancel_record(tmp_path):
+    store = OrderStore()
+    persistence = start_persistence(tmp_path, store)
+    limit_order = store.create("EURUSD", 5, OrderSide.BUY, 1.5)
+    # Logged before the match that fills it partly and cancels the rest, which didn't reach the log
+    market_order = store.create("EURUSD", 3, OrderSide.SELL)
+    await persistence.sync()
+    await persistence.close()
+
+    recovered = OrderStore()
+    persistence = new_persistence(tmp_path)
+    pending = persistence.recover(recovered)
+    assert [order.order_id for order in pending] == [limit_order.order_id]
+    assert recovered.get(market_order.order_id).status == OrderStatus.CANCELLED
+    persistence.start(recovered)
+    await persistence.close()
+    # The cancellation made on recovery is logged
+    restarted = OrderStore()
+    pending = new_persistence(tmp_path).recover(restarted)
+    assert [order.order_id for order in pending] == [limit_order.order_id]
+    assert restarted.get(market_order.order_id).status == OrderStatus.CANCELLED
+
+
+@pytest.mark.asyncio
+async def test_failed_write_is_retried(tmp_path, monkeypatch):
+    write = OrderPersistence._write
+    failed = []
+
+    def fail_once(file, data: bytes):
+        if not failed:
+            failed.append(data)
+            file.write(data[:5])
+            raise OSError("No space left on device")
+        write(file, data)
+
+    monkeypatch.setattr(OrderPersistence, "_write", staticmethod(fail_once))
+    store = OrderStore()
+    persistence = start_persistence(tmp_path, store)
+    order = store.create("EURUSD", 3)
+    # Only answered once the records are on disk, after the failed write
+    await asyncio.wait_for(persistence.sync(), timeout=5)
+    assert failed
+    await persistence.close()
+
+    recovered = OrderStore()
+    new_persistence(tmp_path).recover(recovered)
+    assert order_infos(recovered) == [order.get_info()]
+
+
+@pytest.mark.asyncio
+async def test_close_waits_for_write_in_progress(tmp_path, monkeypatch):
+    loop = asyncio.get_running_loop()
+    writing, resume = asyncio.Event(), threading.Event()
+    write = OrderPersistence._write
+
+    def slow_write(file, data: bytes):
+        loop.call_soon_threadsafe(writing.set)
+        resume.wait(timeout=5)
+        write(file, data)
+
+    monkeypatch.setattr(OrderPersistence, "_write", staticmethod(slow_write))
+    store = OrderStore()
+    persistence = start_persistence(tmp_path, store)
+    order = store.create("EURUSD", 3)
+    await writing.wait()
+    # The flusher is cancelled in the middle of its write, the file is only closed once the write is over
+    closing = asyncio.ensure_future(persistence.close())
+    await asyncio.sleep(0.05)
+    assert not closing.done()
+    resume.set()
+    await closing
+
+    recovered = OrderStore()
+    new_persistence(tmp_path).recover(recovered)
+    assert order_infos(recovered) == [order.get_info()]
@@ -0,0 +1,138 @@
+import os
+
+import pytest
+
+from archive import CHUNK_ENTRY, INDEX_FILE, OrderArchive, OrderRetention
+from clock import VirtualClock
+from database import OrderStore
+from order_models import OrderSide, OrderStatus
+from persistence import OrderPersistence
+
+CHUNK_SIZE = 4
+
+
+def crash(persistence: OrderPersistence):
+    """Stops the write-ahead log like a crash would, records not flushed yet are lost"""
+    for task in persistence._tasks:
+        task.cancel()
+    persistence._file.close()
+
+
+def new_store(clock: VirtualClock) -> OrderStore:
+    """Orders 1-4 and 5-8 are final, 9 and 10 are pending"""
+    store = OrderStore(clock=clock, chunk_size=CHUNK_SIZE)
+    orders = store.create_many([("EURUSD", quantity) for quantity in range(1, 11)])
+    for order in orders[:8:2]:
+        order.execute_order(clock.time())
+    for order in orders[1:8:2]:
+        order.update_status(OrderStatus.CANCELLED)
+    return store
+
+
+@pytest.mark.asyncio
+async def test_archive_orders_past_max_orders(tmp_path):
+    clock = VirtualClock(start=1000)
+    store = new_store(clock)
+    infos = {order_id: store.get(order_id).get_info() for order_id in range(1, 11)}
+    totals = store.totals()
+    retention = OrderRetention(max_orders=2, max_age=0, interval=3600, directory=str(tmp_path), clock=clock)
+    retention.start(store)
+    # 5-8 are followed by 2 orders, 1-4 by 6
+    assert await retention.evict() == CHUNK_SIZE * 2
+    assert len(retention.archive) == CHUNK_SIZE * 2
+    assert len(store) == 2
+    # Still found by ID and counted, but no longer listed
+    assert {order_id: store.get(order_id).get_info() for order_id in range(1, 11)} == infos
+    assert [order.order_id for order in store.values()] == ["9", "10"]
+    assert store.page(symbol="EURUSD", status=OrderStatus.EXECUTED) == ([], None)
+    assert store.totals() == totals
+    await retention.close()
+
+
+@pytest.mark.asyncio
+async def test_archive_orders_past_max_age(tmp_path):
+    clock = VirtualClock(start=1000)
+    store = new_store(clock)
+    retention = OrderRetention(max_orders=0, max_age=60, interval=3600, directory=str(tmp_path), clock=clock)
+    retention.start(store)
+    assert await retention.evict() == 0
+    clock.advance(60)
+    assert await retention.evict() == CHUNK_SIZE * 2
+    await retention.close()
+
+
+@pytest.mark.asyncio
+async def test_pending_order_pins_its_chunk(tmp_path):
+    clock = VirtualClock(start=1000)
+    store = new_store(clock)
+    resting = store.create("USDEUR", 5, OrderSide.SELL, 1.5)
+    store.create_many([("USDEUR", 1)] * CHUNK_SIZE * 2)
+    retention = OrderRetention(max_orders=1, max_age=0, interval=3600, directory=str(tmp_path), clock=clock)
+    retention.start(store)
+    await retention.evict()
+    # 9-12 hold the resting order 11, 13-16 market orders still waiting for execution, 17-19 is the last chunk
+    assert len(retention.archive) == CHUNK_SIZE * 2
+    assert retention.pinned_chunks == 2
+    assert store.get(resting.order_id).status == OrderStatus.PENDING
+    await retention.close()
+
+
+@pytest.mark.asyncio
+async def test_archive_survives_restart(tmp_path):
+    clock = VirtualClock(start=1000)
+    store = new_store(clock)
+    # As a snapshot taken before the chunks were archived, or the write-ahead log, would bring them back
+    arrays = store.dump()
+    retention = OrderRetention(max_orders=2, max_age=0, interval=3600, directory=str(tmp_path), clock=clock)
+    retention.start(store)
+    await retention.evict()
+    infos = [store.get(order_id).get_info() for order_id in range(1, 11)]
+    totals = store.totals()
+    await retention.close()
+    # Half an index entry, as a crash while archiving the next chunk would leave behind
+    with open(os.path.join(tmp_path, INDEX_FILE), "ab") as file:
+        file.write(bytes(CHUNK_ENTRY.size // 2))
+
+    recovered = OrderStore(clock=clock, chunk_size=CHUNK_SIZE)
+    recovered.load(arrays)
+    archive = OrderArchive(str(tmp_path))
+    assert archive.chunks == 2
+    recovered.attach_archive(archive)
+    assert len(recovered) == 2
+    assert [recovered.get(order_id).get_info() for order_id in range(1, 11)] == infos
+    assert recovered.totals() == totals
+    archive.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("logged", [True, False], ids=["synced", "not-synced"])
+async def test_archive_after_crash_before_log_fsync(tmp_path, logged):
+    clock = VirtualClock(start=1000)
+    store = OrderStore(clock=clock, chunk_size=CHUNK_SIZE)
+    persistence = OrderPersistence(str(tmp_path / "wal"), fsync_interval=0.01 if logged else 3600,
+                                   snapshot_interval=3600)
+    persistence.recover(store)
+    persistence.start(store)
+    orders = store.create_many([("EURUSD", quantity) for quantity in range(1, 11)])
+    await persistence.snapshot()
+    for order in orders[:8]:
+        order.execute_order(clock.time())
+    retention = OrderRetention(max_orders=2, max_age=0, interval=3600, directory=str(tmp_path / "archive"),
+                               clock=clock)
+    # Without the log, as an archive written before the executions were on disk, which the log then lost
+    retention.start(store, persistence if logged else None)
+    assert await retention.evict() == CHUNK_SIZE * 2
+    crash(persistence)
+    await retention.close()
+
+    recovered = OrderStore(clock=clock, chunk_size=CHUNK_SIZE)
+    pending = OrderPersistence(str(tmp_path / "wal"), fsync_interval=0.01, snapshot_interval=3600).recover(recovered)
+    assert len(pending) == (2 if logged else 10)
+    retention = OrderRetention(max_orders=2, max_age=0, interval=3600, directory=str(tmp_path / "archive"),
+                               clock=clock)
+    retention.start(recovered)
+    assert [recovered.get(order_id).status for order_id in range(1, 11)] == [OrderStatus.EXECUTED] * 8 + [
+        OrderStatus.PENDING] * 2
+    assert [order.order_id for order in recovered.page(status=OrderStatus.PENDING)[0]] == ["9", "10"]
+    assert recovered.totals()["EURUSD"][OrderStatus.PENDING] == (2, 19)
+    await retention.close()
@@ -1,12 +1,19 @@
-from typing import Union
+from typing import List, Optional, Union
+import asyncio
 import logging
+import aiohttp
 import requests
 
-from tests.utils.custom_requests import post_request, get_request, delete_request, options_request
+from tests.utils.custom_requests import (post_request, get_request, delete_request, options_request, new_session,
+                                         async_request, AsyncResponse)
 import os
 
 
-class TradingAPIClient:
+def without_none(values: dict) -> dict:
+    return {k: v for k, v in values.items() if v is not None}
+
+
+class BaseTradingAPIClient:
     def __init__(self):
         if not os.getenv("INSIDE_DOCKER"):
             # If we are running the tests locally, we need to load the .env file.
@@ -16,20 +23,125 @@ class TradingAPIClient:
         self.base_url = os.getenv("BASE_URL")
         self.create_order_url = f"{self.base_url}/orders"
         self.get_del_order = f"{self.base_url}/orders/ORDER_ID"
+        self.wait_order_url = f"{self.base_url}/orders/ORDER_ID/wait"
+        self.export_orders_url = f"{self.base_url}/orders/export"
+        self.batch_orders_url = f"{self.base_url}/orders/batch"
+        self.cancel_orders_url = f"{self.base_url}/orders/cancel"
+        self.advance_clock_url = f"{self.base_url}/clock/advance"
+        self.metrics_url = f"{self.base_url}/metrics"
+        self.stats_url = f"{self.base_url}/stats"
         self.ws_url = f"{self.base_url}/ws"
 
-    def place_order(self, quantity: int, symbol: str) -> requests.Response:
-        return post_request(url=self.create_order_url, json={"symbol": symbol, "quantity": quantity}, verify=False)
+    def order_url(self, url: str, order_id: Union[int, str]) -> str:
+        return url.replace("ORDER_ID", str(order_id))
+
+
+class TradingAPIClient(BaseTradingAPIClient):
+    """Sends requests one at a time over pooled keep-alive connections, safe to share between threads"""
+
+    def __init__(self, session: Optional[requests.Session] = None):
+        super().__init__()
+        self.session = session or new_session()
+
+    def close(self):
+        self.session.close()
+
+    def place_order(self, quantity: int, symbol: str, side: str = None, price: float = None,
+                    idempotency_key: str = None) -> requests.Response:
+        order = without_none({"symbol": symbol, "quantity": quantity, "side": side, "price": price})
+        return post_request(url=self.create_order_url, json=order, verify=False, session=self.session,
+                            headers=without_none({"Idempotency-Key": idempotency_key}))
+
+    def place_orders_batch(self, orders: List[dict]) -> requests.Response:
+        return post_request(url=self.batch_orders_url, json=orders, verify=False, session=self.session)
 
-    def get_orders(self) -> requests.Response:
-        return get_request(url=self.create_order_url, verify=False)
+    def cancel_orders(self, order_ids: List[Union[int, str]] = None, symbol: str = None) -> requests.Response:
+        return post_request(url=self.cancel_orders_url, json=without_none({"order_ids": order_ids, "symbol": symbol}),
+                            verify=False, session=self.session)
+
+    def get_orders(self, symbol: str = None, status: str = None, limit: int = None,
+                   cursor: Union[int, str] = None) -> requests.Response:
+        params = {"symbol": symbol, "status": status, "limit": limit, "cursor": cursor}
+        return get_request(url=self.create_order_url, params=without_none(params), verify=False, session=self.session)
+
+    def export_orders(self, symbol: str = None, status: str = None) -> requests.Response:
+        params = {"symbol": symbol, "status": status}
+        return get_request(url=self.export_orders_url, params=without_none(params), verify=False, session=self.session)
+
+    def advance_clock(self, seconds: float) -> requests.Response:
+        return post_request(url=self.advance_clock_url, json={"seconds": seconds}, verify=False, session=self.session)
+
+    def get_metrics(self) -> requests.Response:
+        return get_request(url=self.metrics_url, session=self.session)
+
+    def get_stats(self) -> requests.Response:
+        return get_request(url=self.stats_url, session=self.session)
 
     def get_order_by_id(self, order_id: Union[int, str]) -> requests.Response:
-        if isinstance(order_id, int):
-            order_id = str(order_id)
-        return get_request(url=self.get_del_order.replace("ORDER_ID", order_id))
+        return get_request(url=self.order_url(self.get_del_order, order_id), session=self.session)
+
+    def wait_for_order(self, order_id: Union[int, str], status: str = None, timeout: float = None) -> requests.Response:
+        params = {"status": status, "timeout": timeout}
+        return get_request(url=self.order_url(self.wait_order_url, order_id), params=without_none(params),
+                           verify=False, session=self.session)
 
     def delete_order(self, order_id: Union[int, str]) -> requests.Response:
-        if isinstance(order_id, int):
-            order_id = str(order_id)
-        return delete_request(url=self.get_del_order.replace("ORDER_ID", order_id))
+        return delete_request(url=self.order_url(self.get_del_order, order_id), session=self.session)
+
+
+class AsyncTradingAPIClient(BaseTradingAPIClient):
+    """Async client for bulk operations, e.g. `await asyncio.gather(*(client.place_order(...) for ...))`.
+
+    At most `max_concurrency` requests are in flight at once, the others wait for their turn. Use it as
+    `async with AsyncTradingAPIClient() as client:`, its connections belong to the running event loop.
+    """
+
+    def __init__(self, max_concurrency: int = 50):
+        super().__init__()
+        self.max_concurrency = max_concurrency
+        self.session: Optional[aiohttp.ClientSession] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def __aenter__(self) -> "AsyncTradingAPIClient":
+        self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.max_concurrency))
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    async def place_order(self, quantity: int, symbol: str, side: str = None, price: float = None,
+                          idempotency_key: str = None) -> AsyncResponse:
+        order = without_none({"symbol": symbol, "quantity": quantity, "side": side, "price": price})
+        return await self._request("POST", self.create_order_url, json=order,
+                                   headers=without_none({"Idempotency-Key": idempotency_key}))
+
+    async def place_orders_batch(self, orders: List[dict]) -> AsyncResponse:
+        return await self._request("POST", self.batch_orders_url, json=orders)
+
+    async def cancel_orders(self, order_ids: List[Union[int, str]] = None, symbol: str = None) -> AsyncResponse:
+        return await self._request("POST", self.cancel_orders_url,
+                                   json=without_none({"order_ids": order_ids, "symbol": symbol}))
+
+    async def get_orders(self, symbol: str = None, status: str = None, limit: int = None,
+                         cursor: Union[int, str] = None) -> AsyncResponse:
+        params = {"symbol": symbol, "status": status, "limit": limit, "cursor": cursor}
+        return await self._request("GET", self.create_order_url, params=without_none(params))
+
+    async def advance_clock(self, seconds: float) -> AsyncResponse:
+        return await self._request("POST", self.advance_clock_url, json={"seconds": seconds})
+
+    async def get_order_by_id(self, order_id: Union[int, str]) -> AsyncResponse:
+        return await self._request("GET", self.order_url(self.get_del_order, order_id))
+
+    async def wait_for_order(self, order_id: Union[int, str], status: str = None,
+                             timeout: float = None) -> AsyncResponse:
+        params = {"status": status, "timeout": timeout}
+        return await self._request("GET", self.order_url(self.wait_order_url, order_id), params=without_none(params))
+
+    async def delete_order(self, order_id: Union[int, str]) -> AsyncResponse:
+        return await self._request("DELETE", self.order_url(self.get_del_order, order_id))
+
+    async def _request(self, method: str, url: str, json=None, params=None, headers=None) -> AsyncResponse:
+        return await async_request(self.session, self._semaphore, method, url, json=json, params=params,
+                                   headers=headers)
@@ -1,7 +1,12 @@
+import asyncio
+import functools
+import json as json_module
 import logging
 
+import aiohttp
 import requests
 import urllib3
+from requests.adapters import HTTPAdapter
 from typing import Callable
 
 
@@ -11,18 +16,43 @@ urllib3_logger.setLevel(logging.ERROR)
 
 logger = logging.getLogger(__name__)
 
+# Keep-alive connections per session, enough for the tests that send requests from many threads
+POOL_SIZE = 32
+
+
+def new_session(pool_size: int = POOL_SIZE) -> requests.Session:
+    """Session that reuses its connections instead of opening one per request"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+# Used by the request functions below unless they are given a session
+SESSION = new_session()
+
+
+def log_exchange(url, method, request_headers, request_body, status_code, response_headers, response_body):
+    # Bodies are only decoded when debug logging is on
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    logger.debug("Request URL: %s", url)
+    logger.debug("Request Method: %s", method)
+    logger.debug("Request Headers: %s", request_headers)
+    logger.debug("Request Body: %s", request_body)
+    logger.debug("Response Status Code: %s", status_code)
+    logger.debug("Response Headers: %s", response_headers)
+    logger.debug("Response Body: %s", response_body() if callable(response_body) else response_body)
+
 
 def log_request_response_info(func: Callable):
 
+    @functools.wraps(func)
     def wrapper(*args, **kwargs):
         response: requests.Response = func(*args, **kwargs)
-        logger.debug(f"Request URL: {response.url}")
-        logger.debug(f"Request Method: {response.request.method}")
-        logger.debug(f"Request Headers: {response.request.headers}")
-        logger.debug(f"Request Body: {response.request.body}")
-        logger.debug(f"Response Status Code: {response.status_code}")
-        logger.debug(f"Response Headers: {response.headers}")
-        logger.debug(f"Response Body: {response.text}")
+        log_exchange(response.url, response.request.method, response.request.headers, response.request.body,
+                     response.status_code, response.headers, lambda: response.text)
 
         return response
 
@@ -30,25 +60,58 @@ def log_request_response_info(func: Callable):
 
 
 @log_request_response_info
-def get_request(url, headers=None, cookies=None, json=None, data=None, verify=False):
-    return requests.get(url=url, headers=headers, cookies=cookies, json=json, data=data, verify=verify)
+def get_request(url, headers=None, cookies=None, json=None, data=None, params=None, verify=False, session=None):
+    return (session or SESSION).get(url=url, headers=headers, cookies=cookies, json=json, data=data, params=params,
+                                    verify=verify)
 
 
 @log_request_response_info
-def post_request(url, headers=None, cookies=None, json=None, data=None, verify=False):
-    return requests.post(url=url, headers=headers, cookies=cookies, json=json, data=data, verify=verify)
+def post_request(url, headers=None, cookies=None, json=None, data=None, params=None, verify=False, session=None):
+    return (session or SESSION).post(url=url, headers=headers, cookies=cookies, json=json, data=data, params=params,
+                                     verify=verify)
 
 
 @log_request_response_info
-def delete_request(url, headers=None, cookies=None, json=None, data=None, verify=False):
-    return requests.delete(url=url, headers=headers, cookies=cookies, json=json, data=data, verify=verify)
+def delete_request(url, headers=None, cookies=None, json=None, data=None, params=None, verify=False, session=None):
+    return (session or SESSION).delete(url=url, headers=headers, cookies=cookies, json=json, data=data, params=params,
+                                       verify=verify)
 
 
 @log_request_response_info
-def put_request(url, headers=None, cookies=None, json=None, data=None, verify=False):
-    return requests.put(url=url, headers=headers, cookies=cookies, json=json, data=data, verify=verify)
+def put_request(url, headers=None, cookies=None, json=None, data=None, params=None, verify=False, session=None):
+    return (session or SESSION).put(url=url, headers=headers, cookies=cookies, json=json, data=data, params=params,
+                                    verify=verify)
 
 
 @log_request_response_info
-def options_request(url, headers=None, cookies=None, json=None, data=None, verify=False):
-    return requests.options(url=url, headers=headers, cookies=cookies, json=json, data=data, verify=verify)
+def options_request(url, headers=None, cookies=None, json=None, data=None, params=None, verify=False, session=None):
+    return (session or SESSION).options(url=url, headers=headers, cookies=cookies, json=json, data=data,
+                                        params=params, verify=verify)
+
+
+class AsyncResponse:
+    """Response of an async request, read in full, with the parts of requests.Response the tests use"""
+
+    def __init__(self, url: str, status_code: int, headers, content: bytes):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self) -> str:
+        return self.content.decode()
+
+    def json(self):
+        return json_module.loads(self.content)
+
+
+async def async_request(session: aiohttp.ClientSession, semaphore: asyncio.Semaphore, method: str, url: str,
+                        json=None, params=None, headers=None) -> AsyncResponse:
+    """Sends a request once the semaphore lets it, so bulk operations never have more than a few in flight"""
+    async with semaphore:
+        async with session.request(method, url, json=json, params=params, headers=headers) as response:
+            content = await response.read()
+    log_exchange(str(response.url), method, response.request_info.headers, json, response.status, response.headers,
+                 lambda: content.decode(errors="replace"))
+    return AsyncResponse(str(response.url), response.status, response.headers, content)
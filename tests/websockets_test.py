@@ -19,11 +19,12 @@ async def test_websocket_order_placed(ws_url, trading_api_client, delete_all_ord
 
 
 @pytest.mark.asyncio
-async def test_websocket_order_executed(ws_url, trading_api_client, delete_all_orders):
+async def test_websocket_order_executed(ws_url, trading_api_client, advance_clock, delete_all_orders):
     async with ClientSession() as session:
         async with session.ws_connect(url=ws_url) as ws_client:
             response = trading_api_client.place_order(quantity=10, symbol="EURUSD")
             assert response.status_code == HTTPStatus.CREATED
+            advance_clock()
             async for message in ws_client:
                 order_info = json.loads(message.data)
                 assert order_info['order_id'] == response.json()['order_id']
@@ -44,3 +45,81 @@ async def test_websocket_order_canceled(ws_url, trading_api_client, place_order_
                 if order_info['status'] == "CANCELLED":
                     await ws_client.close()
                     break
+
+
+@pytest.mark.asyncio
+async def test_websocket_order_placed_multiple_subscribers(ws_url, trading_api_client, delete_all_orders):
+    async with ClientSession() as session:
+        ws_clients = [await session.ws_connect(url=ws_url) for _ in range(5)]
+        response = trading_api_client.place_order(quantity=10, symbol="EURUSD")
+        assert response.status_code == HTTPStatus.CREATED
+        for ws_client in ws_clients:
+            order_info = json.loads((await ws_client.receive(timeout=5)).data)
+            assert order_info['order_id'] == response.json()['order_id']
+            assert order_info['status'] == "PENDING"
+            await ws_client.close()
+
+
+@pytest.mark.asyncio
+async def test_websocket_orders_batch_placed(ws_url, trading_api_client, delete_all_orders):
+    async with ClientSession() as session:
+        async with session.ws_connect(url=ws_url) as ws_client:
+            response = trading_api_client.place_orders_batch([{"symbol": "EURUSD", "quantity": 1}] * 3)
+            assert response.status_code == HTTPStatus.OK
+            orders = json.loads((await ws_client.receive(timeout=5)).data)
+            assert [x['order_id'] for x in orders] == [x['order']['order_id'] for x in response.json()]
+            await ws_client.close()
+
+
+@pytest.mark.asyncio
+async def test_websocket_subscribe_to_symbol(ws_url, trading_api_client, delete_all_orders):
+    async with ClientSession() as session:
+        async with session.ws_connect(url=ws_url) as ws_client:
+            await ws_client.send_json({"action": "subscribe", "symbols": ["USDCAD"]})
+            ack = json.loads((await ws_client.receive(timeout=5)).data)
+            assert ack['subscription']['symbols'] == ["USDCAD"]
+            trading_api_client.place_order(quantity=10, symbol="EURUSD")
+            response = trading_api_client.place_order(quantity=10, symbol="USDCAD")
+            order_info = json.loads((await ws_client.receive(timeout=5)).data)
+            assert order_info['order_id'] == response.json()['order_id']
+            assert order_info['symbol'] == "USDCAD"
+
+
+@pytest.mark.asyncio
+async def test_websocket_subscribe_to_order_ids_filters_batch(ws_url, trading_api_client, delete_all_orders):
+    results = trading_api_client.place_orders_batch([{"symbol": "EURUSD", "quantity": 1}] * 3).json()
+    order_ids = [x['order']['order_id'] for x in results]
+    async with ClientSession() as session:
+        async with session.ws_connect(url=ws_url) as ws_client:
+            await ws_client.send_json({"action": "subscribe", "order_ids": order_ids[:2]})
+            await ws_client.receive(timeout=5)  # subscription acknowledgement
+            trading_api_client.cancel_orders(order_ids=order_ids)
+            orders = json.loads((await ws_client.receive(timeout=5)).data)
+            assert [x['order_id'] for x in orders] == order_ids[:2]
+            assert all(x['status'] == "CANCELLED" for x in orders)
+
+
+@pytest.mark.asyncio
+async def test_websocket_subscribe_with_unsupported_symbol(ws_url):
+    async with ClientSession() as session:
+        async with session.ws_connect(url=ws_url) as ws_client:
+            await ws_client.send_json({"action": "subscribe", "symbols": ["XXXYYY"]})
+            message = json.loads((await ws_client.receive(timeout=5)).data)
+            assert message['error'] == "Symbol: XXXYYY is not supported"
+
+
+@pytest.mark.asyncio
+async def test_websocket_trade(ws_url, trading_api_client, delete_all_orders):
+    sell = trading_api_client.place_order(quantity=5, symbol="CADUSD", side="SELL", price=0.7).json()
+    async with ClientSession() as session:
+        async with session.ws_connect(url=ws_url) as ws_client:
+            await ws_client.send_json({"action": "subscribe", "order_ids": [sell['order_id']]})
+            await ws_client.receive(timeout=5)  # subscription acknowledgement
+            buy = trading_api_client.place_order(quantity=5, symbol="CADUSD", side="BUY", price=0.8).json()
+            trade = json.loads((await ws_client.receive(timeout=5)).data)
+            assert trade['type'] == "trade"
+            assert (trade['buy_order_id'], trade['sell_order_id']) == (buy['order_id'], sell['order_id'])
+            assert (trade['price'], trade['quantity']) == (0.7, 5)
+            order_info = json.loads((await ws_client.receive(timeout=5)).data)
+            assert order_info['order_id'] == sell['order_id']
+            assert order_info['status'] == "EXECUTED"